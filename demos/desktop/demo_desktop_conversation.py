@@ -1,7 +1,6 @@
 # Import basic preliminaries
 from sic_framework.core.sic_application import SICApplication
 from sic_framework.core import sic_logging
-from sic_framework.core import utils_cv2
 
 # Import the device(s) we will be using
 from sic_framework.devices.desktop import Desktop
@@ -29,7 +28,6 @@ from sic_framework.services.dialogflow.dialogflow import (
     DialogflowConf,
     GetIntentRequest,
 )
-from sic_framework.services.openai_gpt.gpt import GPT, GPTConf, GPTRequest
 
 # Import libraries necessary for the demo
 from time import sleep
@@ -40,9 +38,11 @@ import threading
 from os.path import abspath, join
 from subprocess import call
 from dotenv import load_dotenv
-import cv2
 import numpy as np
 
+# OpenCV (kiosk face display only) and the GPT service are imported where they are used,
+# so importing this demo does not pay for them. Use utils/import_profiler.py to check.
+
 
 class ConversationApp(SICApplication):
     """
@@ -151,6 +151,8 @@ class ConversationApp(SICApplication):
         # OPENAI_API_KEY="your key"
         if self.env_path:
             load_dotenv(self.env_path)
+        from sic_framework.services.openai_gpt.gpt import GPT, GPTConf
+
         conf = GPTConf(openai_key=environ["OPENAI_API_KEY"])
         self.gpt = GPT(conf=conf)
 
@@ -200,6 +202,9 @@ class ConversationApp(SICApplication):
             self.desktop.speakers.request(AudioRequest(reply.waveform, reply.sample_rate))
 
     def _kiosk_run_facedetection(self):
+        import cv2
+        from sic_framework.core import utils_cv2
+
         while True:
             img = self.imgs_buffer.get()
             faces = self.faces_buffer.get()
@@ -265,6 +270,8 @@ class ConversationApp(SICApplication):
             self.speak("What is your favorite hobby?")
             reply = self.dialogflow.request(GetIntentRequest(self.session_id))
             if reply.response.query_result.query_text:
+                from sic_framework.services.openai_gpt.gpt import GPTRequest
+
                 gpt_response = self.gpt.request(GPTRequest(
                     f'You are a chat bot. The bot just asked about a hobby of the user make a brief '
                     f'positive comment about the hobby and ask a '
@@ -1,58 +1,113 @@
 
 # Import basic preliminaries
-from time import time
 from sic_framework.core.sic_application import SICApplication
 from sic_framework.core import sic_logging
 
+# Heavy dependencies are imported on first use, see lazy_imports.py
+from lazy_imports import lazy_attr, lazy_import
+
 # Import the device(s) we will be using
-from sic_framework.devices import Nao
-from sic_framework.devices.nao import NaoqiTextToSpeechRequest
-from sic_framework.devices.common_naoqi.naoqi_motion import (NaoqiAnimationRequest, 
-                                                             NaoPostureRequest, 
-                                                             NaoqiMoveRequest, 
-                                                             NaoqiBreathingRequest)
-from sic_framework.devices.common_naoqi.naoqi_autonomous import NaoRestRequest
+Nao = lazy_attr("sic_framework.devices", "Nao")
+NaoqiTextToSpeechRequest = lazy_attr("sic_framework.devices.nao", "NaoqiTextToSpeechRequest")
+NaoPostureRequest, NaoqiBreathingRequest = lazy_attr(
+    "sic_framework.devices.common_naoqi.naoqi_motion",
+    "NaoPostureRequest",
+    "NaoqiBreathingRequest",
+)
 
 # Import the service(s) we will be using
-from sic_framework.services.dialogflow_cx.dialogflow_cx import (
-    DialogflowCX,
-    DialogflowCXConf,
-    DetectIntentRequest,
-    QueryResult,
-    RecognitionResult,
+DialogflowCX, DialogflowCXConf, DetectIntentRequest = lazy_attr(
+    "sic_framework.services.dialogflow_cx.dialogflow_cx",
+    "DialogflowCX",
+    "DialogflowCXConf",
+    "DetectIntentRequest",
 )
 
+np = lazy_import("numpy")
+
 # Import libraries necessary for the demo
+import argparse
 import json
+import os
+import uuid
 from os.path import abspath, join
-import numpy as np
 
 # Import message types
-from sic_framework.core.message_python2 import AudioRequest
+AudioRequest = lazy_attr("sic_framework.core.message_python2", "AudioRequest")
 
 # Import libraries necessary for the demo
 import wave
 import time
+import threading
 
-#Import Libraries for Text Parsing
-import re
+# Cue sounds on the microphone trigger intents locally, see CUES in scene_script.py
+from audio_fingerprint import CueMatcher
 
-#random number generation
-import random
+# Gestures triggered by word bookmarks inside one utterance
+from gesture_markup import BookmarkListener, GesturePerformer, compile_markup
 
+# Keeps generative replies within the speaking-time budget of their intent
+from reply_shaper import ReplyShaper
 
-# Import the desktop device to use as mic
-from sic_framework.devices.desktop import Desktop
-from sic_framework.devices.common_desktop.desktop_microphone import (
-    DesktopMicrophone,
-    DesktopMicrophoneSensor,
-    MicrophoneConf,
-)
+# Sound effects uploaded to the robot once and played by reference (set SIC_AUDIO_CACHE=robot)
+from audio_cache import AudioAssetCache, LocalAssetBackend, RobotAssetBackend
+
+# Scene checkpoints in Redis, used by --resume
+from scene_checkpoint import SceneCheckpoint
+
+# Fail fast into a scripted degraded mode when Google services fail
+from circuit_breaker import CircuitBreaker, ProtectedService, tcp_probe
+from degraded_mode import LocalReply, ScriptedDegradedMode
+
+# Opt-in asynchronous logging (set SIC_ASYNC_LOGGING=1)
+from async_logging import AsyncLogSink
+
+# Scene content lives in scene_script.py and is hot reloaded, see scene_runner.py
+from scene_runner import ENTER, SceneRunner
+
+# Predict the next intents and prepare them while the current one is performed
+from intent_predictor import Prefetcher, TransitionModel
+
+# Several NAOs performing in unison (--extra-nao)
+from multi_robot import RobotGroup, SyncCoordinator
+
+# Opt-in live metrics on localhost (set SIC_METRICS_PORT=9464)
+from metrics import InstrumentedDevice, MetricsRegistry, MetricsServer
 
-desktop = Desktop(mic_conf=MicrophoneConf(device_index=2))
+# Opt-in sampling profiler for full shows (set SIC_PROFILE=1)
+from sampling_profiler import ProfiledApplication
 
+# Opt-in analytics of every turn across shows (set SIC_ANALYTICS_DB=shows.sqlite3)
+from show_analytics import AnalyticsStore
 
-class NaoDialogflowCXDemo(SICApplication):
+# One microphone capture shared by the local audio consumers
+from mic_multiplexer import MicrophoneMultiplexer
+
+# Opt-in pacing of Google requests to the project quotas, shared through Redis (set SIC_QUOTA=1)
+from quota_scheduler import QuotaScheduler
+
+# Local Whisper transcript sent to text detect-intent (--local-stt)
+from hybrid_intent import TranscribedIntentService
+from text_intent import TextIntentClient
+SICWhisper = lazy_attr("sic_framework.services.openai_whisper_stt.whisper_stt", "SICWhisper")
+
+# Streaming detect-intent with the next stream opened ahead of the turn (--persistent-stream)
+from persistent_stream import PersistentIntentStream
+
+# Short robot outages (Wi-Fi drops) are bridged with reconnect and request replay
+from robot_link import ResilientDevice
+
+# Keyboard overrides for the operator when recognition fails (--operator-console)
+from operator_console import OperatorConsole
+
+# Opt-in recording of audio, camera, intents and robot requests on one timeline (set SIC_RECORD_DIR)
+from session_recorder import RecordingDevice, SessionRecorder
+
+# Import the desktop device to use as mic
+Desktop = lazy_attr("sic_framework.devices.desktop", "Desktop")
+MicrophoneConf = lazy_attr("sic_framework.devices.common_desktop.desktop_microphone", "MicrophoneConf")
+
+class NaoDialogflowCXDemo(ProfiledApplication, SICApplication):
     """
     NAO Dialogflow CX demo application.
     
@@ -77,38 +132,253 @@ class NaoDialogflowCXDemo(SICApplication):
     Note: This uses Dialogflow CX (v3), which is different from Dialogflow ES (v2).
     """
     
-    def __init__(self):
+    def __init__(self, show_logs=(), extra_nao_ips=(), local_stt=False, persistent_stream=False,
+                 operator_console=False):
         # Call parent constructor (handles singleton initialization)
         super(NaoDialogflowCXDemo, self).__init__()
-
-        # Read the wav file
-        self.audio_file = "clock-chimes-sounds.wav"
         
         # Demo-specific initialization
         self.nao_ip = "10.0.0.181"  
+        self.extra_nao_ips = list(extra_nao_ips)
+        self.coordinator = None
         self.dialogflow_keyfile_path = abspath(join("..", "..", "conf", "google", "google-key.json"))
         self.nao = None
+        self.desktop = None
         self.dialogflow_cx = None
-        self.session_id = np.random.randint(10000)
+        self.local_stt = local_stt
+        self.persistent_stream = persistent_stream
+        self.operator_console = operator_console
+        self.console = None
+        # Random ids like randint(10000) collide between shows, a uuid does not
+        self.session_id = uuid.uuid4().hex
+
+        # Show state, checkpointed to Redis on every transition (see scene_checkpoint.py)
+        self.scene = 0
+        self.posture = None
+        self.show_finished = False
+        self.sounds = {}
+        self.audio_cache = None
+        self.checkpoint = SceneCheckpoint(self.logger)
+
+        # Intents are performed one at a time, from the main loop, a cue sound or the operator console
+        self.perform_lock = threading.RLock()
+        self.cue_matcher = CueMatcher(self.logger, on_match=self.on_cue)
+
+        # Speaking-time budgets of generative replies, from the scene file
+        self.shaper = ReplyShaper(self.logger)
+
+        # Degraded mode used while the Dialogflow CX circuit is open, follows the scene file.
+        # The operator confirms every intent; without an answer within 8 s nothing is performed.
+        self.degraded = ScriptedDegradedMode({}, self.logger, prompt_timeout=8.0)
+
+        # Next-intent prediction, learned from the scene file and recorded show logs
+        self.show_logs = list(show_logs)
+        self.predictor = TransitionModel()
+        self.prefetcher = Prefetcher(self.scenes_prepare, self.logger)
+        self.prefetch_k = 2
+
+        # Scene content, reloaded when scene_script.py changes or on SIGHUP
+        self.scenes = SceneRunner(self, on_reload=self.on_scenes_reloaded)
 
         self.set_log_level(sic_logging.INFO)
+
+        # With SIC_ASYNC_LOGGING=1 log calls only append to a ring buffer that a background
+        # thread writes out, so callbacks and the main loop do not wait for log I/O
+        self.log_sink = None
+        if os.environ.get("SIC_ASYNC_LOGGING"):
+            self.log_sink = AsyncLogSink(capacity=int(os.environ.get("SIC_ASYNC_LOGGING_CAPACITY", 2048)))
+            self.log_sink.install(self.logger)
+
+        # With SIC_METRICS_PORT set, live metrics are served on http://127.0.0.1:<port>/metrics
+        self.metrics = None
+        self.metrics_server = None
+        if os.environ.get("SIC_METRICS_PORT"):
+            self.start_metrics(int(os.environ["SIC_METRICS_PORT"]))
+
+        # With SIC_ANALYTICS_DB set, every turn is appended to a SQLite database (see show_analytics.py)
+        self.analytics = None
+        if os.environ.get("SIC_ANALYTICS_DB"):
+            self.analytics = AnalyticsStore(os.environ["SIC_ANALYTICS_DB"], self.logger, session_id=self.session_id)
+
+        # With SIC_RECORD_DIR set, the show is recorded to <dir>/<start time>-<session> (see session_recorder.py)
+        self.recorder = None
+        if os.environ.get("SIC_RECORD_DIR"):
+            self.recorder = SessionRecorder(
+                join(os.environ["SIC_RECORD_DIR"], time.strftime("%Y%m%d-%H%M%S-") + self.session_id[:8]),
+                self.logger)
+
+        # With SIC_QUOTA=1, detect-intent requests wait for the project's quota (created in setup)
+        self.quota = None
         
         # Log files will only be written if set_log_file is called. Must be a valid full path to a directory.
         # self.set_log_file("/Users/apple/Desktop/SAIL/SIC_Development/sic_applications/demos/nao/logs")
         
         self.setup()
     
+    def set_log_file(self, log_dir):
+        """Set the log file directory; with async logging the file is written through the sink."""
+        super(NaoDialogflowCXDemo, self).set_log_file(log_dir)
+        if getattr(self, "log_sink", None) is not None:
+            self.log_sink.install(self.logger)
+
+    def start_metrics(self, port):
+        """
+        Create the metrics of the show and serve them on localhost.
+
+        Args:
+            port: TCP port of the metrics endpoint.
+        """
+        self.metrics = MetricsRegistry()
+        self.turn_latency = self.metrics.histogram(
+            "sir_turn_latency_seconds", "Time from the start of intent detection until the intent is performed")
+        self.dialogflow_latency = self.metrics.histogram(
+            "sir_dialogflow_cx_latency_seconds", "Duration of Dialogflow CX detect-intent requests")
+        self.mic_level = self.metrics.gauge("sir_mic_level_dbfs", "Microphone level over the last 100 ms")
+        self.quota_wait = self.metrics.histogram(
+            "sir_quota_wait_seconds", "Time detect-intent requests waited for the Google project quota")
+        self.turns = self.metrics.counter("sir_turns_total", "Turns by outcome", labels=("outcome",))
+        self.device_requests = self.metrics.counter(
+            "sir_device_requests_total", "Requests sent to the robot", labels=("component", "request"))
+        self.current_intent = self.metrics.gauge("sir_current_intent", "Intent being performed", labels=("intent",))
+        self.metrics.gauge("sir_scene", "Current scene", func=lambda: self.scene)
+        self.metrics.gauge("sir_dialogflow_cx_available", "1 while the Dialogflow CX circuit is closed",
+                           func=lambda: int(self.dialogflow_cx.breaker.available))
+        self.metrics.gauge("sir_prefetch_queue_depth", "Intents waiting to be prefetched",
+                           func=lambda: self.prefetcher.pending)
+        self.metrics.gauge("sir_log_queue_depth", "Log records waiting in the async log sink",
+                           func=lambda: self.log_sink.stats()["backlog"] if self.log_sink else 0)
+        self.metrics.gauge("sir_log_records_dropped", "Log records dropped by the async log sink",
+                           func=lambda: self.log_sink.dropped if self.log_sink else 0)
+        self.metrics.gauge("sir_audio_frames_dropped",
+                           "Audio frames skipped per microphone consumer, records dropped by the session recorder",
+                           labels=("consumer",), func=self.audio_frames_dropped)
+
+        self.metrics_server = MetricsServer(self.metrics, port=port)
+        self.metrics_server.start()
+        self.logger.info("Metrics on http://127.0.0.1:{}/metrics".format(port))
+
+    def audio_frames_dropped(self):
+        """Return a dict of consumer -> dropped audio frames, for the metrics endpoint."""
+        dropped = {}
+        mic_mux = getattr(self, "mic_mux", None)
+        if mic_mux is not None:
+            dropped.update((name, consumer.dropped) for name, consumer in list(mic_mux.consumers.items()))
+        if getattr(self, "recorder", None) is not None:
+            dropped["recorder"] = self.recorder.dropped
+        return dropped
+
+    def shutdown(self, *args, **kwargs):
+        """Write the profile, report the inter-robot skew and flush the async log sink (if any) before shutting down."""
+        if getattr(self, "shaper", None) is not None:
+            self.logger.info("Replies per intent: %s", self.shaper.stats())
+        if getattr(self, "gestures", None) is not None and self.gestures.listener is not None:
+            self.gestures.listener.stop()
+        if getattr(self, "audio_cache", None) is not None:
+            self.logger.info("Sounds: %s", self.audio_cache.stats())
+        if getattr(self, "console", None) is not None:
+            self.logger.info("Operator keys: %s", self.console.stats())
+            self.console.stop()
+        if getattr(self, "quota", None) is not None:
+            self.logger.info("Quota waits: %s", self.quota.stats())
+        if getattr(self, "mic_mux", None) is not None:
+            self.logger.info("Microphone consumers: %s", self.mic_mux.stats())
+            self.mic_mux.stop()
+        if getattr(self, "local_stt", False) and getattr(self, "dialogflow_cx", None) is not None:
+            self.logger.info("Local STT: %s", self.dialogflow_cx.stats())
+        if getattr(self, "persistent_stream", False) and getattr(self, "dialogflow_cx", None) is not None:
+            self.logger.info("Intent streams: %s", self.dialogflow_cx.stats())
+            self.dialogflow_cx.stop()
+        for link in getattr(self, "robot_links", ()):
+            self.logger.info("Robot %s link: %s", link.ip, link.stats())
+            link.stop()
+        if getattr(self, "analytics", None) is not None:
+            self.analytics.close()
+            self.analytics = None
+        if getattr(self, "recorder", None) is not None:
+            self.logger.info("Session recording: %s", self.recorder.stats())
+            self.recorder.close()
+            self.recorder = None
+        if getattr(self, "metrics_server", None) is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
+        if getattr(self, "coordinator", None) is not None:
+            report = self.coordinator.skew_report()
+            if report["actions"]:
+                self.logger.info("Inter-robot skew measured over %d blocking actions (%d not measured): "
+                                 "median %.1f ms, max %.1f ms", report["actions"], report["unmeasured"],
+                                 report["median"] * 1000, report["max"] * 1000)
+        if getattr(self, "log_sink", None) is not None:
+            stats = self.log_sink.stats()
+            self.logger.info("Async logging: %d records written, %d dropped", stats["written"], stats["dropped"])
+            self.log_sink.close()
+            self.log_sink = None
+        return super(NaoDialogflowCXDemo, self).shutdown(*args, **kwargs)
+
     def fallback_handler(self,reply,text):
-        """Fallback handler if no intent is detected."""
+        """
+        Use the generative response of the reply if there is one, otherwise the canned line.
+
+        Either is held to the speaking budget of the intent: a longer response is trimmed
+        or replaced by the canned line, a longer canned line is trimmed (see reply_shaper.py).
 
-        try : 
-            text = reply.parameters.get("$request.generative.")
-            self.logger.info("Reply: {}".format(text))
+        Args:
+            reply: The Dialogflow CX reply, or None (degraded mode, replay after --resume).
+            text: The canned line.
 
-        except:
-            self.logger.info("No generative response found, using default reply: {}".format(text))
-        return text
+        Returns:
+            str: The line to say.
+        """
+        parameters = getattr(reply, "parameters", None)
+        generated = None
+        if parameters:
+            try:
+                generated = parameters.get("$request.generative.")
+            except (AttributeError, TypeError) as e:
+                self.logger.warning("Unreadable reply parameters: {}".format(e))
+
+        if generated:
+            self.logger.info("Reply: {}".format(generated))
+            return self.shaper.shape(getattr(reply, "intent", None), generated, text)
+
+        self.logger.info("No generative response found, using default reply: {}".format(text))
+        return self.shaper.shape(getattr(reply, "intent", None), None, text)
+
+    def detect_intent(self):
+        """
+        Request intent detection, falling back to the scripted degraded mode.
+
+        Dialogflow CX calls go through a circuit breaker: a failing or hanging call
+        returns after the call timeout, and once the circuit is open calls fail
+        immediately until the background probe sees the service again.
+
+        Returns:
+            The Dialogflow CX reply, or a LocalReply from the degraded mode.
+        """
+        if self.dialogflow_cx.breaker.available:
+            try:
+                if self.quota is not None:
+                    # Live traffic: has priority over rehearsal batches, but does not wait forever
+                    self.quota.acquire("dialogflow_cx", timeout=5.0)
+                start = time.time()
+                reply = self.dialogflow_cx.request(DetectIntentRequest(self.session_id))
+                if self.metrics is not None:
+                    self.dialogflow_latency.observe(time.time() - start)
+                return reply
+            except Exception as e:
+                self.logger.error("Intent detection failed: {}".format(e))
+        return self.degraded.next_reply(self.scene)
     
+    def on_quota_wait(self, api, priority, seconds):
+        """Record how long a request waited for quota (QuotaScheduler callback)."""
+        if self.metrics is not None:
+            self.quota_wait.observe(seconds)
+
+    def on_mic_level(self, frame):
+        """Update the microphone level gauge (multiplexer consumer, 100 ms frames)."""
+        samples = np.frombuffer(frame.waveform, dtype="<i2").astype(np.float32)
+        rms = float(np.sqrt(np.mean(samples ** 2))) if len(samples) else 0.0
+        self.mic_level.set(round(20 * np.log10(max(rms, 1.0) / 32768.0), 1))
+
     def on_recognition(self, message):
         """
         Callback function for Dialogflow CX recognition results.
@@ -124,24 +394,80 @@ class NaoDialogflowCXDemo(SICApplication):
                 rr = message.response.recognition_result
                 if hasattr(rr, 'is_final') and rr.is_final:
                     if hasattr(rr, 'transcript'):
-                        self.logger.info("Transcript: {transcript}".format(transcript=rr.transcript))
+                        self.logger.info("Transcript: %s", rr.transcript)
+                        if self.analytics is not None:
+                            self.analytics.record_event(self.scene, "transcript", rr.transcript)
     
+    def on_transcript(self, transcript):
+        """Callback for the local Whisper transcripts (--local-stt)."""
+        self.logger.info("Transcript: %s", transcript)
+        if self.analytics is not None:
+            self.analytics.record_event(self.scene, "transcript", transcript)
+
     def setup(self):
         """Initialize and configure NAO robot and Dialogflow CX."""
         self.logger.info("Initializing NAO robot...")
 
-        self.wavefile = wave.open(self.audio_file, "rb")
-        self.samplerate = self.wavefile.getframerate() * 5
-        
+
         # Initialize NAO
-        self.nao = Nao(ip=self.nao_ip, dev_test=False)
-        nao_mic = desktop.mic
+        self.nao = ResilientDevice(lambda: Nao(ip=self.nao_ip, dev_test=False), self.nao_ip, self.logger)
+        self.robot_links = [self.nao]
+        self.nao.on_reconnect(self.on_robot_reconnect)
+
+        # With extra NAOs every request goes to all robots, timed to arrive at the same moment
+        if self.extra_nao_ips:
+            robots = {self.nao_ip: self.nao}
+            for ip in self.extra_nao_ips:
+                robots[ip] = ResilientDevice(lambda ip=ip: Nao(ip=ip, dev_test=False), ip, self.logger)
+                self.robot_links.append(robots[ip])
+            self.coordinator = SyncCoordinator(robots, self.logger)
+            self.coordinator.calibrate()
+            self.nao = RobotGroup(self.coordinator)
+
+        # SIC_AUDIO_CACHE=robot keeps the sounds on the robot, a directory path uses a local stand-in
+        audio_cache = os.environ.get("SIC_AUDIO_CACHE")
+        if audio_cache == "robot" and self.coordinator is None:
+            self.audio_cache = AudioAssetCache(RobotAssetBackend(self.nao.ssh), self.logger)
+        elif audio_cache and audio_cache != "robot":
+            self.audio_cache = AudioAssetCache(LocalAssetBackend(audio_cache, self.logger), self.logger)
+
+        if self.metrics is not None:
+            self.nao = InstrumentedDevice(self.nao, self.device_requests)
+
+        if self.recorder is not None:
+            if self.coordinator is None:
+                self.nao.top_camera.register_callback(self.recorder.on_image)
+            self.nao = RecordingDevice(self.nao, self.recorder)
+
+        # Gestures start on the TTS bookmarks of the robot, or on estimated word timing
+        self.gestures = GesturePerformer(
+            self.nao, self.logger, BookmarkListener.start(getattr(self.nao, "ssh", None), self.logger)
+        )
+
+        # Desktop device used as mic (created here instead of at import time)
+        self.desktop = Desktop(mic_conf=MicrophoneConf(device_index=2))
+        nao_mic = self.desktop.mic
+
+        # Local consumers read the microphone through one capture, each on its own thread
+        self.mic_mux = MicrophoneMultiplexer(self.logger)
+        self.mic_mux.attach(nao_mic)
+
+        # Listen for the cue sounds of the scene file on the same microphone
+        self.mic_mux.subscribe("cues", self.cue_matcher.on_audio)
+        if self.metrics is not None:
+            self.mic_mux.subscribe("level", self.on_mic_level, sample_rate=8000, frame_ms=100)
+        if self.recorder is not None:
+            # Frames are kept in the recorder's buffer until written, so they must be copies
+            self.mic_mux.subscribe("recorder", self.recorder.on_audio, sample_rate=16000, frame_ms=500, copy=True)
         
         self.logger.info("Initializing Dialogflow CX...")
         
         # Load the key json file
         with open(self.dialogflow_keyfile_path) as f:
             keyfile_json = json.load(f)
+
+        if os.environ.get("SIC_QUOTA") == "1":
+            self.quota = QuotaScheduler(self.logger, keyfile_json["project_id"], on_wait=self.on_quota_wait)
         
         # Agent configuration
         # TODO: Replace with your agent details (use verify_dialogflow_cx_agent.py to find them)
@@ -160,495 +486,306 @@ class NaoDialogflowCXDemo(SICApplication):
             language="en"
         )
         
-        # Initialize Dialogflow CX with NAO's microphone as input
-        self.dialogflow_cx = DialogflowCX(conf=dialogflow_conf, input_source=nao_mic)
-        
-        self.logger.info("Initialized Dialogflow CX... registering callback function")
-
-        # Register a callback function to handle recognition results
-        self.dialogflow_cx.register_callback(callback=self.on_recognition)
-    
-    def parse_text_to_gesture(self,text):
-        # Remove quotation if present
-        text = text.strip('"')
-         # Split into alternating speech and gesture tokens
-        sentences = re.split(r"[.|]",text)
-        for sentence in sentences:
- 
-            randint = random.randint(1,11)
-
-            self.logger.info("Sentence: {}".format(sentence))
-            self.nao.tts.request(
-            NaoqiTextToSpeechRequest(sentence), block=False
+        # Initialize Dialogflow CX with NAO's microphone as input. Requests go through a
+        # circuit breaker, the timeout leaves the actor time to say their line. A request
+        # listens until someone speaks, so a slow turn is not counted as a failure.
+        dialogflow_breaker = CircuitBreaker(
+            "dialogflow_cx",
+            self.logger,
+            call_timeout=30.0,
+            probe=tcp_probe("dialogflow.googleapis.com" if location == "global"
+                            else "{}-dialogflow.googleapis.com".format(location)),
+        )
+        if self.local_stt:
+            # Only the transcript goes to the agent, the audio stays on this machine
+            self.logger.info("Transcribing locally with Whisper, sending text to Dialogflow CX")
+            self.dialogflow_cx = ProtectedService(
+                TranscribedIntentService(SICWhisper(input_source=nao_mic),
+                                         TextIntentClient(self.dialogflow_keyfile_path, agent_id, location),
+                                         self.logger),
+                dialogflow_breaker,
             )
-            self.logger.info(f"Random Gesture: {randint}")
-            self.nao.motion.request(
-            NaoqiAnimationRequest(f"animations/Stand/Gestures/Explain_{randint}")
+            time.sleep(1)
+            self.dialogflow_cx.register_callback(self.on_transcript)
+        elif self.persistent_stream:
+            # Segments the utterances itself and sets up the next stream while a turn is performed
+            self.dialogflow_cx = ProtectedService(
+                PersistentIntentStream(self.dialogflow_keyfile_path, agent_id, location, self.logger,
+                                       sample_rate=dialogflow_conf.sample_rate_hertz),
+                dialogflow_breaker,
+            )
+            self.mic_mux.subscribe("intent_stream", self.dialogflow_cx.on_audio, copy=True)
+            self.dialogflow_cx.register_callback(self.on_recognition)
+        else:
+            self.dialogflow_cx = ProtectedService(
+                DialogflowCX(conf=dialogflow_conf, input_source=nao_mic), dialogflow_breaker
             )
-            time.sleep(0.1)
-
-        # tokens = re.findall(r"([^*]+|\*.*?\*)", text)
-
-        # for token in tokens:
-        #     if token.startswith("*") and token.endswith("*"):
-        #         # Gesture
-        #         gesture = token.strip("*").strip() #remove * and remove white spaces
-        #         self.logger.info("Gesture: {}".format(gesture))
-        #         self.nao.motion.request(
-        #             NaoqiAnimationRequest(f"animations/Stand/Gestures/Explain_{gesture}")
-        #         )
-        #     else:
-        #         # Speech
-        #         sentence = token.strip()
-        #         if sentence:
-        #             self.logger.info("Sentence: {}".format(sentence))
-        #             self.nao.tts.request(
-        #                 NaoqiTextToSpeechRequest(sentence), block=True
-        #             )
-
-
-
-
-    def run(self):
-        """Main application loop."""
-        self.nao.motion.request(NaoPostureRequest("Stand", 0.5), block=False)
-
-        self.nao.motion.request(
-                            NaoqiBreathingRequest("Body", True), 
-                            block=False
-                        )
-
-        scene = 0
-        try:
-            # Demo starts
-            # self.nao.tts.request(NaoqiTextToSpeechRequest("Hello, I am Nao, nice to meet you!"))
-            
-
-            while not self.shutdown_event.is_set():
-                self.logger.info(" ----- Your turn to talk!")
-                # Request intent detection with the current session
-                reply = self.dialogflow_cx.request(DetectIntentRequest(self.session_id))
-                
-                # Log the detected intent
-                if reply.intent:
-                    self.logger.info("The detected intent: {intent} (confidence: {conf})".format(
-                        intent=reply.intent,
-                        conf=reply.intent_confidence if reply.intent_confidence else "N/A"
-                    ))
-                    
-
-                    # movements and dialog for scene 1, scene 2 wip
-                    if scene == 1:
-
-
-                        
-                        # Actor: Shhhhh…. I’m so tired
-                        if reply.intent == "tired.scene1":
-                            self.logger.info("Tired intent detected")
-
-                            # responses
-                            text = self.fallback_handler(reply, "Understood. I will remain here, silent and still, so you may rest undisturbed.")
-                            self.logger.info("Reply: {}".format(text))
-                            self.nao.tts.request(NaoqiTextToSpeechRequest(text), block=False)
-
-                            # extra actions
-                            self.nao.motion.request(NaoqiAnimationRequest("animations/Stand/Gestures/YouKnowWhat_1"))
-
-                            if len(text.split()) > 15:
-                                time.sleep(7)
-
-                            self.logger.info("Sending audio!")
-                            self.nao.speaker.request(message)
-
-
-                        # Actor: Ahhh! Okay okay I’m awake 
-                        if reply.intent == "shocked_awake":
-                            self.logger.info("Good morning!")
-
-                            # responses
-                            text = self.fallback_handler(reply, "Good morning!")
-                            self.logger.info("Reply: {}".format(text))
-                            self.nao.tts.request(NaoqiTextToSpeechRequest(text), block=False)
-
-                            # extra actions
-                            self.nao.motion.request(NaoqiAnimationRequest("animations/Stand/Gestures/Hey_4"), block=False)
-                            time.sleep(3)
-
-
-                        # Actor: - Who are you?
-                        if reply.intent == "acquaintance":
-                            self.logger.info("Acquaintance intent detected - introducing itself")
-
-                            # responses
-                            text = self.fallback_handler(reply, "I’m Nao! I’m here to be your guide. What is your name?")
-                            self.logger.info("Reply: {}".format(text))
-                            self.nao.tts.request(NaoqiTextToSpeechRequest(text), block=False)
-
-                            # extra actions
-                            self.nao.motion.request(NaoqiAnimationRequest("animations/Stand/Gestures/Me_2"))
-
-                
-                        if reply.intent == "panic":
-                            self.logger.info("Confused user intent detected - explaining situation")
-
-                            # responses
-                            text = self.fallback_handler(reply, "Please calm down. You’re going to tear the carpet. Let’s do some breathing exercises. Breathe in for 3. 1, 2, 3. Hold for 3. 1, 2, 3. Exhale for 3.")
-                            self.parse_text_to_gesture(text)
-                            self.logger.info("Reply: {}".format(text))
-
-                            # extra actions
-                            #self.nao.motion.request(NaoqiAnimationRequest("example gesture CalmDown_1 animation"))
-
-
-                        # Actor: Wow. Thank you Nao. That really helped.
-                        if reply.intent == "thankful":
-                            self.logger.info("start_of_play intent detected - starting play")
-
-                            text = self.fallback_handler(reply, "No problem! Follow me. I will show you the way")
-                            self.nao.tts.request(NaoqiTextToSpeechRequest(text), block=False)
-
-                            # extra actions
-                            self.nao.motion.request(
-                            NaoqiAnimationRequest("animations/Stand/Gestures/Kisses_1"), 
-                            block=False
-                            )
-
-                            if len(text.split()) > 30:
-                                time.sleep(4)
-
-                            # stop idling feature
-                            """self.nao.motion.request(
-                            NaoqiBreathingRequest("Body", False), 
-                            block=False
-                            )"""
-
-                            # extra actions
-                            self.logger.info("Moving forward")
-                            self.nao.motion.request(NaoqiMoveRequest(0.001,0,0.02))
-                            time.sleep(10)
-                            self.nao.motion.request(NaoqiMoveRequest(0,0,0))
-                            time.sleep(1)
-
-                            self.nao.motion.request(NaoPostureRequest("Stand", 0.5), block=False)
-
-                            # restart the idling feature
-                            self.nao.motion.request(
-                            NaoqiBreathingRequest("Body", True), 
-                            block=False
-                            )
-
-                            
-                                
-                        
-                        if reply.intent == "malevolent_greeting":
-                            self.logger.info("Malevolent greeting intent detected")
-
-                            # responses
-                            text = self.fallback_handler(reply, "We have never seen you before.")
-                            self.logger.info("Reply: {}".format(text))
-                            self.nao.tts.request(NaoqiTextToSpeechRequest(text), block=False)
-
-                        
-                            self.nao.motion.request(NaoqiAnimationRequest("animations/Stand/Gestures/No_9"))
-                            time.sleep(1)
-
-                            # extra actions
-                            """self.logger.info("Moving forward")
-                            self.nao.motion.request(NaoqiMoveRequest(0.001,0,0))
-                            time.sleep(10)
-                            self.nao.motion.request(NaoqiMoveRequest(0,0,0))"""
-                        
-
-                        # Deceiving proposal
-                        if reply.intent == "deceiving_proposal":
-                            self.logger.info("deceiving_proposal intent detected")
-
-                            # responses
-                            text = self.fallback_handler(reply, "Wait a minute, this sounds too good to be true - I am not sure if we can trust this man")
-                            self.nao.tts.request(NaoqiTextToSpeechRequest(text), block=False)
-
-                            # actions
-
-                            self.nao.motion.request(NaoqiAnimationRequest("animations/Stand/Gestures/No_2"),
-                                                    block=False)
-                            time.sleep(3)
-
-
-                        # Deceiving 
-                        if reply.intent == "deceiving":
-                            self.logger.info("Deceving intent detected")
 
-                            # responses
-                            text = self.fallback_handler(reply, "I'm not sure about it.")
-                            self.nao.tts.request(NaoqiTextToSpeechRequest(text), block=False)
+            self.logger.info("Initialized Dialogflow CX... registering callback function")
 
+            # Register a callback function to handle recognition results
+            self.dialogflow_cx.register_callback(callback=self.on_recognition)
     
-                            # self.nao.motion.request(
-                            #                 NaoqiAnimationRequest("animations/Stand/Emotions/Neutral/Hesitation_1"), 
-                            #                 block=False
-                            #                 )
-                            time.sleep(1)
-
-
-
-                        
-                        if reply.intent == "confused":
-                            self.logger.info("Confused intent detected")
-
-                            # responses
-                            text = self.fallback_handler(reply, "I'm trying to help you")
-                            self.logger.info("Reply: {}".format(text))
-                            self.nao.tts.request(NaoqiTextToSpeechRequest(text), block=False)
-
-                            # extra actions
-                            self.logger.info("Be confused and need help ")
-                            self.nao.motion.request(
-                                            NaoqiAnimationRequest("animations/Stand/Gestures/Thinking_3"), 
-                                            block=True
-                                            )
-                            time.sleep(1)
-                           
-
-                        # When Nao senses that Later is intimidating_attitude
-                        if reply.intent == "intimidating_attitude":
-                            self.logger.info("intimidating_attitude intent detected")
-
-                            # responses
-                            text = self.fallback_handler(reply, "The proximity, insistence and body language of this individual suggest coercion")
-                            
-                            self.logger.info("Reply: {}".format(text))
-                            self.parse_text_to_gesture(text)
-                            
-                            # if len(text) > 30:
-                            #     time.sleep(3)
-                            time.sleep(1)
-                            
-                        
-
+    def on_robot_reconnect(self, device):
+        """Re-attach what lived on the previous Nao device (robot_link.py callback)."""
+        if self.coordinator is not None:
+            return
+        if isinstance(getattr(self.audio_cache, "backend", None), RobotAssetBackend):
+            self.audio_cache.backend.use_ssh(device.ssh)
+        if getattr(self, "gestures", None) is not None:
+            self.gestures.set_listener(BookmarkListener.start(getattr(device, "ssh", None), self.logger))
+        if self.recorder is not None:
+            device.top_camera.register_callback(self.recorder.on_image)
 
-                        # Actor: What am I gonna do? I need to get home. Please help me
-                        # if reply.intent == "help":
-                        #     self.logger.info("start_of_play intent detected - starting play")
-
-                        #     # responses
-                        #     text = self.fallback_handler(reply, "Good morning!")
-                        #     self.logger.info("Reply: {}".format(text))
-                        #     self.nao.tts.request(NaoqiTextToSpeechRequest(text), block=False)
-
-                        #     # extra actions
-                        #     self.nao.motion.request(NaoqiAnimationRequest("animations/Stand/Gestures/Shoot_1"))
-
-                        # if reply.intent == "concerned":
-                        #     self.logger.info("start_of_play intent detected - starting play")
-
-                        #     # responses
-                        #     text = self.fallback_handler(reply, "Good morning!")
-                        #     self.logger.info("Reply: {}".format(text))
-                        #     self.nao.tts.request(NaoqiTextToSpeechRequest(text), block=False)
-
-                        #     # extra actions
-                        #     self.nao.motion.request(NaoqiAnimationRequest("animations/Stand/Gestures/Shoot_1"))
-                        
-                        if reply.intent == "innocent_answer":
-                            self.logger.info("Innocent answer intent detected")
-
-                            # responses
-                            text = self.fallback_handler(reply, "We have never seen you before!")
-                            self.logger.info("Reply: {}".format(text))
-                            self.nao.tts.request(NaoqiTextToSpeechRequest(text), block=False)
-
-                            # extra actions
-                            self.logger.info("Be confused and need help ")
-                            self.nao.motion.request(NaoqiAnimationRequest("animations/Stand/Gestures/YouKnowWhat_1"))
-                        
-                        if reply.intent == "uneasy":
-                            self.logger.info("Uneasy intent detected")
-
-                            # responses
-                            text = self.fallback_handler(reply, "Let’s disengage!")
-                            self.logger.info("Reply: {}".format(text))
-                            self.nao.tts.request(NaoqiTextToSpeechRequest(text), block=False)
-
-                            # extra actions
-                            self.logger.info("Moving backward")
-                            self.nao.motion.request(NaoqiMoveRequest(0.001,0,0.02))
-                            time.sleep(10)
-                            self.nao.motion.request(NaoqiMoveRequest(0,0,0))
-
-                            self.nao.motion.request(NaoPostureRequest("Stand", 0.5), block=False)
-                            self.nao.motion.request(
-                            NaoqiBreathingRequest("Body", True), 
-                            block=False
-                            )   
-                        
-                        if reply.intent == "relieved":
-                            self.logger.info("Relieved intent detected")
-
-                            # responses
-                            text = self.fallback_handler(reply, "That’s why I’m here. Until you recalibrate, I will help you understand human behavior. You’re not alone.")
-                            self.logger.info("Reply: {}".format(text))
-                            self.nao.tts.request(NaoqiTextToSpeechRequest(text), block=False)
-
-                            # extra actions
-                            self.nao.motion.request(NaoqiAnimationRequest("animations/Stand/Gestures/Me_2"))
-                            time.sleep(3)
-
-                            # extra actions
-                            self.logger.info("Moving backward")
-                            self.nao.motion.request(NaoqiMoveRequest(0.001,0,0.02))
-                            time.sleep(10)
-                            self.nao.motion.request(NaoqiMoveRequest(0,0,0))
-
-                            self.nao.motion.request(NaoPostureRequest("Stand", 0.5), block=False)
-                            self.nao.motion.request(
-                            NaoqiBreathingRequest("Body", True), 
-                            block=False
-                            )
-
-                            # responses
-                            text = "Oh dear, there is a human on the floor. Stand up human!"
-                            
-                            self.logger.info("Reply: {}".format(text))
-                            self.nao.tts.request(NaoqiTextToSpeechRequest(text), block=False)
-                            time.sleep(10)
-
-                        if reply.intent == "rude":
-                            self.logger.info("Rude intent detected")
-
-                            # responses
-                            text = self.fallback_handler(reply, "Later, you are being very rude to this lady")
-                            self.logger.info("Reply: {}".format(text))
-                            self.nao.tts.request(NaoqiTextToSpeechRequest(text), block=False)
+    def parse_text_to_gesture(self,text):
+        """
+        Say a text as one utterance with gestures landing on the right words.
 
-                            # extra actions
-                            self.nao.motion.request(NaoqiAnimationRequest("animations/Stand/Gestures/No_1"))
-                            time.sleep(3)
+        Inline markers like "*Explain_3*" (or "*3*") place a gesture; a text without
+        markers gets a gesture at the start of every chunk (see gesture_markup.py).
 
-                        if reply.intent == "needing_guidance":
-                            self.logger.info("Needing guidance intent detected")
+        Args:
+            text: The text to say.
+        """
+        # Remove quotation if present
+        text = text.strip('"')
+        self.gestures.say(compile_markup(text, self.scenes.gestures()))
+
+    def on_scenes_reloaded(self, scenes):
+        """Keep the degraded mode and the intent predictor in sync with the (re)loaded scene file."""
+        # Everything is built first; the cues are swapped in one step under the matcher's lock
+        # and the rest under the perform lock, so a running intent never sees a half reload
+        script = scenes.intent_order()
+        budgets = scenes.speaking_budgets()
+        self.cue_matcher.replace_wavs(scenes.cues())
+
+        predictor = TransitionModel()
+        predictor.learn_from_script(script, scenes.transitions())
+        for path in self.show_logs:
+            with open(path, errors="replace") as f:
+                predictor.learn_from_log(f)
+
+        with self.perform_lock:
+            self.degraded.script = script
+            self.shaper.budgets = budgets
+            self.predictor = predictor
+
+    def scenes_prepare(self, scene, intent):
+        """Prepare an intent in the background (called by the prefetcher)."""
+        self.scenes.compile(scene, intent)
+
+    def prefetch_after(self, intent):
+        """
+        Prefetch the most likely intents after the given one.
 
-                            # responses
-                            text = self.fallback_handler(reply, "People can’t just cheer up if you tell them to. Human emotions are far more complicated than that.")
-                            self.logger.info("Reply: {}".format(text))
-                            self.parse_text_to_gesture(text)
-                            time.sleep(3)
+        Args:
+            intent: The intent that is about to be performed.
+        """
+        scene = self.scene
+        if intent == "ready":
+            # The next intents are in the next scene, which starts right away
+            scene += 1
+            self.prefetcher.prefetch(scene, [ENTER])
+        predictions = self.predictor.predict(intent, self.prefetch_k)
+        if predictions:
+            self.logger.debug("Predicted after %s: %s", intent, predictions)
+            self.prefetcher.prefetch(scene, [name for name, _ in predictions])
+
+    def load_sound(self, path):
+        """
+        Load a wav file as an AudioRequest for the robot's speaker.
 
-                        if reply.intent == "asking_for_help":
-                            self.logger.info("Asking for help intent detected")
+        The file is read once; the AudioRequest is kept and sent again on later plays.
+        With the audio cache, the clip is also uploaded to the robot here (usually while
+        prefetching), so playing it only sends a reference.
 
-                            # responses
-                            text = self.fallback_handler(reply, "I notice our friend is feeling quite sad right now. When someone is upset, it\'s really important to try and understand how they might be feeling. Instead of saying things that might make them feel worse, we can try to imagine ourselves in their shoes. Think about a time you felt sad or frustrated. What would have made you feel better? Often, just listening without judgment, offering a kind word, or even just being quietly present can make a big difference. It shows them that you care about their feelings, and that is what empathy is all about.")
-                            self.logger.info("Reply: {}".format(text))
-                            self.parse_text_to_gesture(text)
-                            time.sleep(5)
+        Args:
+            path: Path of the wav file.
 
-                        if reply.intent == "confident":
-                            self.logger.info("Confident intent detected")
+        Returns:
+            AudioRequest: The request to send to the speaker.
+        """
+        message = self.sounds.get(path)
+        if message is None:
+            wavefile = wave.open(path, "rb")
+            samplerate = wavefile.getframerate() * 5
+            sound = wavefile.readframes(wavefile.getnframes())
+            wavefile.close()
+            message = AudioRequest(sample_rate=samplerate, waveform=sound)
+            self.sounds[path] = message
+            if self.audio_cache is not None:
+                self.audio_cache.prepare(message)
+        return message
+
+    def perform_intent(self, intent, reply):
+        """
+        Perform the lines and actions of an intent in the current scene.
 
-                            # responses
-                            text = self.fallback_handler(reply, "And remember to be nice!")
-                            self.logger.info("Reply: {}".format(text))
-                            self.nao.tts.request(NaoqiTextToSpeechRequest(text), block=False)
+        Args:
+            intent: Name of the detected intent.
+            reply: The Dialogflow CX reply, or None when a pending intent is replayed
+                after --resume (the canned lines are used in that case).
 
-                            # Motion?
-                            self.nao.motion.request(NaoqiAnimationRequest("animations/Stand/Gestures/YouKnowWhat_2"))
-                            time.sleep(3)
-                            
-                        if reply.intent == "growth":
-                            self.logger.info("Growth intent detected")
+        Returns:
+            None
+        """
+        self.scenes.perform(intent, reply)
+
+    def save_checkpoint(self, pending_actions=()):
+        """Checkpoint the scene, session, posture and pending actions to Redis."""
+        self.checkpoint.save(
+            scene=self.scene,
+            session_id=self.session_id,
+            posture=self.posture,
+            pending_actions=pending_actions,
+        )
 
-                            # responses
-                            text = self.fallback_handler(reply, "Her software has been upgraded!")
-                            self.logger.info("Reply: {}".format(text))
-                            self.nao.tts.request(NaoqiTextToSpeechRequest(text), block=False)
+    def resume(self):
+        """
+        Restore the state of the last checkpoint, without replaying earlier scenes.
 
-                            # Motion?
-                            self.nao.motion.request(NaoqiAnimationRequest("animations/Stand/Gestures/Explain_10"))
+        Restores the scene index and the Dialogflow CX session, puts the robot back in its
+        posture and replays the actions of the intent that was interrupted (if any).
 
-                            # extra actions
-                            self.logger.info("Moving backward")
-                            self.nao.motion.request(NaoqiMoveRequest(0.001,0,0.02))
-                            time.sleep(10)
-                            self.nao.motion.request(NaoqiMoveRequest(0,0,0))
-                            
-                            self.nao.motion.request(NaoPostureRequest("Stand", 0.5), block=False)
-                            self.nao.motion.request(
-                            NaoqiBreathingRequest("Body", True), 
-                            block=False
-                            )   
+        Returns:
+            bool: True if a checkpoint was found and restored.
+        """
+        start = time.time()
+        state = self.checkpoint.load()
+        if state is None:
+            self.logger.info("No checkpoint found, starting the show from the beginning")
+            return False
+
+        self.scene = state["scene"]
+        self.session_id = state["session_id"]
+        self.posture = state["posture"]
+        self.logger.info("Resuming scene {} (session {}, posture {})".format(
+            self.scene, self.session_id, self.posture))
+
+        if self.posture and self.posture != "Rest":
+            self.nao.motion.request(NaoPostureRequest(self.posture, 0.5), block=False)
+            self.nao.motion.request(NaoqiBreathingRequest("Body", True), block=False)
+
+        self.logger.info("Checkpoint restored in {:.3f}s".format(time.time() - start))
+
+        for intent in state["pending_actions"]:
+            self.logger.info("Replaying interrupted intent: {}".format(intent))
+            self.perform_intent(intent, None)
+        if state["pending_actions"]:
+            self.save_checkpoint()
+        return True
+
+    def handle_intent(self, intent, reply, turn_start, detect_latency=None, source="dialogflow_cx"):
+        """
+        Perform a detected intent and record the transition.
 
-                            time.sleep(3)
+        Called from the main loop and, for cue sounds and the operator console, from their
+        own threads, so intents are performed one at a time.
 
-                            text = "We are reaching the end of our route"
-                            self.nao.tts.request(NaoqiTextToSpeechRequest(text), block=True)
+        Args:
+            intent: The detected intent.
+            reply: The Dialogflow CX reply, or None (cue sounds, operator).
+            turn_start: Time the turn started.
+            detect_latency: Seconds the intent detection took, if known.
+            source: Where the intent came from: "dialogflow_cx", "degraded", "cue" or "operator".
+        """
+        with self.perform_lock:
+            # Save the transition before acting, so a crash mid-action can be resumed
+            self.save_checkpoint(pending_actions=[intent])
+            self.prefetch_after(intent)
+            if self.metrics is not None:
+                self.current_intent.set_only(1, intent)
+            scene, expected = self.scene, self.degraded.expected_intent(self.scene)
+            if self.recorder is not None:
+                self.recorder.record_intent(scene, intent, reply, source)
+            perform_start = time.time()
+            self.perform_intent(intent, reply)
+            if self.analytics is not None:
+                self.analytics.record_turn(
+                    scene, intent, expected, getattr(reply, "intent_confidence", None),
+                    getattr(reply, "transcript", None), detect_latency, time.time() - perform_start, source)
+            if self.metrics is not None:
+                self.turn_latency.observe(time.time() - turn_start)
+                self.turns.inc("intent")
+            self.predictor.observe(self.degraded.last_intent, intent)
+            self.degraded.observe(intent)
+            if self.show_finished:
+                self.checkpoint.clear()
+            else:
+                self.save_checkpoint()
+            if self.console is not None and self.console.started and self.scene != scene:
+                # The keys of the new scene
+                self.console.draw()
+
+    def on_cue(self, cue, intent):
+        """Perform the intent of a cue sound heard by the fingerprint matcher (microphone callback)."""
+        self.logger.info("The detected intent: %s (cue %s)", intent, cue)
+        self.handle_intent(intent, None, time.time(), source="cue")
+
+    def run(self, resume=False):
+        """
+        Main application loop.
 
-                        if reply.intent == "Grateful":
-                            self.logger.info("Growth intent detected")
+        Args:
+            resume: Continue from the last checkpoint stored in Redis instead of scene 0.
+        """
+        if not (resume and self.resume()):
+            self.nao.motion.request(NaoPostureRequest("Stand", 0.5), block=False)
 
-                            # responses
-                            text = self.fallback_handler(reply, "Humans are complicated creatures so it’s okay to need some help every once in a while")
-                            self.logger.info("Reply: {}".format(text))
-                            self.nao.tts.request(NaoqiTextToSpeechRequest(text), block=False)
-
-                            # Motion?
-                            self.nao.motion.request(NaoqiAnimationRequest("animations/Stand/Gestures/Explain_6"))
-                            time.sleep(5)
-                            
-                        if reply.intent == "Farewell":
-                            self.logger.info("Growth intent detected")
-
-                            # responses
-                            text = self.fallback_handler(reply, "See you later!")
-                            self.logger.info("Reply: {}".format(text))
-                            self.nao.tts.request(NaoqiTextToSpeechRequest(text), block=False)
-
-                            # Motion? 
-                            self.nao.motion.request(NaoqiAnimationRequest("animations/Stand/Gestures/Salute_1"))
-                            time.sleep(3)
+            self.nao.motion.request(
+                                NaoqiBreathingRequest("Body", True), 
+                                block=False
+                            )
+            self.posture = "Stand"
+            self.save_checkpoint()
 
+        # Edit scene_script.py during rehearsals, the changes are picked up between intents
+        self.scenes.watch()
+        self.scenes.install_signal_handler()
 
+        if self.operator_console:
+            self.console = OperatorConsole(self, self.logger)
+            self.console.start()
+            if self.console.started:
+                # The console owns the terminal input, the degraded mode asks through it
+                self.degraded.read_input = self.console.prompt
 
+        # Prepare the first intents of the (resumed) scene and the start of the next scene
+        self.prefetcher.prefetch(self.scene, self.degraded.script.get(self.scene, [])[:self.prefetch_k])
+        self.prefetcher.prefetch(self.scene + 1, [ENTER])
 
+        try:
+            # Demo starts
+            # self.nao.tts.request(NaoqiTextToSpeechRequest("Hello, I am Nao, nice to meet you!"))
+            
 
-                            
-                    
-                    # ------------------------------------------------------------------------------------
-                    # code for specific scenes dialog put above line ^
-
-
-                    # To be implemented in each scene, move to next scene intent (when we have more scenes ready)
-                    if reply.intent == "ready": 
-                        scene +=1
-                        self.logger.info("Moving to scene {}".format(scene))
-
-                        # immediately start scene one dialog
-                        if scene == 1:
-                            self.logger.info(" -- Ready -- ")
-                            
-                            self.nao.motion.request(NaoqiAnimationRequest("animations/Stand/Reactions/TouchHead_2"), block=False)
-
-                            self.nao.tts.request(NaoqiTextToSpeechRequest("Oh no! It appears that this human is unconscious. Let me wake her up!"))
-                            
-                            self.logger.info("Sending audio!")
-                            sound = self.wavefile.readframes(self.wavefile.getnframes())
-                            message = AudioRequest(sample_rate=self.samplerate, waveform=sound)
-                            self.nao.speaker.request(message)
-                        else:
-                            # move to next scene code, TBD
-                            self.logger.info("Moving to next scene")
-
-                    # current default turn off intent
-                    if reply.intent == "bye":
-                        self.logger.info("Bye intent detected - going to sleep")
-                        self.nao.autonomous.request(NaoRestRequest())
-                        self.shutdown_event.set()
+            while not self.shutdown_event.is_set():
+                self.logger.info(" ----- Your turn to talk!")
+                # Request intent detection with the current session
+                turn_start = time.time()
+                reply = self.detect_intent()
+                detect_latency = time.time() - turn_start
+                
+                # Log the detected intent
+                if reply.intent:
+                    self.logger.info("The detected intent: %s (confidence: %s)",
+                                     reply.intent, reply.intent_confidence if reply.intent_confidence else "N/A")
+                    self.handle_intent(reply.intent, reply, turn_start, detect_latency,
+                                       "degraded" if isinstance(reply, LocalReply) else "dialogflow_cx")
                         
                 else:
                     self.logger.info("No intent detected")
+                    if self.analytics is not None:
+                        self.analytics.record_turn(self.scene, None, self.degraded.expected_intent(self.scene),
+                                                   transcript=reply.transcript, detect_latency=detect_latency)
+                    if self.recorder is not None:
+                        self.recorder.record_intent(self.scene, None, reply)
+                    if self.metrics is not None:
+                        self.turns.inc("no_intent")
                 
                 # Log the transcript
                 if reply.transcript:
-                    self.logger.info("User said: {text}".format(text=reply.transcript))
+                    self.logger.info("User said: %s", reply.transcript)
                 
                 # Speak the agent's response using NAO's text-to-speech
                 if reply.fulfillment_message:
@@ -660,7 +797,7 @@ class NaoDialogflowCXDemo(SICApplication):
                 
                 # Log any parameters
                 if reply.parameters:
-                    self.logger.info("Parameters: {params}".format(params=reply.parameters))
+                    self.logger.info("Parameters: %s", reply.parameters)
                     
         except KeyboardInterrupt:
             self.logger.info("Demo interrupted by user")
@@ -673,6 +810,23 @@ class NaoDialogflowCXDemo(SICApplication):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the group 4 performance.")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue from the last checkpoint instead of starting at scene 0")
+    parser.add_argument("--learn-from", nargs="*", default=[], metavar="LOG",
+                        help="logs of earlier shows to learn the intent transitions from")
+    parser.add_argument("--extra-nao", nargs="*", default=[], metavar="IP",
+                        help="IPs of more NAOs that perform in unison with the first one")
+    parser.add_argument("--local-stt", action="store_true",
+                        help="transcribe speech locally with Whisper and send only the text to Dialogflow CX")
+    parser.add_argument("--persistent-stream", action="store_true",
+                        help="open the next detect-intent stream ahead of the turn and segment utterances locally")
+    parser.add_argument("--operator-console", action="store_true",
+                        help="show the expected intents of the scene and fire them with a key")
+    args = parser.parse_args()
+
     # Create and run the demo
-    demo = NaoDialogflowCXDemo()
-    demo.run()
\ No newline at end of file
+    demo = NaoDialogflowCXDemo(show_logs=args.learn_from, extra_nao_ips=args.extra_nao,
+                               local_stt=args.local_stt, persistent_stream=args.persistent_stream,
+                               operator_console=args.operator_console)
+    demo.run(resume=args.resume)
\ No newline at end of file
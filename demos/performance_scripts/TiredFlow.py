@@ -18,13 +18,21 @@ from sic_framework.services.dialogflow_cx.dialogflow_cx import (
     RecognitionResult,
 )
 
+# Opt-in sampling profiler (set SIC_PROFILE=1)
+from sampling_profiler import ProfiledApplication
+
+# Opt-in analytics of every turn (set SIC_ANALYTICS_DB=shows.sqlite3)
+from show_analytics import AnalyticsStore
+
 # Import libraries necessary for the demo
 import json
+import os
+import time
 from os.path import abspath, join
 import numpy as np
 
 
-class NaoDialogflowCXDemo(SICApplication):
+class NaoDialogflowCXDemo(ProfiledApplication, SICApplication):
     """
     NAO Dialogflow CX demo application.
     
@@ -60,6 +68,11 @@ class NaoDialogflowCXDemo(SICApplication):
         self.dialogflow_cx = None
         self.session_id = np.random.randint(10000)
 
+        # With SIC_ANALYTICS_DB set, every turn is appended to a SQLite database (see show_analytics.py)
+        self.analytics = None
+        if os.environ.get("SIC_ANALYTICS_DB"):
+            self.analytics = AnalyticsStore(os.environ["SIC_ANALYTICS_DB"], self.logger, session_id=self.session_id)
+
         self.set_log_level(sic_logging.INFO)
         
         # Log files will only be written if set_log_file is called. Must be a valid full path to a directory.
@@ -83,6 +96,8 @@ class NaoDialogflowCXDemo(SICApplication):
                 if hasattr(rr, 'is_final') and rr.is_final:
                     if hasattr(rr, 'transcript'):
                         self.logger.info("Transcript: {transcript}".format(transcript=rr.transcript))
+                        if self.analytics is not None:
+                            self.analytics.record_event(None, "transcript", rr.transcript)
     
     def setup(self):
         """Initialize and configure NAO robot and Dialogflow CX."""
@@ -133,7 +148,10 @@ class NaoDialogflowCXDemo(SICApplication):
             while not self.shutdown_event.is_set():
                 self.logger.info(" ----- Your turn to talk!")
                 # Request intent detection with the current session
+                start = time.time()
                 reply = self.dialogflow_cx.request(DetectIntentRequest(self.session_id))
+                detect_latency = time.time() - start
+                perform_start = time.time()
                 
                 # Log the detected intent
                 if reply.intent:
@@ -207,6 +225,12 @@ class NaoDialogflowCXDemo(SICApplication):
                         
                 else:
                     self.logger.info("No intent detected")
+
+                if self.analytics is not None:
+                    self.analytics.record_turn(
+                        None, reply.intent or None, confidence=reply.intent_confidence, transcript=reply.transcript,
+                        detect_latency=detect_latency,
+                        perform_latency=time.time() - perform_start if reply.intent else None)
                 
                 # Log the transcript
                 if reply.transcript:
@@ -231,6 +255,8 @@ class NaoDialogflowCXDemo(SICApplication):
             import traceback
             traceback.print_exc()
         finally:
+            if self.analytics is not None:
+                self.analytics.close()
             self.shutdown()
 
 
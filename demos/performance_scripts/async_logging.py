@@ -0,0 +1,197 @@
+"""
+Asynchronous, bounded logging for hot loops and callbacks.
+
+With the sink installed, a log call only appends the (unformatted) record to a
+bounded ring buffer; a background thread formats the records and writes them to the
+real handlers (console, Redis, log file). When the buffer is full the oldest records
+are dropped and counted, so a burst of logging never blocks the caller.
+
+For per-frame logs (camera, microphone) RateLimitedLogger lets through at most one
+record per interval per call site and reports how many were suppressed.
+
+Usage:
+    sink = AsyncLogSink(capacity=2048)
+    sink.install(self.logger)        # handlers of the logger now write through the sink
+    ...
+    frame_log = RateLimitedLogger(self.logger, interval=1.0)
+    frame_log.info("Got image %s", image.shape)   # use %-style args, formatting is deferred
+    ...
+    sink.close()                     # flushes the remaining records
+"""
+
+import logging
+import sys
+import threading
+import time
+from collections import deque
+
+
+class AsyncLogSink(logging.Handler):
+    """
+    Logging handler that hands records to a background thread through a ring buffer.
+
+    Args:
+        capacity: Maximum number of records waiting to be written.
+        flush_interval: Maximum time (seconds) a record waits before the drain thread wakes up.
+    """
+
+    def __init__(self, capacity=2048, flush_interval=0.2):
+        super(AsyncLogSink, self).__init__()
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.targets = []
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+
+        self._buffer = deque(maxlen=capacity)
+        self._wakeup = threading.Condition(threading.Lock())
+        self._closed = False
+        self._thread = threading.Thread(target=self._drain_loop, name="async-log-sink", daemon=True)
+        self._thread.start()
+
+    # ----------------------------------------------------------------------------- setup
+
+    def install(self, logger):
+        """
+        Move the handlers of a logger behind the sink.
+
+        Can be called again after handlers were added to the logger (e.g. by
+        SICApplication.set_log_file) to move the new handlers behind the sink as well.
+
+        Args:
+            logger: The logger, e.g. the logger of a SICApplication.
+        """
+        source = logger
+        if not logger.handlers and logger.propagate:
+            # The records of this logger are written by the root handlers
+            source = logging.getLogger()
+            logger.propagate = False
+
+        for handler in list(source.handlers):
+            if handler is self:
+                continue
+            if source is logger:
+                logger.removeHandler(handler)
+            if handler not in self.targets:
+                self.targets.append(handler)
+
+        if self not in logger.handlers:
+            logger.addHandler(self)
+
+    # ----------------------------------------------------------------------------- caller side
+
+    def emit(self, record):
+        # Runs on the caller thread: only an append, formatting happens in the drain thread
+        with self._wakeup:
+            if len(self._buffer) == self.capacity:
+                self.dropped += 1
+            self._buffer.append(record)
+            self.enqueued += 1
+            if len(self._buffer) >= self.capacity // 2:
+                self._wakeup.notify()
+
+    # ----------------------------------------------------------------------------- drain side
+
+    def _drain_loop(self):
+        while True:
+            with self._wakeup:
+                if not self._buffer and not self._closed:
+                    self._wakeup.wait(self.flush_interval)
+                records = list(self._buffer)
+                self._buffer.clear()
+                closed = self._closed
+            self._write(records)
+            if closed and not records:
+                return
+
+    def _write(self, records):
+        for record in records:
+            for target in self.targets:
+                if record.levelno >= target.level:
+                    try:
+                        target.handle(record)
+                    except Exception:
+                        target.handleError(record)
+            self.written += 1
+
+    def flush(self):
+        """Write all buffered records now, on the calling thread."""
+        with self._wakeup:
+            records = list(self._buffer)
+            self._buffer.clear()
+        self._write(records)
+        for target in self.targets:
+            target.flush()
+
+    def close(self):
+        """Flush the remaining records and stop the drain thread."""
+        with self._wakeup:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup.notify()
+        self._thread.join(timeout=2.0)
+        self.flush()
+        if self.dropped:
+            sys.stderr.write("async log sink dropped {} records\n".format(self.dropped))
+        super(AsyncLogSink, self).close()
+
+    def stats(self):
+        """Return a dict with the enqueued, written and dropped record counts and the backlog."""
+        return {
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "backlog": len(self._buffer),
+        }
+
+
+class RateLimitedLogger(object):
+    """
+    Logger wrapper for per-frame logs: at most one record per interval per call site.
+
+    Records are keyed on the message template, so "Got %d faces" is limited as one
+    stream whatever the arguments are. The number of suppressed records is appended
+    to the next record that gets through.
+
+    Args:
+        logger: The logger to write to.
+        interval: Minimum number of seconds between two records with the same template.
+    """
+
+    def __init__(self, logger, interval=1.0):
+        self.logger = logger
+        self.interval = interval
+        self.suppressed = 0
+        self._last = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def log(self, level, msg, *args):
+        if not self.logger.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last.get(msg, float("-inf")) < self.interval:
+                self._pending[msg] = self._pending.get(msg, 0) + 1
+                self.suppressed += 1
+                return
+            self._last[msg] = now
+            skipped = self._pending.pop(msg, 0)
+        if skipped:
+            self.logger.log(level, msg + " (%d similar suppressed)", *(args + (skipped,)))
+        else:
+            self.logger.log(level, msg, *args)
+
+    def debug(self, msg, *args):
+        self.log(logging.DEBUG, msg, *args)
+
+    def info(self, msg, *args):
+        self.log(logging.INFO, msg, *args)
+
+    def warning(self, msg, *args):
+        self.log(logging.WARNING, msg, *args)
+
+    def error(self, msg, *args):
+        self.log(logging.ERROR, msg, *args)
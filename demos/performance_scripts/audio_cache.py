@@ -0,0 +1,177 @@
+"""
+Robot-side cache of sound effects, played by reference instead of re-streamed.
+
+Playing an AudioRequest sends the whole waveform through the message broker, after
+which the speaker component writes it to a wav file on the robot and plays that file.
+The cache keys every clip on the hash of its content and uploads the wav file to the
+robot once, over the SSH session the Nao device already has open. Later plays only
+send a play-by-reference command (ALAudioPlayer.playFile of the uploaded file). Files
+that are already on the robot from an earlier session are not uploaded again. If
+uploading or playing by reference fails, the clip is streamed as before.
+
+LocalAssetBackend is a stand-in for the robot that keeps the clips in a local directory.
+
+Usage:
+    cache = AudioAssetCache(RobotAssetBackend(nao.ssh), logger)
+    cache.prepare(request)                    # e.g. while prefetching, uploads if needed
+    cache.play(request, nao.speaker)          # by reference, or streamed as a fallback
+"""
+
+import hashlib
+import io
+import os
+import shutil
+import threading
+import wave
+
+REMOTE_ASSET_DIR = "/home/nao/.sir_assets"
+
+
+def wav_bytes(request):
+    """Return the wav file the speaker component would write for an AudioRequest (16-bit mono)."""
+    buffer = io.BytesIO()
+    wav_file = wave.open(buffer, "wb")
+    wav_file.setparams((1, 2, request.sample_rate, len(request.waveform) // 2, "NONE", "not compressed"))
+    wav_file.writeframes(request.waveform)
+    wav_file.close()
+    return buffer.getvalue()
+
+
+class RobotAssetBackend(object):
+    """
+    Keeps the clips in a directory on the robot and plays them with ALAudioPlayer.
+
+    Args:
+        ssh: The connected paramiko.SSHClient of the Nao device (nao.ssh).
+        remote_dir: Directory on the robot for the clips.
+    """
+
+    def __init__(self, ssh, remote_dir=REMOTE_ASSET_DIR):
+        self.ssh = ssh
+        self.remote_dir = remote_dir
+        self._sftp = None
+
+    def use_ssh(self, ssh):
+        """Continue on a new SSH session (after a reconnect), the uploaded clips stay on the robot."""
+        self.ssh = ssh
+        self._sftp = None
+
+    def upload(self, digest, data):
+        """Upload a clip unless it is already on the robot. Returns the reference (remote path)."""
+        if self._sftp is None:
+            self._sftp = self.ssh.open_sftp()
+            try:
+                self._sftp.mkdir(self.remote_dir)
+            except IOError:
+                pass  # already exists
+        path = "{}/{}.wav".format(self.remote_dir, digest)
+        try:
+            if self._sftp.stat(path).st_size == len(data):
+                return path
+        except IOError:
+            pass
+        self._sftp.putfo(io.BytesIO(data), path)
+        return path
+
+    def play(self, reference):
+        # Returns when the clip has finished, like a blocking speaker request
+        _, stdout, stderr = self.ssh.exec_command("qicli call ALAudioPlayer.playFile {}".format(reference))
+        if stdout.channel.recv_exit_status() != 0:
+            raise IOError(stderr.read().decode("utf-8", "replace").strip())
+
+
+class LocalAssetBackend(object):
+    """
+    Local stand-in for the robot: keeps the clips in a directory and logs the plays.
+
+    Args:
+        directory: Local directory for the clips.
+        logger: Logger of the application.
+    """
+
+    def __init__(self, directory, logger):
+        self.directory = directory
+        self.logger = logger
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def upload(self, digest, data):
+        path = os.path.join(self.directory, "{}.wav".format(digest))
+        if not os.path.exists(path):
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            shutil.move(path + ".tmp", path)
+        return path
+
+    def play(self, reference):
+        self.logger.info("Playing {}".format(reference))
+
+
+class AudioAssetCache(object):
+    """
+    Plays AudioRequests by reference to a clip uploaded once per content hash.
+
+    Args:
+        backend: RobotAssetBackend or LocalAssetBackend.
+        logger: Logger of the application.
+    """
+
+    def __init__(self, backend, logger):
+        self.backend = backend
+        self.logger = logger
+        self.uploads = 0
+        self.by_reference = 0
+        self.streamed = 0
+        self._references = {}
+        self._failed = set()
+        self._lock = threading.Lock()
+
+    def prepare(self, request):
+        """
+        Make sure the clip of a request is on the robot.
+
+        Returns:
+            The reference of the clip, or None if it has to be streamed.
+        """
+        key = id(request)
+        with self._lock:
+            if key in self._failed:
+                return None
+            reference = self._references.get(key)
+            if reference is not None:
+                return reference[1]
+            try:
+                data = wav_bytes(request)
+                reference = self.backend.upload(hashlib.sha1(data).hexdigest(), data)
+            except Exception as e:
+                self._failed.add(key)
+                self.logger.warning("Could not upload sound to the robot, streaming it instead: {}".format(e))
+                return None
+            # The request is kept with its reference, so its id is not reused by another request
+            self._references[key] = (request, reference)
+            self.uploads += 1
+            return reference
+
+    def play(self, request, speaker):
+        """
+        Play an AudioRequest by reference, or stream it to the speaker if that is not possible.
+
+        Args:
+            request: The AudioRequest.
+            speaker: The speaker connector of the robot (nao.speaker).
+        """
+        reference = self.prepare(request)
+        if reference is not None:
+            try:
+                self.backend.play(reference)
+                self.by_reference += 1
+                return
+            except Exception as e:
+                self.logger.warning("Playing sound by reference failed, streaming it instead: {}".format(e))
+                with self._lock:
+                    self._failed.add(id(request))
+        speaker.request(request)
+        self.streamed += 1
+
+    def stats(self):
+        return {"uploads": self.uploads, "by_reference": self.by_reference, "streamed": self.streamed}
@@ -0,0 +1,218 @@
+"""
+Local audio fingerprinting of cue sounds on the microphone stream.
+
+Scene changes used to wait until an actor's line came back from Dialogflow CX as
+"ready", a full speech recognition round trip that can be misheard over music. The
+matcher listens to the microphone for pre-registered cue sounds (a music sting, a
+clap pattern) and fires the transition locally, without network.
+
+Fingerprints are spectral peak pairs: the spectrogram's strongest peak per frequency
+band per frame, paired with the next few peaks into (f1, f2, dt) hashes. A cue matches
+when enough hashes of the last audio window line up at the same time offset in the
+cue, which is robust to noise, music and volume. Matching runs on every microphone
+chunk over a short sliding window, in a few milliseconds.
+
+The cues are CUES in scene_script.py, e.g. {"sting": {"file": "sting.wav", "intent": "ready"}}.
+
+Usage:
+    matcher = CueMatcher(logger, on_match=lambda cue, intent: ...)
+    matcher.register_wav("sting", "sting.wav", "ready")
+    desktop.mic.register_callback(matcher.on_audio)
+"""
+
+import threading
+import time
+import wave
+from collections import Counter, defaultdict
+
+from lazy_imports import lazy_import
+
+np = lazy_import("numpy")
+
+# Audio is resampled to this rate before fingerprinting, enough for the peaks of music and claps
+TARGET_RATE = 11025
+N_FFT = 1024
+HOP = 256
+# Frequency bands (FFT bins) in which the strongest peak of a frame is taken
+BAND_EDGES = (5, 10, 20, 40, 80, 160, 320, 512)
+# A peak is paired with this many following peaks, at most MAX_DT frames later
+FAN_OUT = 5
+MAX_DT = 63
+
+
+def resample(samples, rate, target=TARGET_RATE):
+    """Resample a float array to the target rate (moving-average filter + linear interpolation)."""
+    if rate == target:
+        return samples
+    factor = rate / float(target)
+    if factor > 1:
+        width = int(np.ceil(factor))
+        samples = np.convolve(samples, np.ones(width) / width, mode="same")
+    positions = np.arange(0, len(samples) - 1, factor)
+    return np.interp(positions, np.arange(len(samples)), samples)
+
+
+def spectral_peaks(samples):
+    """
+    Return the spectral peaks of a signal at TARGET_RATE.
+
+    Returns:
+        list of (frame, bin), sorted by frame.
+    """
+    if len(samples) < N_FFT:
+        return []
+    frames = 1 + (len(samples) - N_FFT) // HOP
+    index = np.arange(N_FFT)[None, :] + HOP * np.arange(frames)[:, None]
+    spectrum = np.abs(np.fft.rfft(samples[index] * np.hanning(N_FFT), axis=1))
+    floor = spectrum.mean() * 2.0
+
+    peaks = []
+    for low, high in zip(BAND_EDGES, BAND_EDGES[1:]):
+        band = spectrum[:, low:high]
+        bins = band.argmax(axis=1)
+        strength = band[np.arange(frames), bins]
+        for frame in np.nonzero(strength > floor)[0]:
+            peaks.append((int(frame), int(low + bins[frame])))
+    peaks.sort()
+    return peaks
+
+
+def peak_hashes(peaks):
+    """Yield (hash, anchor frame) for the peak pairs of a constellation."""
+    for i, (t1, f1) in enumerate(peaks):
+        paired = 0
+        for t2, f2 in peaks[i + 1:]:
+            dt = t2 - t1
+            if dt == 0:
+                continue
+            if dt > MAX_DT or paired == FAN_OUT:
+                break
+            yield (f1 << 16) | (f2 << 6) | dt, t1
+            paired += 1
+
+
+def pcm16_to_float(data):
+    """Convert 16-bit little endian PCM bytes to a float array."""
+    return np.frombuffer(data, dtype="<i2").astype(np.float32) / 32768.0
+
+
+def _read_wav(path):
+    wavefile = wave.open(path, "rb")
+    try:
+        channels, rate = wavefile.getnchannels(), wavefile.getframerate()
+        samples = pcm16_to_float(wavefile.readframes(wavefile.getnframes()))[::channels]
+    finally:
+        wavefile.close()
+    return samples, rate
+
+
+class CueMatcher(object):
+    """
+    Matches the microphone stream against registered cue sounds.
+
+    Args:
+        logger: Logger of the application.
+        on_match: Callable(cue, intent) invoked (on the microphone callback thread) when a cue is heard.
+        window: Seconds of recent audio matched on every chunk.
+        min_matches: Number of aligned hashes needed for a match.
+        cooldown: Seconds after a match during which the same cue is not matched again.
+    """
+
+    def __init__(self, logger, on_match=None, window=1.5, min_matches=12, cooldown=5.0):
+        self.logger = logger
+        self.on_match = on_match
+        self.window = window
+        self.min_matches = min_matches
+        self.cooldown = cooldown
+        self.cues = {}
+        self.matches = 0
+        self._index = defaultdict(list)
+        self._buffer = None
+        self._last_match = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, samples, sample_rate, intent):
+        """
+        Register a cue sound.
+
+        Args:
+            name: Name of the cue.
+            samples: Float array of the (mono) cue audio.
+            sample_rate: Sample rate of the samples.
+            intent: Intent performed when the cue is heard.
+        """
+        hashes = list(peak_hashes(spectral_peaks(resample(samples, sample_rate))))
+        with self._lock:
+            self.cues[name] = intent
+            for h, frame in hashes:
+                self._index[h].append((name, frame))
+        self.logger.info("Registered cue {} ({} hashes) for intent {}".format(name, len(hashes), intent))
+
+    def register_wav(self, name, path, intent):
+        """Register a cue from a 16-bit wav file (the first channel is used)."""
+        samples, rate = _read_wav(path)
+        self.register(name, samples, rate, intent)
+
+    def replace_wavs(self, cues):
+        """
+        Replace all cues at once, so the microphone thread never matches against a half-loaded set.
+
+        Args:
+            cues: Dict of name -> {"file": path of a 16-bit wav, "intent": intent}.
+        """
+        new_cues, index = {}, defaultdict(list)
+        for name, cue in cues.items():
+            try:
+                samples, rate = _read_wav(cue["file"])
+            except (IOError, EOFError, wave.Error) as e:
+                self.logger.error("Could not load cue {}: {}".format(name, e))
+                continue
+            new_cues[name] = cue["intent"]
+            for h, frame in peak_hashes(spectral_peaks(resample(samples, rate))):
+                index[h].append((name, frame))
+        with self._lock:
+            self.cues, self._index = new_cues, index
+        self.logger.info("Registered {} cues".format(len(new_cues)))
+
+    def clear(self):
+        with self._lock:
+            self.cues = {}
+            self._index = defaultdict(list)
+
+    def on_audio(self, message):
+        """Microphone callback: append the chunk (AudioMessage) and match the recent window."""
+        self.feed(pcm16_to_float(message.waveform), message.sample_rate)
+
+    def feed(self, samples, sample_rate):
+        """
+        Add audio and match the recent window against the cues.
+
+        Returns:
+            The name of the matched cue, or None.
+        """
+        if not self._index:
+            return None
+        samples = resample(samples, sample_rate)
+        keep = int(self.window * TARGET_RATE)
+        self._buffer = samples[-keep:] if self._buffer is None else np.concatenate((self._buffer, samples))[-keep:]
+
+        votes = Counter()
+        with self._lock:
+            for h, frame in peak_hashes(spectral_peaks(self._buffer)):
+                for name, cue_frame in self._index.get(h, ()):
+                    votes[(name, cue_frame - frame)] += 1
+        if not votes:
+            return None
+        (name, _), count = votes.most_common(1)[0]
+        if count < self.min_matches:
+            return None
+
+        now = time.time()
+        if now - self._last_match.get(name, 0.0) < self.cooldown:
+            return None
+        self._last_match[name] = now
+        self.matches += 1
+        self.logger.info("Heard cue {} ({} aligned hashes)".format(name, count))
+        if self.on_match is not None:
+            self.on_match(name, self.cues[name])
+        return name
@@ -0,0 +1,272 @@
+"""
+Circuit breaker for the (Google) services used during the show.
+
+A call that fails or hangs should not block the performance until the SIC timeout.
+The breaker wraps the request of a service connector (Dialogflow CX, Google TTS,
+GPT, ...), puts a hard timeout on every call and tracks the error rate and latency
+of recent calls. When too many calls fail the circuit opens: further calls fail
+immediately with CircuitOpenError so the caller can switch to its degraded mode,
+while a background thread probes the service until it has recovered.
+
+Usage:
+    breaker = CircuitBreaker("dialogflow_cx", logger, call_timeout=15, probe=tcp_probe(host))
+    dialogflow_cx = ProtectedService(DialogflowCX(...), breaker)
+    reply = dialogflow_cx.request(DetectIntentRequest(session_id))  # may raise CircuitOpenError
+"""
+
+import socket
+import threading
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is refused because the circuit of a service is open."""
+
+
+class ServiceTimeoutError(Exception):
+    """Raised when a call did not return within the call timeout of the breaker."""
+
+
+class CircuitBreaker(object):
+    """
+    Tracks the health of one service and decides whether calls are let through.
+
+    Args:
+        name: Name of the service, used in the logs.
+        logger: Logger of the application.
+        call_timeout: Seconds before a call is abandoned and counted as a failure.
+        slow_call_threshold: Calls slower than this (seconds) count as failures. None to disable;
+            leave it off for calls that wait for someone to speak.
+        window: Number of recent calls used to compute the error rate.
+        error_rate_threshold: Error rate in the window at which the circuit opens.
+        min_calls: Minimum number of calls in the window before the error rate is used.
+        consecutive_failures: Number of failures in a row at which the circuit opens.
+        probe: Optional callable returning True when the service looks healthy again.
+        probe_interval: Seconds between probes while the circuit is open. Without a probe
+            the circuit goes to half-open after this time and lets one real call through.
+    """
+
+    def __init__(
+        self,
+        name,
+        logger,
+        call_timeout=10.0,
+        slow_call_threshold=None,
+        window=10,
+        error_rate_threshold=0.5,
+        min_calls=4,
+        consecutive_failures=3,
+        probe=None,
+        probe_interval=5.0,
+    ):
+        self.name = name
+        self.logger = logger
+        self.call_timeout = call_timeout
+        self.slow_call_threshold = slow_call_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.min_calls = min_calls
+        self.consecutive_failures = consecutive_failures
+        self.probe = probe
+        self.probe_interval = probe_interval
+
+        self.state = CLOSED
+        self.trips = 0
+        self._results = deque(maxlen=window)
+        self._latencies = deque(maxlen=window)
+        self._failures_in_row = 0
+        self._lock = threading.Lock()
+        self._probe_thread = None
+
+    # ----------------------------------------------------------------------------- calls
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call func through the breaker.
+
+        Raises:
+            CircuitOpenError: The circuit is open, the call was not made.
+            ServiceTimeoutError: The call did not finish within call_timeout.
+            Exception: Whatever func raised.
+        """
+        with self._lock:
+            if self.state == OPEN:
+                raise CircuitOpenError("{} is unavailable (circuit open)".format(self.name))
+
+        start = time.time()
+        try:
+            result = self._call_with_timeout(func, args, kwargs)
+        except Exception:
+            self._record(False, time.time() - start)
+            raise
+
+        latency = time.time() - start
+        slow = self.slow_call_threshold is not None and latency > self.slow_call_threshold
+        if slow:
+            self.logger.warning("{} call took {:.2f}s".format(self.name, latency))
+        self._record(not slow, latency)
+        return result
+
+    def _call_with_timeout(self, func, args, kwargs):
+        if self.call_timeout is None:
+            return func(*args, **kwargs)
+
+        # A daemon thread per call, so a hung request can be abandoned and never keeps
+        # the process alive on shutdown
+        outcome = {}
+        done = threading.Event()
+
+        def target():
+            try:
+                outcome["result"] = func(*args, **kwargs)
+            except Exception as e:
+                outcome["error"] = e
+            finally:
+                done.set()
+
+        threading.Thread(target=target, name="{}-call".format(self.name), daemon=True).start()
+        if not done.wait(self.call_timeout):
+            raise ServiceTimeoutError("{} did not answer within {}s".format(self.name, self.call_timeout))
+        if "error" in outcome:
+            raise outcome["error"]
+        return outcome["result"]
+
+    # ----------------------------------------------------------------------------- state
+
+    def _record(self, success, latency):
+        with self._lock:
+            self._results.append(success)
+            self._latencies.append(latency)
+
+            if success:
+                self._failures_in_row = 0
+                if self.state == HALF_OPEN:
+                    self.state = CLOSED
+                    self._results.clear()
+                    self.logger.info("{} recovered, circuit closed".format(self.name))
+                return
+
+            self._failures_in_row += 1
+            if self.state == HALF_OPEN or self._should_trip():
+                self._trip()
+
+    def _should_trip(self):
+        if self._failures_in_row >= self.consecutive_failures:
+            return True
+        if len(self._results) < self.min_calls:
+            return False
+        return self.error_rate >= self.error_rate_threshold
+
+    def _trip(self):
+        # Called with the lock held
+        self.state = OPEN
+        self.trips += 1
+        self.logger.warning("{} is failing (error rate {:.0%}), circuit opened".format(
+            self.name, self.error_rate))
+        if self._probe_thread is None or not self._probe_thread.is_alive():
+            self._probe_thread = threading.Thread(
+                target=self._probe_loop, name="{}-probe".format(self.name), daemon=True
+            )
+            self._probe_thread.start()
+
+    def _probe_loop(self):
+        while True:
+            time.sleep(self.probe_interval)
+            healthy = True
+            if self.probe is not None:
+                try:
+                    healthy = bool(self.probe())
+                except Exception:
+                    healthy = False
+            if healthy:
+                with self._lock:
+                    if self.state == OPEN:
+                        # Let the next real call through as a trial
+                        self.state = HALF_OPEN
+                        self._failures_in_row = 0
+                        self.logger.info("{} probe succeeded, circuit half-open".format(self.name))
+                return
+
+    @property
+    def error_rate(self):
+        if not self._results:
+            return 0.0
+        return 1.0 - float(sum(self._results)) / len(self._results)
+
+    @property
+    def available(self):
+        """False while the circuit is open, i.e. calls fail fast."""
+        return self.state != OPEN
+
+    def stats(self):
+        """Return a dict with the state, error rate, trips and latency of recent calls."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            return {
+                "state": self.state,
+                "error_rate": self.error_rate,
+                "trips": self.trips,
+                "latency_median": latencies[len(latencies) // 2] if latencies else None,
+                "latency_max": latencies[-1] if latencies else None,
+            }
+
+
+class ProtectedService(object):
+    """
+    Wraps a SIC service connector so its blocking requests go through a circuit breaker.
+
+    Blocking requests are serialized: a request the breaker abandoned may still be running
+    on the connector, and the next one waits for it (within the call timeout) instead of
+    running next to it. Non-blocking requests and every other attribute (register_callback,
+    stop, ...) are passed on to the connector unchanged.
+
+    Args:
+        connector: The SIC connector, e.g. DialogflowCX(...) or Text2Speech(...).
+        breaker: The CircuitBreaker for this service.
+    """
+
+    def __init__(self, connector, breaker):
+        self.connector = connector
+        self.breaker = breaker
+        self._busy = threading.Lock()
+
+    def request(self, request, block=True, **kwargs):
+        if not block:
+            return self.connector.request(request, block=False, **kwargs)
+        return self.breaker.call(self._serialized_request, request, **kwargs)
+
+    def _serialized_request(self, request, **kwargs):
+        timeout = self.breaker.call_timeout
+        start = time.time()
+        if not self._busy.acquire(timeout=-1 if timeout is None else timeout):
+            raise ServiceTimeoutError("{} is still busy with an abandoned request".format(self.breaker.name))
+        try:
+            reply = self.connector.request(request, **kwargs)
+        finally:
+            self._busy.release()
+        if timeout is not None and time.time() - start > timeout:
+            self.breaker.logger.warning("{} answered {:.1f}s after the request was abandoned, reply dropped".format(
+                self.breaker.name, time.time() - start))
+        return reply
+
+    def __getattr__(self, attr):
+        return getattr(self.connector, attr)
+
+
+def tcp_probe(host, port=443, timeout=2.0):
+    """
+    Return a probe that checks whether a TCP connection to host:port can be opened.
+
+    Args:
+        host: Host name of the API endpoint, e.g. "europe-west4-dialogflow.googleapis.com".
+        port: Port to connect to.
+        timeout: Connect timeout in seconds.
+    """
+    def probe():
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    return probe
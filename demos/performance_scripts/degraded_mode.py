@@ -0,0 +1,124 @@
+"""
+Scripted degraded mode for when Dialogflow CX is unavailable.
+
+Our show follows a script, so when the intent detection fails we still know which
+intent should come next. In degraded mode the operator gets a timed prompt with the
+scripted intent: Enter takes it (when the actor says the line), another intent name
+overrides it and "skip" performs nothing. Nothing is performed without an answer, so
+an outage never walks the robot through the script on its own; the prompt is shown
+again on the next turn. The resulting reply has no generative parameters, so the
+performance falls back to its canned lines.
+"""
+
+import os
+import sys
+import time
+
+
+def timed_input(prompt, timeout):
+    """
+    Ask for a line on the terminal, giving up after timeout seconds.
+
+    Returns:
+        str: The line without the newline, or None if nothing was entered in time.
+    """
+    sys.stdout.write(prompt)
+    sys.stdout.flush()
+    deadline = time.time() + timeout
+    if os.name == "nt":
+        import msvcrt
+        line = ""
+        while time.time() < deadline:
+            if not msvcrt.kbhit():
+                time.sleep(0.02)
+                continue
+            char = msvcrt.getwche()
+            if char in "\r\n":
+                sys.stdout.write("\n")
+                return line
+            line = line[:-1] if char == "\b" else line + char
+        sys.stdout.write("\n")
+        return None
+
+    import select
+    if select.select([sys.stdin], [], [], timeout)[0]:
+        return sys.stdin.readline().rstrip("\n")
+    sys.stdout.write("\n")
+    return None
+
+
+class LocalReply(object):
+    """
+    Stand-in for the Dialogflow CX QueryResult, with the attributes the performance uses.
+
+    Args:
+        intent: Name of the intent.
+        transcript: What the actor said, if known.
+    """
+
+    def __init__(self, intent, transcript=None):
+        self.intent = intent
+        self.intent_confidence = None
+        self.transcript = transcript
+        self.fulfillment_message = None
+        self.parameters = {}
+
+
+class ScriptedDegradedMode(object):
+    """
+    Proposes the next intent of the script while the intent detection is unavailable.
+
+    Args:
+        script: dict of scene index -> list of intents in the order they occur in the show.
+        logger: Logger of the application.
+        prompt_timeout: Seconds the prompt waits for the operator before the turn passes without an intent.
+        read_input: Callable(prompt, timeout) asking the operator, returning None on timeout.
+    """
+
+    def __init__(self, script, logger, prompt_timeout=8.0, read_input=timed_input):
+        self.script = script
+        self.logger = logger
+        self.prompt_timeout = prompt_timeout
+        self.read_input = read_input
+        self.last_intent = None
+        self.replies = 0
+
+    def expected_intent(self, scene):
+        """Return the intent that follows the last performed intent in the scene."""
+        intents = self.script.get(scene, [])
+        if not intents:
+            return "ready"
+        if self.last_intent in intents:
+            index = intents.index(self.last_intent) + 1
+            return intents[index] if index < len(intents) else "ready"
+        return intents[0]
+
+    def observe(self, intent):
+        """Remember the last performed intent, also while the service is healthy."""
+        self.last_intent = intent
+
+    def next_reply(self, scene):
+        """
+        Ask the operator to confirm the next scripted intent.
+
+        Args:
+            scene: Current scene index.
+
+        Returns:
+            LocalReply, without intent if the operator typed "skip" or did not answer in time.
+        """
+        expected = self.expected_intent(scene)
+        answer = self.read_input(
+            "[DEGRADED] Next: '{}'. Enter: perform it, an intent name, or 'skip' ({:.0f}s): ".format(
+                expected, self.prompt_timeout),
+            self.prompt_timeout)
+        if answer is None:
+            self.logger.warning("Degraded mode: no answer from the operator, nothing performed")
+            return LocalReply(None)
+        answer = answer.strip()
+        if answer == "skip":
+            return LocalReply(None)
+        intent = answer or expected
+        self.replies += 1
+        self.logger.warning("Degraded mode: using local intent '{}'".format(intent))
+        return LocalReply(intent)
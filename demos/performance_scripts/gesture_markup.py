@@ -0,0 +1,242 @@
+"""
+Gestures inside a single TTS utterance, triggered by word bookmarks.
+
+Sending every chunk of a reply as its own NaoqiTextToSpeechRequest adds a TTS restart
+gap between the chunks. Instead, the reply is compiled into one utterance: inline
+gesture markers like "Hello *Explain_3* there" (or, without markers, the chunks of
+text_chunker.py) become NAOqi bookmarks (\\mrk=N\\), and the matching animation is
+started when the robot reaches the bookmark. The robot reports bookmarks through the
+ALMemory event ALTextToSpeech/CurrentBookMark, which BookmarkListener follows over the
+SSH session of the Nao device. Without the listener, or when an event is late, a timer
+based on the estimated word timing starts the animation.
+
+Marker names: "*3*" is Explain_3, "*Hey_1*" is animations/Stand/Gestures/Hey_1, and a
+name with a "/" is used as the full animation path. Only known gestures (those of
+text_chunker.py and the ones the scene file uses) become gestures; any other marker,
+like the emphasis in "I *really* mean it" of a generative reply, is spoken as a word.
+
+Usage:
+    listener = BookmarkListener.start(nao.ssh, logger)
+    performer = GesturePerformer(nao, logger, listener)
+    performer.say(compile_markup("Oh no! *3* What happened?", scenes.gestures()))
+    listener.stop()
+"""
+
+import itertools
+import re
+import threading
+from collections import namedtuple
+
+from lazy_imports import lazy_attr
+from text_chunker import GESTURES, WORDS_PER_SECOND, chunk_text, pick_gesture
+
+NaoqiTextToSpeechRequest = lazy_attr("sic_framework.devices.nao", "NaoqiTextToSpeechRequest")
+NaoqiAnimationRequest = lazy_attr("sic_framework.devices.common_naoqi.naoqi_motion", "NaoqiAnimationRequest")
+
+GESTURE_PREFIX = "animations/Stand/Gestures/"
+
+_MARKER = re.compile(r"\*([^*\s][^*]*?)\*")
+
+# Bookmark numbers are unique over the whole show, so a late event of an earlier utterance is ignored
+_mark_ids = itertools.count(1)
+
+# Runs on the robot (Python 2 with the qi module) and prints every bookmark the TTS reaches
+_LISTENER_SCRIPT = """
+import sys, qi
+app = qi.Application(["bookmarks", "--qi-url=tcp://127.0.0.1:9559"])
+app.start()
+subscriber = app.session.service("ALMemory").subscriber("ALTextToSpeech/CurrentBookMark")
+def on_mark(value):
+    sys.stdout.write("%s\\n" % value)
+    sys.stdout.flush()
+subscriber.signal.connect(on_mark)
+app.run()
+"""
+
+# Utterance text with bookmarks; marks is a list of (mark id, animation, words before the mark)
+Utterance = namedtuple("Utterance", ["text", "marks"])
+
+
+def animation_for(name):
+    """Return the animation path of a gesture marker name."""
+    name = name.strip()
+    if "/" in name:
+        return name
+    if name.isdigit():
+        return "{}Explain_{}".format(GESTURE_PREFIX, name)
+    return GESTURE_PREFIX + name
+
+
+def compile_markup(text, known=()):
+    """
+    Compile a reply into one utterance with bookmarks for its gestures.
+
+    Args:
+        text: The reply, with or without *gesture* markers. Without markers, a gesture
+            is added at the start of every chunk.
+        known: Animations that exist besides GESTURES, e.g. the ones of the scene file.
+            Markers of other names are spoken as plain text.
+
+    Returns:
+        Utterance
+    """
+    known = set(GESTURES).union(known)
+    parts = []
+    marks = []
+    words = 0
+    if _MARKER.search(text):
+        position = 0
+        for match in _MARKER.finditer(text):
+            speech = text[position:match.start()]
+            animation = animation_for(match.group(1))
+            if animation not in known:
+                # Emphasis, not a gesture: say the word without the asterisks
+                speech += match.group(1)
+            parts.append(speech)
+            words += len(speech.split())
+            if animation in known:
+                mark = next(_mark_ids)
+                parts.append("\\mrk={}\\ ".format(mark))
+                marks.append((mark, animation, words))
+            position = match.end()
+        parts.append(text[position:])
+    else:
+        for chunk in chunk_text(text):
+            mark = next(_mark_ids)
+            parts.append("\\mrk={}\\ {} ".format(mark, chunk.text))
+            marks.append((mark, pick_gesture(), words))
+            words += chunk.words
+    return Utterance(re.sub(r"\s+", " ", "".join(parts)).strip(), marks)
+
+
+class BookmarkListener(object):
+    """
+    Follows the TTS bookmark events of the robot over SSH.
+
+    Args:
+        stdout: Output stream of the listener script on the robot.
+        logger: Logger of the application.
+    """
+
+    def __init__(self, stdout, logger):
+        self.logger = logger
+        self.events = 0
+        self._channel = stdout.channel
+        self._stopping = False
+        self._callbacks = []
+        self._thread = threading.Thread(target=self._read_loop, args=(stdout,), name="tts-bookmarks", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def start(cls, ssh, logger):
+        """
+        Start the listener script on the robot.
+
+        Args:
+            ssh: The connected paramiko.SSHClient of the Nao device (nao.ssh), or None.
+            logger: Logger of the application.
+
+        Returns:
+            BookmarkListener, or None if it could not be started (gestures then use the timers).
+        """
+        if ssh is None:
+            return None
+        try:
+            # With a pty the script gets a hangup when the channel is closed, see stop()
+            _, stdout, _ = ssh.exec_command("python -c '{}'".format(_LISTENER_SCRIPT.replace("'", "\"")),
+                                            get_pty=True)
+        except Exception as e:
+            logger.warning("No TTS bookmark events, gestures are timed on estimated word timing: {}".format(e))
+            return None
+        return cls(stdout, logger)
+
+    @property
+    def alive(self):
+        return self._thread.is_alive()
+
+    def add_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def stop(self):
+        """Stop the listener script on the robot."""
+        self._stopping = True
+        self._channel.close()
+
+    def _read_loop(self, stdout):
+        for line in stdout:
+            try:
+                mark = int(line.strip())
+            except ValueError:
+                continue
+            self.events += 1
+            for callback in self._callbacks:
+                callback(mark)
+        if not self._stopping:
+            self.logger.warning("TTS bookmark listener stopped, gestures are timed on estimated word timing")
+
+
+class GesturePerformer(object):
+    """
+    Says an utterance and starts its gestures on the bookmarks, with a timer as fallback.
+
+    Args:
+        nao: The Nao device.
+        logger: Logger of the application.
+        listener: BookmarkListener, or None to only use the timers.
+        words_per_second: Estimated speaking rate for the timers.
+        slack: Extra seconds the timers wait when bookmark events are expected.
+    """
+
+    def __init__(self, nao, logger, listener=None, words_per_second=WORDS_PER_SECOND, slack=0.4):
+        self.nao = nao
+        self.logger = logger
+        self.listener = None
+        self.words_per_second = words_per_second
+        self.slack = slack
+        self.on_bookmark = 0
+        self.on_timer = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.set_listener(listener)
+
+    def set_listener(self, listener):
+        """Use another BookmarkListener (e.g. after a reconnect to the robot), stopping the previous one."""
+        if self.listener is not None:
+            self.listener.stop()
+        self.listener = listener
+        if listener is not None:
+            listener.add_callback(lambda mark: self._fire(mark, "bookmark"))
+
+    def _fire(self, mark, source):
+        with self._lock:
+            animation = self._pending.pop(mark, None)
+            if animation is None:
+                return
+            if source == "bookmark":
+                self.on_bookmark += 1
+            else:
+                self.on_timer += 1
+        self.logger.info("Gesture: {} ({})".format(animation, source))
+        self.nao.motion.request(NaoqiAnimationRequest(animation), block=False)
+
+    def say(self, utterance, block=True):
+        """
+        Say an utterance and start its gestures when their words are reached.
+
+        Args:
+            utterance: Utterance from compile_markup.
+            block: Wait until the utterance is spoken.
+        """
+        slack = self.slack if self.listener is not None and self.listener.alive else 0.0
+        timers = []
+        with self._lock:
+            for mark, animation, words in utterance.marks:
+                self._pending[mark] = animation
+                timer = threading.Timer(words / float(self.words_per_second) + slack, self._fire, (mark, "timer"))
+                timer.daemon = True
+                timers.append(timer)
+
+        self.logger.info("Sentence: {}".format(utterance.text))
+        for timer in timers:
+            timer.start()
+        self.nao.tts.request(NaoqiTextToSpeechRequest(utterance.text), block=block)
@@ -0,0 +1,104 @@
+"""
+Intent detection on a local transcript: only the text goes to Dialogflow CX.
+
+With DialogflowCX fed by the microphone, the audio of every turn is streamed to the
+agent, which is slow and uneven on a weak venue uplink. In the hybrid pipeline the
+Whisper service transcribes the speech locally (see demos/desktop/demo_desktop_microphone_whisper.py)
+and the transcript is sent to text detect-intent (text_intent.TextIntentClient), a
+request of a few hundred bytes. The reply is a TextQueryResult with the same attributes
+as the SIC QueryResult, so the rest of the performance script does not change.
+
+IMPORTANT: the Whisper service needs to be running (pip install "social-interaction-cloud[whisper-speech-to-text]", run-whisper).
+
+Usage:
+    service = TranscribedIntentService(SICWhisper(input_source=desktop.mic), TextIntentClient(), logger)
+    reply = service.request(DetectIntentRequest(session_id))
+"""
+
+import threading
+import time
+
+from lazy_imports import lazy_attr
+from text_intent import TextQueryResult
+
+GetTranscript = lazy_attr("sic_framework.services.openai_whisper_stt.whisper_stt", "GetTranscript")
+
+
+class TranscribedIntentService(object):
+    """
+    Detect-intent service that transcribes locally and sends only the text to the agent.
+
+    Stands in for the DialogflowCX connector: request() takes the same DetectIntentRequest
+    and returns a QueryResult-like TextQueryResult.
+
+    Args:
+        whisper: The SICWhisper connector, with the microphone as input source.
+        client: TextIntentClient (or LocalIntentMatcher) used for the transcripts.
+        logger: Logger of the application.
+        listen_timeout: Seconds to wait for speech to start.
+        phrase_time_limit: Maximum seconds of one phrase. Together with listen_timeout and the
+            transcription this stays within the call timeout of the circuit breaker.
+    """
+
+    def __init__(self, whisper, client, logger, listen_timeout=8, phrase_time_limit=15):
+        self.whisper = whisper
+        self.client = client
+        self.logger = logger
+        self.listen_timeout = listen_timeout
+        self.phrase_time_limit = phrase_time_limit
+        self.listens = 0
+        self.turns = 0
+        self.stt_time = 0.0
+        self.intent_time = 0.0
+        self.uploaded_bytes = 0
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def register_callback(self, callback):
+        """Register a callable(transcript) called with every non-empty transcript."""
+        self._callbacks.append(callback)
+
+    def request(self, request, block=True):
+        """
+        Listen for one phrase and detect its intent.
+
+        Args:
+            request: DetectIntentRequest, its session_id is used for the agent session.
+
+        Returns:
+            TextQueryResult, without intent when nothing was said.
+        """
+        start = time.time()
+        try:
+            transcript = (self.whisper.request(GetTranscript(
+                timeout=self.listen_timeout, phrase_time_limit=self.phrase_time_limit)).transcript or "").strip()
+        except Exception as e:
+            # Nothing said within the listen timeout, or Whisper failed: a turn without intent
+            self.logger.warning("No transcript: {}".format(e))
+            transcript = ""
+        stt_done = time.time()
+        with self._lock:
+            self.listens += 1
+            self.stt_time += stt_done - start
+        if not transcript:
+            return TextQueryResult(None, None, "", latency=stt_done - start)
+
+        for callback in self._callbacks:
+            callback(transcript)
+        reply = self.client.detect(transcript, request.session_id)
+        with self._lock:
+            self.turns += 1
+            self.intent_time += time.time() - stt_done
+            self.uploaded_bytes += len(transcript.encode("utf-8"))
+        self.logger.info("Transcribed in {:.2f}s, intent in {:.2f}s".format(stt_done - start, time.time() - stt_done))
+        return reply
+
+    def stats(self):
+        with self._lock:
+            return {"listens": self.listens, "turns": self.turns,
+                    "mean_stt_s": round(self.stt_time / max(self.listens, 1), 3),
+                    "mean_intent_s": round(self.intent_time / max(self.turns, 1), 3),
+                    "uploaded_bytes": self.uploaded_bytes}
+
+    def stop(self):
+        self.whisper.stop()
@@ -0,0 +1,181 @@
+"""
+Next-intent prediction and background prefetching.
+
+The show is scripted, so the next intent is very predictable: after "acquaintance"
+comes "panic", and so on. TransitionModel counts intent transitions, seeded from the
+order (or the optional TRANSITIONS) of the scene file, from recorded show logs, and
+from the running show itself. While the current intent is being performed, Prefetcher
+prepares the assets of the top-k predicted next intents in the background (sounds,
+compiled robot requests), so nothing has to be prepared when the reply arrives.
+
+Learn from recorded logs and print the model:
+    python intent_predictor.py logs/*.log
+"""
+
+import argparse
+import re
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# Matches the intent log line of the performance script
+INTENT_LOG_PATTERN = re.compile(r"The detected intent: (\S+)")
+
+# Weight of a transition declared in (or implied by) the scene file, relative to one observation
+SCRIPT_WEIGHT = 5.0
+
+
+class TransitionModel(object):
+    """
+    First-order model of intent transitions.
+
+    Args:
+        script_weight: Count given to every transition taken from the scene file.
+    """
+
+    def __init__(self, script_weight=SCRIPT_WEIGHT):
+        self.script_weight = script_weight
+        self.counts = defaultdict(lambda: defaultdict(float))
+        self._lock = threading.Lock()
+
+    def observe(self, previous, intent, weight=1.0):
+        """Count one transition from previous to intent."""
+        if previous is None or intent is None:
+            return
+        with self._lock:
+            self.counts[previous][intent] += weight
+
+    def learn_from_script(self, intent_order, transitions=None):
+        """
+        Seed the model from the scene file.
+
+        Args:
+            intent_order: dict of scene index -> intents in show order (SceneRunner.intent_order()).
+            transitions: Optional dict of intent -> list of next intents (TRANSITIONS in the scene file).
+                Declared transitions replace the ones implied by the order.
+        """
+        transitions = transitions or {}
+        # The whole show as one sequence: every scene ends with "ready" for the next one
+        sequence = []
+        for scene in sorted(intent_order):
+            sequence += [intent for intent in intent_order[scene] if intent != "ready"] + ["ready"]
+        for previous, intent in zip(sequence, sequence[1:]):
+            if previous not in transitions:
+                self.observe(previous, intent, self.script_weight)
+        for previous, next_intents in transitions.items():
+            for intent in next_intents:
+                self.observe(previous, intent, self.script_weight)
+
+    def learn_from_log(self, lines):
+        """
+        Learn transitions from the lines of a recorded show log.
+
+        Args:
+            lines: Iterable of log lines.
+
+        Returns:
+            int: Number of transitions learned.
+        """
+        learned = 0
+        previous = None
+        for line in lines:
+            match = INTENT_LOG_PATTERN.search(line)
+            if match:
+                intent = match.group(1)
+                if previous is not None:
+                    self.observe(previous, intent)
+                    learned += 1
+                previous = intent
+        return learned
+
+    def predict(self, intent, k=2):
+        """
+        Return the k most likely next intents.
+
+        Args:
+            intent: The current intent.
+            k: Number of predictions.
+
+        Returns:
+            list of (intent, probability), most likely first.
+        """
+        with self._lock:
+            following = dict(self.counts.get(intent, {}))
+        total = sum(following.values())
+        if not total:
+            return []
+        ranked = sorted(following.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(name, count / total) for name, count in ranked]
+
+
+class Prefetcher(object):
+    """
+    Prepares the assets of predicted intents on a small background thread pool.
+
+    Args:
+        prepare: Callable(scene, intent) preparing everything an intent needs.
+        logger: Logger of the application.
+        workers: Number of background threads.
+    """
+
+    def __init__(self, prepare, logger, workers=2):
+        self.prepare = prepare
+        self.logger = logger
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self.prefetched = 0
+        self.failed = 0
+        self._in_flight = set()
+        self._lock = threading.Lock()
+
+    def prefetch(self, scene, intents):
+        """Schedule the preparation of the given intents, skipping ones already in flight."""
+        for intent in intents:
+            key = (scene, intent)
+            with self._lock:
+                if key in self._in_flight:
+                    continue
+                self._in_flight.add(key)
+            self.executor.submit(self._run, scene, intent)
+
+    def _run(self, scene, intent):
+        start = time.time()
+        try:
+            self.prepare(scene, intent)
+            self.prefetched += 1
+            self.logger.debug("Prefetched %s (scene %s) in %.3fs", intent, scene, time.time() - start)
+        except Exception as e:
+            self.failed += 1
+            self.logger.warning("Prefetching %s failed: %s", intent, e)
+        finally:
+            with self._lock:
+                self._in_flight.discard((scene, intent))
+
+    @property
+    def pending(self):
+        """Number of intents scheduled or being prepared."""
+        with self._lock:
+            return len(self._in_flight)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Learn intent transitions from recorded show logs.")
+    parser.add_argument("logs", nargs="+", help="Log files of earlier shows")
+    parser.add_argument("-k", type=int, default=3, help="Number of predictions to show per intent")
+    args = parser.parse_args()
+
+    model = TransitionModel()
+    for path in args.logs:
+        with open(path, errors="replace") as f:
+            print("{}: {} transitions".format(path, model.learn_from_log(f)))
+
+    for intent in sorted(model.counts):
+        predictions = ", ".join("{} ({:.0%})".format(n, p) for n, p in model.predict(intent, args.k))
+        print("{:<25} -> {}".format(intent, predictions))
+
+
+if __name__ == "__main__":
+    main()
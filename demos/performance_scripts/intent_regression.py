@@ -0,0 +1,179 @@
+"""
+Batch regression of the actor lines against the intent agent.
+
+Sends every expected actor line of the scene file (ACTOR_LINES in scene_script.py,
+plus optional extra lines) through text-mode detect-intent with a bounded worker
+pool, and reports per line the predicted intent, its confidence and the latency,
+followed by the accuracy, the confusions and latency percentiles. Misrouted lines
+like "deceiving" vs "deceiving_proposal" show up in seconds instead of during a
+rehearsal.
+
+Every line gets its own session, so results do not depend on the order of the lines.
+
+Usage:
+    python intent_regression.py                       # against the real Dialogflow CX agent
+    python intent_regression.py --local --lines extra.tsv    # local stand-in, trained on ACTOR_LINES
+    python intent_regression.py --lines extra.tsv --workers 16 --repeat 3
+    python intent_regression.py --quota               # paced behind live shows (quota_scheduler.py)
+
+The optional lines file has one "intent<TAB>line" per row. The local stand-in is built
+from ACTOR_LINES, so with --local only the lines of that file are checked (testing the
+matcher on its own examples would always pass). The exit code is 1 if a line was
+misrouted, so the check can be scripted.
+"""
+
+import argparse
+import json
+import logging
+import math
+import runpy
+import sys
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from quota_scheduler import BACKGROUND, QuotaScheduler
+from scene_runner import SCENE_SCRIPT_PATH
+from text_intent import AGENT_ID, KEYFILE_PATH, LOCATION, LocalIntentMatcher, TextIntentClient
+
+
+def load_lines(scene_path, extra_path=None):
+    """
+    Collect the (expected intent, line) pairs to check.
+
+    Args:
+        scene_path: Path of the scene file.
+        extra_path: Optional "intent<TAB>line" file with more lines.
+
+    Returns:
+        list of (intent, line)
+    """
+    content = runpy.run_path(scene_path)
+    cases = [(intent, line) for intent, lines in content.get("ACTOR_LINES", {}).items() for line in lines]
+    if extra_path:
+        cases += load_extra_lines(extra_path)
+    return cases
+
+
+def load_extra_lines(path):
+    """Return the (expected intent, line) pairs of an "intent<TAB>line" file."""
+    cases = []
+    with open(path) as f:
+        for row in f:
+            row = row.rstrip("\n")
+            if row and not row.startswith("#"):
+                intent, line = row.split("\t", 1)
+                cases.append((intent.strip(), line.strip()))
+    return cases
+
+
+def percentile(values, fraction):
+    """Return the given percentile (0-1) of a list of values, nearest-rank method."""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    # Nearest rank: the smallest value with at least this fraction of the values at or below it
+    index = min(len(ordered) - 1, max(0, int(math.ceil(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def run_case(agent, expected, line):
+    try:
+        result = agent.detect(line, uuid.uuid4().hex)
+        return expected, line, result.intent, result.intent_confidence, result.latency, None
+    except Exception as e:
+        return expected, line, None, None, None, e
+
+
+def run_regression(agent, cases, workers):
+    """
+    Send all cases to the agent with a bounded worker pool.
+
+    Returns:
+        list of (expected, line, predicted, confidence, latency, error), in the order of cases.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda case: run_case(agent, *case), cases))
+
+
+def report(results, wall_time):
+    """Print the per-line results and the summary. Returns the number of misrouted and failed lines."""
+    print("{:<4} {:<22} {:<22} {:>5} {:>8}  {}".format("", "expected", "predicted", "conf", "ms", "line"))
+    misses = 0
+    errors = 0
+    confusions = Counter()
+    latencies = []
+    for expected, line, predicted, confidence, latency, error in results:
+        if error is not None:
+            errors += 1
+            print("ERR  {:<22} {:<22} {:>5} {:>8}  {} ({})".format(expected, "-", "-", "-", line, error))
+            continue
+        ok = predicted == expected
+        if not ok:
+            misses += 1
+            confusions[(expected, predicted)] += 1
+        latencies.append(latency)
+        print("{:<4} {:<22} {:<22} {:>5} {:>8.0f}  {}".format(
+            "ok" if ok else "MISS", expected, predicted or "-",
+            "{:.2f}".format(confidence) if confidence is not None else "-", latency * 1000, line))
+
+    checked = len(results) - errors
+    print("=" * 80)
+    print("{} lines in {:.1f}s: {} ok, {} misrouted, {} errors ({:.0%} accuracy)".format(
+        len(results), wall_time, checked - misses, misses, errors,
+        (checked - misses) / float(checked) if checked else 0.0))
+    if latencies:
+        print("latency p50 {:.0f} ms, p90 {:.0f} ms, p99 {:.0f} ms, max {:.0f} ms".format(
+            percentile(latencies, 0.5) * 1000, percentile(latencies, 0.9) * 1000,
+            percentile(latencies, 0.99) * 1000, max(latencies) * 1000))
+    for (expected, predicted), count in confusions.most_common():
+        print("  {} -> {}: {}x".format(expected, predicted or "(no intent)", count))
+    return misses + errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check every actor line against the intent agent.")
+    parser.add_argument("--scene-file", default=SCENE_SCRIPT_PATH, help="Scene file with ACTOR_LINES")
+    parser.add_argument("--lines", help="Extra lines, one 'intent<TAB>line' per row")
+    parser.add_argument("--local", action="store_true",
+                        help="Use the local stand-in (trained on ACTOR_LINES) instead of Dialogflow CX, needs --lines")
+    parser.add_argument("--workers", type=int, default=8, help="Number of concurrent requests")
+    parser.add_argument("--repeat", type=int, default=1, help="Send every line this many times")
+    parser.add_argument("--keyfile", default=KEYFILE_PATH, help="Google service account key")
+    parser.add_argument("--agent-id", default=AGENT_ID)
+    parser.add_argument("--location", default=LOCATION)
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--quota", action="store_true",
+                        help="Pace the requests to the project quota shared through Redis, behind live shows")
+    args = parser.parse_args()
+
+    if args.local:
+        if not args.lines:
+            print("--local checks the lines of --lines against a matcher trained on ACTOR_LINES, pass --lines")
+            return 1
+        cases = load_extra_lines(args.lines) * args.repeat
+    else:
+        cases = load_lines(args.scene_file, args.lines) * args.repeat
+    if not cases:
+        print("No actor lines found, add them to ACTOR_LINES in the scene file or pass --lines")
+        return 1
+
+    if args.local:
+        agent = LocalIntentMatcher(runpy.run_path(args.scene_file).get("ACTOR_LINES", {}))
+    else:
+        scheduler = None
+        if args.quota:
+            with open(args.keyfile) as f:
+                project_id = json.load(f)["project_id"]
+            scheduler = QuotaScheduler(logging.getLogger("intent_regression"), project_id)
+        agent = TextIntentClient(args.keyfile, args.agent_id, args.location, args.language,
+                                 scheduler=scheduler, priority=BACKGROUND)
+
+    start = time.time()
+    results = run_regression(agent, cases, args.workers)
+    return 1 if report(results, time.time() - start) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""
+Lazy import helpers for the performance scripts.
+
+Heavy dependencies (NumPy, OpenCV, the Google client libraries and most of
+sic_framework) are only imported the first time they are actually used, so an
+entry point only pays the import cost of the code path it runs.
+
+Usage:
+    np = lazy_import("numpy")
+    NaoqiTextToSpeechRequest = lazy_attr("sic_framework.devices.nao", "NaoqiTextToSpeechRequest")
+
+Use utils/import_profiler.py to see what an entry point imports at startup.
+"""
+
+import importlib
+import threading
+
+_lock = threading.RLock()
+
+
+class LazyModule(object):
+    """
+    Stand-in for a module that is imported on first attribute access.
+
+    Args:
+        name: Dotted module name, e.g. "numpy" or "google.cloud.dialogflowcx_v3".
+    """
+
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            with _lock:
+                module = self.__dict__["_module"]
+                if module is None:
+                    module = importlib.import_module(self.__dict__["_name"])
+                    self.__dict__["_module"] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = "loaded" if self.__dict__["_module"] is not None else "not loaded"
+        return "<lazy module '{}' ({})>".format(self.__dict__["_name"], state)
+
+
+class LazyAttribute(object):
+    """
+    Stand-in for a class or function living in a module that is imported on first use.
+
+    Calling the proxy, or accessing one of its attributes, imports the module and
+    forwards to the real object, so request classes can be used exactly like after a
+    regular ``from module import Name``.
+
+    Args:
+        module: Dotted module name.
+        attr: Name of the object inside the module.
+    """
+
+    def __init__(self, module, attr):
+        self._module = LazyModule(module) if isinstance(module, str) else module
+        self._attr = attr
+        self._target = None
+
+    def resolve(self):
+        """Import the module (if needed) and return the real object."""
+        if self._target is None:
+            self._target = getattr(self._module, self._attr)
+        return self._target
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        return getattr(self.resolve(), attr)
+
+    def __instancecheck__(self, instance):
+        return isinstance(instance, self.resolve())
+
+    def __repr__(self):
+        return "<lazy attribute '{}.{}'>".format(self._module.__dict__["_name"], self._attr)
+
+
+def lazy_import(name):
+    """
+    Return a LazyModule for the given module name.
+
+    Args:
+        name: Dotted module name.
+
+    Returns:
+        LazyModule: Proxy that imports the module on first attribute access.
+    """
+    return LazyModule(name)
+
+
+def lazy_attr(module, *attrs):
+    """
+    Lazy equivalent of ``from module import attr1, attr2, ...``.
+
+    Args:
+        module: Dotted module name.
+        attrs: Names to import from the module.
+
+    Returns:
+        LazyAttribute if a single name is given, otherwise a tuple of them.
+    """
+    lazy_module = LazyModule(module)
+    proxies = tuple(LazyAttribute(lazy_module, attr) for attr in attrs)
+    return proxies[0] if len(proxies) == 1 else proxies
@@ -0,0 +1,257 @@
+"""
+Live metrics of the running show, served over HTTP in the Prometheus text format.
+
+The endpoint is off by default. With SIC_METRICS_PORT set, the performance script
+serves its metrics on http://127.0.0.1:<port>/metrics; it only listens on localhost,
+so it is not reachable from the venue network. Any Prometheus-compatible scraper or a
+browser pointed at the page can watch the show: turn and Dialogflow CX latency
+histograms, queue depths, dropped log records and audio frames, the current scene and intent, and
+request counters per robot component (their rate gives the request rate).
+
+Usage:
+    registry = MetricsRegistry()
+    turns = registry.histogram("sir_turn_latency_seconds", "Detect + perform time of a turn")
+    registry.gauge("sir_scene", "Current scene", func=lambda: self.scene)
+    server = MetricsServer(registry, port=9464)
+    server.start()
+    ...
+    turns.observe(time.time() - start)
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Buckets (seconds) for latencies between a fast local action and a slow Google call
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join('{}="{}"'.format(n, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                     for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Metric(object):
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.help_text), "# TYPE {} {}".format(self.name, self.kind)]
+        return lines + self._samples()
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, optionally per label values."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super(Counter, self).__init__(name, help_text, labels)
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return ["{}{} {}".format(self.name, _format_labels(self.label_names, key), value) for key, value in values]
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down.
+
+    Args:
+        func: Optional callable returning the value at scrape time, instead of set(). With
+            labels it returns a dict of label values (a tuple, or a str for one label) -> value.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=(), func=None):
+        super(Gauge, self).__init__(name, help_text, labels)
+        self.func = func
+        self._values = {}
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+    def set_only(self, value, *label_values):
+        """Set the value for these label values and drop all others, e.g. for the current intent."""
+        with self._lock:
+            self._values = {label_values: value}
+
+    def _samples(self):
+        if self.func is not None:
+            try:
+                value = self.func()
+            except Exception:
+                return []
+            if not self.label_names:
+                return ["{} {}".format(self.name, value if value is not None else "NaN")]
+            values = sorted((key if isinstance(key, tuple) else (key,), value) for key, value in value.items())
+        else:
+            with self._lock:
+                values = sorted(self._values.items())
+        return ["{}{} {}".format(self.name, _format_labels(self.label_names, key), value) for key, value in values]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (e.g. latencies) in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * len(self.buckets)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+                    break
+            self._sum += value
+            self._count += 1
+
+    def _samples(self):
+        with self._lock:
+            counts, total, count = list(self._counts), self._sum, self._count
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            lines.append('{}_bucket{{le="{}"}} {}'.format(self.name, bound, cumulative))
+        lines.append('{}_bucket{{le="+Inf"}} {}'.format(self.name, count))
+        lines.append("{}_sum {}".format(self.name, total))
+        lines.append("{}_count {}".format(self.name, count))
+        return lines
+
+
+class MetricsRegistry(object):
+    """The metrics of the application, rendered together in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=(), func=None):
+        return self._add(Gauge(name, help_text, labels, func))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help_text, buckets))
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer(object):
+    """
+    Serves a registry on /metrics from a background thread.
+
+    Args:
+        registry: The MetricsRegistry to serve.
+        port: TCP port.
+        host: Interface to listen on, localhost by default so the endpoint stays local.
+    """
+
+    def __init__(self, registry, port=9464, host="127.0.0.1"):
+        self.registry = registry
+        self.address = (host, port)
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Scrapes every few seconds would flood the show log
+                pass
+
+        self._server = ThreadingHTTPServer(self.address, Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class _CountingConnector(object):
+    def __init__(self, connector, counter, component):
+        self._connector = connector
+        self._counter = counter
+        self._component = component
+
+    def request(self, request, *args, **kwargs):
+        self._counter.inc(self._component, type(request).__name__)
+        return self._connector.request(request, *args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self._connector, attr)
+
+
+class InstrumentedDevice(object):
+    """
+    Wraps a Nao (or RobotGroup) and counts the requests per component and request type.
+
+    Args:
+        device: The device to wrap.
+        counter: Counter with the labels ("component", "request").
+    """
+
+    COMPONENTS = ("tts", "motion", "speaker", "autonomous", "leds")
+
+    def __init__(self, device, counter):
+        self._device = device
+        self._counter = counter
+
+    def __getattr__(self, attr):
+        value = getattr(self._device, attr)
+        if attr in self.COMPONENTS:
+            # Wrapped on first use, the connectors of a Nao start their component when accessed
+            value = _CountingConnector(value, self._counter, attr)
+            setattr(self, attr, value)
+        return value
@@ -0,0 +1,205 @@
+"""
+One microphone capture fanned out to any number of consumers.
+
+The cue matcher, the persistent intent stream and the level meter each registered
+their own callback on the microphone, so they ran one after the other on the
+connector's callback thread and a slow one (fingerprint matching) delayed the rest.
+The multiplexer is the only callback on the microphone: it copies every chunk once
+into a ring buffer of 16-bit samples and returns. Every consumer has its own thread
+and read position, and gets frames of its own size at its own sample rate. A frame
+at the microphone's rate is a view into the ring (no copy) unless it wraps around
+the end of the ring or the consumer asked for a copy. A consumer that falls more than
+the ring behind skips ahead and counts the dropped audio, so neither the capture nor
+the other consumers ever wait for it.
+
+SIC services (DialogflowCX, SICWhisper) subscribe to the microphone in their own
+process and keep using the connector as their input_source.
+
+Usage:
+    mux = MicrophoneMultiplexer(logger)
+    mux.attach(desktop.mic)
+    mux.subscribe("cues", matcher.on_audio)                            # chunks as captured
+    mux.subscribe("level", on_level, sample_rate=8000, frame_ms=100)   # 100 ms frames at 8 kHz
+"""
+
+import threading
+import time
+
+from async_logging import RateLimitedLogger
+from audio_fingerprint import resample
+from lazy_imports import lazy_import
+
+np = lazy_import("numpy")
+
+
+class AudioFrame(object):
+    """
+    Frame of 16-bit mono audio, with the attributes of the SIC AudioMessage.
+
+    Args:
+        waveform: Bytes-like 16-bit little endian samples. Views into the ring are only
+            valid during the callback; subscribe with copy=True to keep them.
+        sample_rate: Sample rate of the frame.
+        timestamp: Time the last sample of the frame was captured (time.monotonic()).
+    """
+
+    __slots__ = ("waveform", "sample_rate", "timestamp")
+
+    def __init__(self, waveform, sample_rate, timestamp):
+        self.waveform = waveform
+        self.sample_rate = sample_rate
+        self.timestamp = timestamp
+
+
+class _Consumer(object):
+    def __init__(self, mux, name, callback, sample_rate, frame_ms, copy):
+        self.mux = mux
+        self.name = name
+        self.callback = callback
+        self.sample_rate = sample_rate
+        self.frame_ms = frame_ms
+        self.copy = copy
+        self.cursor = None
+        self.frames = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_lag = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="mic-" + name, daemon=True)
+        self._thread.start()
+
+    def _frame_size(self, rate):
+        return int(round(self.frame_ms * rate / 1000.0)) if self.frame_ms else 1
+
+    def _run(self):
+        mux = self.mux
+        while not self._stop.is_set():
+            with mux._cond:
+                while not self._stop.is_set():
+                    if mux._ring is not None:
+                        if self.cursor is None or self.cursor > mux._written:
+                            # Start at the current audio (also after the ring was reset)
+                            self.cursor = mux._written
+                        if mux._written - self.cursor >= self._frame_size(mux.sample_rate):
+                            break
+                    mux._cond.wait(0.5)
+                if self._stop.is_set():
+                    return
+                ring, rate, written, timestamp = mux._ring, mux.sample_rate, mux._written, mux._timestamp
+                capacity = len(ring)
+                if written - self.cursor > capacity - mux._max_chunk:
+                    # Too far behind: skip to half a ring back, the capture does not wait
+                    skip_to = written - capacity // 2
+                    self.dropped += skip_to - self.cursor
+                    self.cursor = skip_to
+                lag = written - self.cursor
+                self.max_lag = max(self.max_lag, lag)
+                size = self._frame_size(rate) if self.frame_ms else lag
+
+            # Read outside the lock; the writer is at least one chunk away from this region
+            start = self.cursor % capacity
+            if start + size <= capacity:
+                samples = ring[start:start + size]
+            else:
+                samples = np.concatenate((ring[start:], ring[:size - (capacity - start)]))
+            self.cursor += size
+            frame_time = timestamp - (written - self.cursor) / float(rate)
+
+            if self.sample_rate and self.sample_rate != rate:
+                converted = resample(samples.astype(np.float32), rate, self.sample_rate)
+                waveform = np.clip(converted, -32768, 32767).astype("<i2").tobytes()
+                frame_rate = self.sample_rate
+            else:
+                waveform = samples.tobytes() if self.copy else memoryview(samples).cast("B")
+                frame_rate = rate
+            try:
+                self.callback(AudioFrame(waveform, frame_rate, frame_time))
+                self.frames += 1
+            except Exception as e:
+                self.errors += 1
+                # A broken consumer fails on every frame
+                mux.frame_log.error("Microphone consumer " + self.name + " failed: %s", e)
+
+    def stop(self):
+        self._stop.set()
+        with self.mux._cond:
+            self.mux._cond.notify_all()
+
+    def stats(self):
+        rate = float(self.mux.sample_rate or 1)
+        return {"frames": self.frames, "dropped_s": round(self.dropped / rate, 2),
+                "max_lag_s": round(self.max_lag / rate, 2), "errors": self.errors}
+
+
+class MicrophoneMultiplexer(object):
+    """
+    Single microphone capture with a ring buffer, read by consumers on their own threads.
+
+    Args:
+        logger: Logger of the application.
+        seconds: Length of the ring buffer, how far a consumer may fall behind.
+    """
+
+    def __init__(self, logger, seconds=10.0):
+        self.logger = logger
+        self.frame_log = RateLimitedLogger(logger, interval=5.0)
+        self.seconds = seconds
+        self.sample_rate = None
+        self.chunks = 0
+        self.consumers = {}
+        self._ring = None
+        self._written = 0  # samples written since the ring was allocated
+        self._timestamp = 0.0
+        self._max_chunk = 0
+        self._cond = threading.Condition()
+
+    def attach(self, mic):
+        """Register the multiplexer as callback of a microphone connector (e.g. desktop.mic)."""
+        mic.register_callback(self.on_audio)
+
+    def on_audio(self, message):
+        """Microphone callback: copy the chunk (AudioMessage) into the ring and wake the consumers."""
+        samples = np.frombuffer(message.waveform, dtype="<i2")
+        with self._cond:
+            if self._ring is None or message.sample_rate != self.sample_rate:
+                self.sample_rate = message.sample_rate
+                self._ring = np.zeros(int(self.seconds * self.sample_rate), dtype="<i2")
+                self._written = 0
+            capacity = len(self._ring)
+            samples = samples[-capacity:]
+            start = self._written % capacity
+            first = min(len(samples), capacity - start)
+            self._ring[start:start + first] = samples[:first]
+            self._ring[:len(samples) - first] = samples[first:]
+            self._written += len(samples)
+            self._max_chunk = max(self._max_chunk, len(samples))
+            self._timestamp = time.monotonic()
+            self.chunks += 1
+            self._cond.notify_all()
+
+    def subscribe(self, name, callback, sample_rate=None, frame_ms=None, copy=False):
+        """
+        Add a consumer.
+
+        Args:
+            name: Name of the consumer, for the logs and stats.
+            callback: Callable(AudioFrame), called on the consumer's own thread.
+            sample_rate: Sample rate of the frames, None for the microphone's rate.
+            frame_ms: Length of the frames in milliseconds, None for everything new at once
+                (about the microphone's chunks).
+            copy: Pass bytes instead of a view into the ring, for consumers that keep the frames.
+        """
+        self.consumers[name] = _Consumer(self, name, callback, sample_rate, frame_ms, copy)
+
+    def unsubscribe(self, name):
+        consumer = self.consumers.pop(name, None)
+        if consumer is not None:
+            consumer.stop()
+
+    def stats(self):
+        """Return a dict of consumer name -> frames, dropped and maximum lag (seconds)."""
+        return {name: consumer.stats() for name, consumer in self.consumers.items()}
+
+    def stop(self):
+        for name in list(self.consumers):
+            self.unsubscribe(name)
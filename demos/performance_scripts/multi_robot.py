@@ -0,0 +1,228 @@
+"""
+Synchronized performance with several NAOs.
+
+A robot performs a request as soon as it arrives, so what differs between the robots
+is the time a request takes to get there. The coordinator measures, for every robot,
+the one-way latency of the path requests really take: a blocking no-op request (an
+empty text to speech) through SIC, i.e. Redis, the robot's component and back, with
+several probes of which the one with the smallest round trip wins.
+
+A request is then sent to every robot at a shared local moment minus that robot's
+latency, so the requests arrive together. This is latency compensation only: the
+robots' clocks are not used. The skew is measured, not assumed: for blocking requests
+the reply times of the robots (minus their return latency) give when every robot
+finished the same action, and the spread of those is recorded, so it can be kept under
+~50 ms. Non-blocking requests have no reply and are only counted.
+
+RobotGroup has the same connectors as a Nao (tts, motion, speaker, autonomous), so
+the scene runner drives two or three robots without any change:
+
+    robots = {ip: Nao(ip=ip) for ip in ("10.0.0.181", "10.0.0.182")}
+    coordinator = SyncCoordinator(robots, logger)
+    coordinator.calibrate()
+    self.nao = RobotGroup(coordinator)
+"""
+
+import socket
+import threading
+import time
+
+from lazy_imports import lazy_attr
+
+NaoqiTextToSpeechRequest = lazy_attr("sic_framework.devices.nao", "NaoqiTextToSpeechRequest")
+
+# NAOqi listens on this port on every robot, used to measure the network round trip
+NAOQI_PORT = 9559
+
+
+def tcp_clock_probe(ip, port=NAOQI_PORT, timeout=1.0):
+    """
+    Return a probe measuring the round trip of a TCP connect to the robot.
+
+    Only tells whether NAOqi answers (see robot_link.py).
+    """
+    def probe():
+        with socket.create_connection((ip, port), timeout=timeout):
+            return None
+    return probe
+
+
+def sic_request_probe(device):
+    """
+    Return a probe timing a blocking no-op request (an empty text to speech) through SIC.
+
+    This is the path every request of the show takes, so its round trip gives the latency.
+    """
+    def probe():
+        device.tts.request(NaoqiTextToSpeechRequest(""), block=True)
+        return None
+    return probe
+
+
+class PathEstimate(object):
+    """
+    One-way latency of a request through SIC to a robot.
+
+    Args:
+        latency: Half the round trip of the fastest probe (seconds).
+        rtt: Round trip of the fastest probe.
+    """
+
+    def __init__(self, latency, rtt):
+        self.latency = latency
+        self.rtt = rtt
+
+    def __repr__(self):
+        return "latency {:.1f} ms (rtt {:.1f} ms)".format(self.latency * 1000, self.rtt * 1000)
+
+
+def estimate_latency(probe, samples=8):
+    """
+    Estimate the one-way latency of a path from timed round trips.
+
+    The sample with the smallest round trip is the least disturbed by queueing, so
+    latency = that round trip / 2.
+
+    Args:
+        probe: Callable making one round trip.
+        samples: Number of round trips.
+
+    Returns:
+        PathEstimate
+    """
+    best = None
+    for _ in range(samples):
+        start = time.time()
+        probe()
+        rtt = time.time() - start
+        if best is None or rtt < best:
+            best = rtt
+    return PathEstimate(best / 2.0, best)
+
+
+class SyncCoordinator(object):
+    """
+    Sends requests to several robots so they arrive at the same moment.
+
+    Args:
+        robots: dict of name (e.g. the IP) -> Nao device.
+        logger: Logger of the application.
+        latency_probes: Optional dict of name -> probe making one round trip, by default a
+            blocking no-op request through SIC.
+        margin: Extra time (seconds) on top of the largest latency before the shared moment.
+        max_skew: Skew (seconds) above which a warning is logged.
+    """
+
+    def __init__(self, robots, logger, latency_probes=None, margin=0.05, max_skew=0.05):
+        self.robots = robots
+        self.logger = logger
+        self.latency_probes = latency_probes or {name: sic_request_probe(device) for name, device in robots.items()}
+        self.margin = margin
+        self.max_skew = max_skew
+        self.paths = {name: PathEstimate(0.0, 0.0) for name in robots}
+        self.skews = []
+        self.unmeasured = 0
+
+    def calibrate(self, samples=8):
+        """Estimate the request latency of every robot."""
+        for name in self.robots:
+            try:
+                self.paths[name] = estimate_latency(self.latency_probes[name], samples)
+                self.logger.info("Robot {}: {}".format(name, self.paths[name]))
+            except Exception as e:
+                self.logger.warning("Could not calibrate robot {}: {}".format(name, e))
+
+    def send(self, component, request, block=True):
+        """
+        Send a request to the given component of every robot, arriving at a shared moment.
+
+        Args:
+            component: Name of the connector on the device, e.g. "tts" or "motion".
+            request: The request to send (the same request object goes to every robot).
+            block: Wait until every robot has finished the request.
+
+        Returns:
+            The reply of the first robot (None if not blocking).
+
+        Raises:
+            Exception: The first error of a robot's request, after all robots were sent theirs.
+        """
+        lead = max(path.latency for path in self.paths.values()) + self.margin
+        moment = time.time() + lead
+        replies = {}
+        finished = {}
+        errors = {}
+
+        def dispatch(name, device):
+            # Sent one latency before the shared moment, so it arrives at that moment
+            send_at = moment - self.paths[name].latency
+            # Sleep most of the way, then spin for the last milliseconds for an exact send time
+            while True:
+                remaining = send_at - time.time()
+                if remaining <= 0:
+                    break
+                time.sleep(remaining - 0.002 if remaining > 0.003 else 0)
+            try:
+                replies[name] = getattr(device, component).request(request, block=block)
+            except Exception as e:
+                errors[name] = e
+                self.logger.error("Robot {} failed {} request: {}".format(name, component, e))
+                return
+            if block:
+                # When the robot finished: the reply minus its way back
+                finished[name] = time.time() - self.paths[name].latency
+
+        threads = [threading.Thread(target=dispatch, args=(name, device), daemon=True)
+                   for name, device in self.robots.items()]
+        for thread in threads:
+            thread.start()
+        # Also without blocking, wait until everything is sent, so the order of requests per robot is kept
+        for thread in threads:
+            thread.join()
+
+        if len(finished) < len(self.robots):
+            self.unmeasured += 1
+        else:
+            skew = max(finished.values()) - min(finished.values())
+            self.skews.append(skew)
+            if skew > self.max_skew:
+                self.logger.warning("Inter-robot skew {:.1f} ms for {}".format(skew * 1000, component))
+        if errors:
+            raise next(iter(errors.values()))
+        first = next(iter(self.robots))
+        return replies.get(first)
+
+    def skew_report(self):
+        """
+        Return a dict with the median and maximum measured inter-robot skew (seconds).
+
+        Only blocking requests are measured; "unmeasured" counts the other actions.
+        """
+        if not self.skews:
+            return {"actions": 0, "median": None, "max": None, "unmeasured": self.unmeasured}
+        ordered = sorted(self.skews)
+        return {"actions": len(ordered), "median": ordered[len(ordered) // 2], "max": ordered[-1],
+                "unmeasured": self.unmeasured}
+
+
+class _GroupConnector(object):
+    def __init__(self, coordinator, component):
+        self.coordinator = coordinator
+        self.component = component
+
+    def request(self, request, block=True):
+        return self.coordinator.send(self.component, request, block=block)
+
+
+class RobotGroup(object):
+    """
+    Drop-in replacement for a Nao device that performs every request on all robots in unison.
+
+    Args:
+        coordinator: The SyncCoordinator of the robots.
+    """
+
+    def __init__(self, coordinator):
+        self.coordinator = coordinator
+        for component in ("tts", "motion", "speaker", "autonomous", "leds"):
+            setattr(self, component, _GroupConnector(coordinator, component))
@@ -0,0 +1,258 @@
+"""
+Terminal console for the operator to fire intents by hand when recognition fails.
+
+When an actor's line is not recognised on stage, the only fix was for the actor to
+repeat it. The console shows the current scene and the intents expected in it (the
+intents of the scene and the global intents of scene_script.py), each with a key. A
+key fires the intent through handle_intent, the same path as a recognised intent, so
+the checkpoint, analytics and scene transitions stay right.
+
+Keys are read in cbreak mode on their own thread and performed on another one, so a
+key is never lost while an intent is being performed. The console owns the terminal
+input: anything else that asks the operator (the degraded mode) goes through prompt(),
+which pauses the keys until the answer is in. The panel is redrawn whenever the scene
+changes.
+
+The expected intents are prepared ahead (like the predicted ones). For every key the
+time from taking the perform lock to the first request the operator's intent sends to
+the robot is measured against LATENCY_BUDGET, and separately the time the key waited
+for an intent that was still being performed; both are logged at shutdown.
+
+Usage:
+    console = OperatorConsole(app, logger)
+    console.start()    # shows the panel; keys 1-9, 0, a-z fire, space redraws
+    answer = console.prompt("Intent? ", timeout=8.0)
+"""
+
+import os
+import queue
+import sys
+import threading
+import time
+
+from scene_runner import ENTER
+
+KEYS = "1234567890abcdefghijklmnopqrstuvwxyz"
+
+# Seconds from taking the perform lock to the first robot request of an operator intent
+LATENCY_BUDGET = 0.05
+
+
+class _TimedConnector(object):
+    def __init__(self, connector, console):
+        self._connector = connector
+        self._console = console
+
+    def request(self, request, *args, **kwargs):
+        self._console.on_robot_request()
+        return self._connector.request(request, *args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self._connector, attr)
+
+
+class _TimedDevice(object):
+    """Wraps the robot of the application to timestamp the first request after a key press."""
+
+    COMPONENTS = ("tts", "motion", "speaker", "autonomous", "leds")
+
+    def __init__(self, device, console):
+        self._device = device
+        self._console = console
+
+    def __getattr__(self, attr):
+        value = getattr(self._device, attr)
+        if attr in self.COMPONENTS:
+            value = _TimedConnector(value, self._console)
+            setattr(self, attr, value)
+        return value
+
+
+def _read_keys(stop_event):
+    """Yield single key presses from the terminal until stop_event is set."""
+    if os.name == "nt":
+        import msvcrt
+        while not stop_event.is_set():
+            if msvcrt.kbhit():
+                yield msvcrt.getwch()
+            else:
+                time.sleep(0.005)
+        return
+
+    import select
+    import termios
+    import tty
+    fd = sys.stdin.fileno()
+    old = termios.tcgetattr(fd)
+    try:
+        tty.setcbreak(fd)
+        while not stop_event.is_set():
+            if select.select([fd], [], [], 0.1)[0]:
+                yield os.read(fd, 1).decode(errors="ignore")
+    finally:
+        termios.tcsetattr(fd, termios.TCSADRAIN, old)
+
+
+class OperatorConsole(object):
+    """
+    Keyboard panel that fires the intents of the current scene.
+
+    Args:
+        app: The performance application (scene, scenes, prefetcher, perform_lock, handle_intent, nao).
+        logger: Logger of the application.
+        out: Stream the panel is written to.
+    """
+
+    def __init__(self, app, logger, out=sys.stdout):
+        self.app = app
+        self.logger = logger
+        self.out = out
+        self.keymap = {}
+        self.latencies = []
+        self.waits = []
+        self.no_robot_action = 0
+        self._turn = None  # (thread id, start) of the operator intent being measured
+        self._turn_lock = threading.Lock()
+        self._fired = queue.Queue()
+        self._stop = threading.Event()
+        self._prompt_lock = threading.Lock()
+        self._line = None  # characters of the prompt answer while prompt() waits
+        self._answer = queue.Queue()
+        self.started = False
+
+    def start(self):
+        """Show the panel and start reading keys. Does nothing without a terminal on stdin."""
+        if not sys.stdin.isatty():
+            self.logger.warning("Operator console needs a terminal on stdin, not started")
+            return
+        self.app.nao = _TimedDevice(self.app.nao, self)
+        self.started = True
+        self.draw()
+        threading.Thread(target=self._read_loop, name="operator-keys", daemon=True).start()
+        threading.Thread(target=self._fire_loop, name="operator-fire", daemon=True).start()
+
+    def expected_intents(self):
+        """Return the intents of the current scene followed by the global intents."""
+        content = self.app.scenes.content
+        intents = list(content["SCENES"].get(self.app.scene, {}).get("intents", {}))
+        intents += [intent for intent in content["GLOBAL_INTENTS"] if intent not in intents]
+        return intents[:len(KEYS)]
+
+    def draw(self):
+        """Print the current scene and the key of every expected intent, and prepare those intents."""
+        scene = self.app.scene
+        intents = self.expected_intents()
+        self.keymap = dict(zip(KEYS, intents))
+        self.app.prefetcher.prefetch(scene, intents)
+        self.app.prefetcher.prefetch(scene + 1, [ENTER])
+        lines = ["", "=" * 60, "OPERATOR  scene {}".format(scene)]
+        lines += ["  [{}] {}".format(key, intent) for key, intent in zip(KEYS, intents)]
+        lines += ["  [space] redraw", "=" * 60]
+        self.out.write("\n".join(lines) + "\n")
+        self.out.flush()
+
+    def prompt(self, text, timeout):
+        """
+        Ask the operator for a line while the intent keys are paused (degraded mode).
+
+        Returns:
+            str: The line, or None if nothing was entered within timeout seconds.
+        """
+        with self._prompt_lock:
+            while not self._answer.empty():
+                self._answer.get_nowait()
+            self._line = ""
+            self.out.write(text)
+            self.out.flush()
+            try:
+                return self._answer.get(timeout=timeout)
+            except queue.Empty:
+                self.out.write("\n")
+                return None
+            finally:
+                self._line = None
+
+    def _prompt_key(self, key, line):
+        if key in "\r\n":
+            self.out.write("\n")
+            self._answer.put(line)
+            line = ""
+        elif key in "\b\x7f":
+            line = line[:-1]
+            self.out.write("\b \b")
+        else:
+            line += key
+            self.out.write(key)
+        self.out.flush()
+        if self._line is not None:
+            self._line = line
+
+    def _read_loop(self):
+        try:
+            for key in _read_keys(self._stop):
+                now = time.time()
+                line = self._line
+                if not key:
+                    continue
+                if line is not None:
+                    self._prompt_key(key, line)
+                    continue
+                key = key.lower()
+                if key == " ":
+                    self.draw()
+                elif key in self.keymap:
+                    self._fired.put((self.keymap[key], now))
+        except Exception as e:
+            self.logger.error("Operator console stopped reading keys: {}".format(e))
+
+    def _fire_loop(self):
+        while not self._stop.is_set():
+            try:
+                intent, key_time = self._fired.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            self.logger.info("The detected intent: %s (operator)", intent)
+            # The measurement starts once no other intent is performed; only requests of
+            # this thread (the operator's intent) close it
+            with self.app.perform_lock:
+                start = time.time()
+                self.waits.append(start - key_time)
+                with self._turn_lock:
+                    self._turn = (threading.get_ident(), start)
+                try:
+                    self.app.handle_intent(intent, None, key_time, source="operator")
+                except Exception as e:
+                    self.logger.error("Operator intent {} failed: {}".format(intent, e))
+                with self._turn_lock:
+                    if self._turn is not None:
+                        # The intent only logged or changed state, nothing went to the robot
+                        self._turn = None
+                        self.no_robot_action += 1
+
+    def on_robot_request(self):
+        """Called for every robot request: the first one of the operator's intent closes the measurement."""
+        with self._turn_lock:
+            if self._turn is None or self._turn[0] != threading.get_ident():
+                return
+            start, self._turn = self._turn[1], None
+        latency = time.time() - start
+        self.latencies.append(latency)
+        if latency > LATENCY_BUDGET:
+            self.logger.warning("Operator key to robot took {:.0f} ms".format(latency * 1000))
+
+    def stats(self):
+        """Return the number of fired keys, the dispatch latency and the wait for a running intent (ms)."""
+        latencies = sorted(self.latencies)
+        stats = {"fired": len(latencies) + self.no_robot_action, "no_robot_action": self.no_robot_action}
+        if latencies:
+            stats.update(
+                median_ms=round(latencies[len(latencies) // 2] * 1000, 1),
+                max_ms=round(latencies[-1] * 1000, 1),
+                over_budget=sum(1 for latency in latencies if latency > LATENCY_BUDGET),
+            )
+        if self.waits:
+            stats["max_wait_ms"] = round(max(self.waits) * 1000, 1)
+        return stats
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,329 @@
+"""
+Streaming detect-intent with the stream opened ahead of the turn.
+
+Every DetectIntentRequest to the SIC DialogflowCX service opens a new streaming call
+(channel, session configuration) when the turn starts, and its one-chunk audio buffer
+drops what the actor said while the stream was being set up. A Dialogflow CX stream
+carries a single query, so it cannot be kept open over several turns; instead the
+next stream is opened and configured right after a turn ends, and waits for the
+next utterance. The stream talks to the agent directly (like text_intent.py), on one
+long-lived client.
+
+Utterances are segmented here with an adaptive energy threshold on the microphone
+chunks: audio is only sent once speech starts (with the chunks just before it), and
+the stream is half-closed after a stretch of silence, the agent's final recognition,
+or the phrase time limit. A waiting stream is replaced before it gets old, and a
+stream that fails during a turn (for instance on a server-side stream limit) is
+reopened and the utterance so far is sent again, so the turn does not notice. A turn
+reopens its stream at most max_reopens times, with a growing delay in between; after
+that the error is raised, so the circuit breaker sees an unreachable endpoint.
+
+Replies are the SIC QueryResult and interim results are passed to the callbacks as
+RecognitionResult, like the DialogflowCX connector does.
+
+Usage:
+    stream = PersistentIntentStream(keyfile_path, agent_id, location, logger)
+    desktop.mic.register_callback(stream.on_audio)
+    reply = stream.request(DetectIntentRequest(session_id))
+"""
+
+import collections
+import json
+import queue
+import threading
+import time
+
+from lazy_imports import lazy_attr, lazy_import
+from text_intent import api_endpoint
+
+dialogflowcx_v3 = lazy_import("google.cloud.dialogflowcx_v3")
+service_account = lazy_import("google.oauth2.service_account")
+np = lazy_import("numpy")
+QueryResult = lazy_attr("sic_framework.services.dialogflow_cx.dialogflow_cx", "QueryResult")
+RecognitionResult = lazy_attr("sic_framework.services.dialogflow_cx.dialogflow_cx", "RecognitionResult")
+
+# Sent to the stream to half-close it
+_END = None
+
+
+def _empty_result():
+    # The SIC service returns the same when there is no query result
+    return QueryResult(type("obj", (object,), {"query_result": None})())
+
+
+class _Stream(object):
+    """One streaming detect-intent call: an audio queue in, the responses read on a thread."""
+
+    def __init__(self, session_id, sample_rate):
+        self.session_id = session_id
+        self.sample_rate = sample_rate
+        self.opened = time.time()
+        self.audio = queue.Queue()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.call = None
+
+    def fail(self, error):
+        self.error = error
+        self.done.set()
+
+    def cancel(self):
+        self.audio.put(_END)
+        cancel = getattr(self.call, "cancel", None)
+        if cancel is not None:
+            cancel()
+
+    @property
+    def alive(self):
+        return not self.done.is_set()
+
+
+class PersistentIntentStream(object):
+    """
+    Detect-intent on a stream that is open before the turn starts.
+
+    Stands in for the DialogflowCX connector: request() takes the same DetectIntentRequest
+    and returns a QueryResult.
+
+    Args:
+        keyfile_path: Path of the Google service account key.
+        agent_id: Dialogflow CX agent id.
+        location: Agent location.
+        logger: Logger of the application.
+        language: Language code of the agent.
+        listen_timeout: Seconds to wait for speech to start, after which the turn has no intent.
+        phrase_time_limit: Maximum seconds of one utterance.
+        end_silence: Seconds of silence that end an utterance.
+        result_timeout: Seconds to wait for the intent after the utterance.
+        max_idle: Seconds a waiting stream is kept before it is replaced by a fresh one.
+        energy_threshold: Minimum RMS (16-bit samples) of speech.
+        sample_rate: Sample rate of the microphone until its first chunk arrives.
+        max_reopens: Times a failed stream is reopened within one turn before the error is raised.
+        reopen_delay: Seconds before the first reopen, doubled for every further one.
+
+    The timeouts add up to less than the call timeout of the Dialogflow CX circuit breaker.
+    """
+
+    def __init__(self, keyfile_path, agent_id, location, logger, language="en", listen_timeout=8.0,
+                 phrase_time_limit=15.0, end_silence=0.75, result_timeout=5.0, max_idle=30.0,
+                 energy_threshold=300.0, sample_rate=16000, max_reopens=2, reopen_delay=0.5):
+        with open(keyfile_path) as f:
+            keyfile_json = json.load(f)
+        self.project_id = keyfile_json["project_id"]
+        self.agent_id = agent_id
+        self.location = location
+        self.logger = logger
+        self.language = language
+        self.listen_timeout = listen_timeout
+        self.phrase_time_limit = phrase_time_limit
+        self.end_silence = end_silence
+        self.result_timeout = result_timeout
+        self.max_idle = max_idle
+        self.energy_threshold = energy_threshold
+        self.max_reopens = max_reopens
+        self.reopen_delay = reopen_delay
+        self.client = dialogflowcx_v3.SessionsClient(
+            credentials=service_account.Credentials.from_service_account_info(keyfile_json),
+            client_options={"api_endpoint": api_endpoint(location)},
+        )
+
+        self.sample_rate = sample_rate
+        self.opened = 0
+        self.reopened = 0
+        self.turns = 0
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._waiting = None  # stream opened for the next turn
+        self._active = None  # stream of the current turn
+        self._utterance = []  # chunks sent in the current turn, replayed if the stream is reopened
+        self._preroll = collections.deque(maxlen=2)
+        self._noise = None
+        self._speech_started = None
+        self._last_speech = None
+        self._speech_event = threading.Event()
+        self._stop = threading.Event()
+        self._keeper = threading.Thread(target=self._keep_fresh, name="intent-stream", daemon=True)
+        self._keeper.start()
+
+    def register_callback(self, callback):
+        """Register a callable(RecognitionResult) for the interim recognition results."""
+        self._callbacks.append(callback)
+
+    def _session_path(self, session_id):
+        return self.client.session_path(self.project_id, self.location, self.agent_id, str(session_id))
+
+    def _open(self, session_id):
+        stream = _Stream(session_id, self.sample_rate)
+        config = dialogflowcx_v3.QueryInput(
+            audio=dialogflowcx_v3.AudioInput(config=dialogflowcx_v3.InputAudioConfig(
+                audio_encoding=dialogflowcx_v3.AudioEncoding.AUDIO_ENCODING_LINEAR_16,
+                sample_rate_hertz=stream.sample_rate)),
+            language_code=self.language)
+
+        def requests():
+            yield dialogflowcx_v3.StreamingDetectIntentRequest(
+                session=self._session_path(session_id), query_input=config)
+            while True:
+                chunk = stream.audio.get()
+                if chunk is _END:
+                    return
+                yield dialogflowcx_v3.StreamingDetectIntentRequest(query_input=dialogflowcx_v3.QueryInput(
+                    audio=dialogflowcx_v3.AudioInput(audio=bytes(chunk)), language_code=self.language))
+
+        def read():
+            try:
+                for response in stream.call:
+                    recognition = response.recognition_result
+                    if recognition and recognition.transcript:
+                        for callback in self._callbacks:
+                            callback(RecognitionResult(response))
+                    if recognition and recognition.is_final:
+                        stream.audio.put(_END)
+                    if response.detect_intent_response and response.detect_intent_response.query_result:
+                        stream.result = QueryResult(response.detect_intent_response)
+                        break
+            except Exception as e:
+                stream.fail(e)
+                return
+            stream.done.set()
+
+        try:
+            stream.call = self.client.streaming_detect_intent(requests=requests())
+        except Exception as e:
+            stream.fail(e)
+            return stream
+        threading.Thread(target=read, name="intent-stream-reader", daemon=True).start()
+        self.opened += 1
+        return stream
+
+    def _fresh(self, stream, session_id):
+        return (stream is not None and stream.alive and stream.session_id == session_id
+                and stream.sample_rate == self.sample_rate and time.time() - stream.opened < self.max_idle)
+
+    def _keep_fresh(self):
+        # Replace the waiting stream before it runs into the server's limits
+        while not self._stop.wait(1.0):
+            with self._lock:
+                stream = self._waiting
+                if stream is None or self._fresh(stream, stream.session_id):
+                    continue
+                stream.cancel()
+                self._waiting = self._open(stream.session_id)
+
+    def on_audio(self, message):
+        """Microphone callback: segment the utterance and send its audio to the active stream."""
+        self.sample_rate = message.sample_rate
+        samples = np.frombuffer(message.waveform, dtype="<i2").astype(np.float32)
+        rms = float(np.sqrt(np.mean(samples ** 2))) if len(samples) else 0.0
+        now = time.time()
+
+        with self._lock:
+            stream = self._active
+            if stream is None:
+                self._preroll.append(message.waveform)
+                # The noise floor is learned while nobody is expected to speak
+                self._noise = rms if self._noise is None else 0.9 * self._noise + 0.1 * rms
+                return
+
+            speech = rms > max(self.energy_threshold, 2.5 * (self._noise or 0.0))
+            if self._speech_started is None:
+                if not speech:
+                    self._preroll.append(message.waveform)
+                    return
+                self._speech_started = self._last_speech = now
+                self._speech_event.set()
+                chunks = list(self._preroll) + [message.waveform]
+                self._preroll.clear()
+            else:
+                chunks = [message.waveform]
+                if speech:
+                    self._last_speech = now
+
+            for chunk in chunks:
+                self._utterance.append(chunk)
+                stream.audio.put(chunk)
+            if now - self._last_speech >= self.end_silence or now - self._speech_started >= self.phrase_time_limit:
+                stream.audio.put(_END)
+
+    def request(self, request, block=True):
+        """
+        Listen for one utterance and detect its intent.
+
+        Args:
+            request: DetectIntentRequest, its session_id is used for the agent session.
+
+        Returns:
+            QueryResult, without intent when nothing was said within listen_timeout.
+        """
+        session_id = request.session_id
+        with self._lock:
+            if self._active is not None:
+                # A turn that was abandoned (e.g. by the circuit breaker's call timeout)
+                self._active.cancel()
+            stream = self._waiting if self._fresh(self._waiting, session_id) else None
+            if stream is None:
+                if self._waiting is not None:
+                    self._waiting.cancel()
+                stream = self._open(session_id)
+            self._waiting = None
+            self._active = stream
+            self._utterance = []
+            self._speech_started = self._last_speech = None
+            self._speech_event.clear()
+            self.turns += 1
+
+        try:
+            if not self._speech_event.wait(self.listen_timeout):
+                with self._lock:
+                    if self._speech_started is None:
+                        # Nothing said: the stream has not sent audio and is kept for the next turn
+                        self._active = None
+                        self._waiting = stream
+                        return _empty_result()
+
+            deadline = time.time() + self.phrase_time_limit + self.result_timeout
+            reopens = 0
+            while True:
+                stream.done.wait(max(0.0, deadline - time.time()))
+                if stream.error is None:
+                    break
+                delay = self.reopen_delay * 2 ** reopens
+                if reopens >= self.max_reopens or time.time() + delay > deadline:
+                    raise stream.error
+                # Transparent reopen: a new stream gets the utterance so far and the rest of it
+                self.logger.warning("Intent stream failed ({}), reopening in {:.1f}s".format(stream.error, delay))
+                reopens += 1
+                if self._stop.wait(delay):
+                    raise stream.error
+                with self._lock:
+                    stream = self._open(session_id)
+                    for chunk in self._utterance:
+                        stream.audio.put(chunk)
+                    if self._speech_started is not None and (
+                            time.time() - self._last_speech >= self.end_silence):
+                        stream.audio.put(_END)
+                    self._active = stream
+                    self.reopened += 1
+            if not stream.done.is_set():
+                stream.cancel()
+                raise RuntimeError("No intent within {:.0f}s of the utterance".format(
+                    self.phrase_time_limit + self.result_timeout))
+            return stream.result or _empty_result()
+        finally:
+            with self._lock:
+                if self._active is stream:
+                    self._active = None
+                # The next turn's stream is set up while this turn's intent is performed
+                if self._waiting is None and stream.done.is_set():
+                    self._waiting = self._open(session_id)
+
+    def stats(self):
+        return {"turns": self.turns, "streams_opened": self.opened, "reopened": self.reopened}
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            for stream in (self._waiting, self._active):
+                if stream is not None:
+                    stream.cancel()
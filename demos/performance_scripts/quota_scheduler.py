@@ -0,0 +1,202 @@
+"""
+Paces Google API requests to the project's per-minute quotas, across machines.
+
+In rehearsals several machines call Dialogflow CX on the same Google Cloud project at
+once and the per-minute quota is hit in bursts of errors. The scheduler keeps a token
+bucket per API and project in the local Redis server (the one of scene_checkpoint.py),
+refilled at the quota rate; every request takes a token first and waits when the
+bucket is empty. The bucket is updated by a Lua script on Redis' own clock, so all
+machines share it without clock differences.
+
+Live-show requests have priority over background traffic (rehearsal batches such as
+intent_regression.py): background requests leave a reserve of tokens untouched and
+also yield to live requests waiting in the same process. How long requests waited is
+kept per API and priority.
+
+If Redis is not reachable, a bucket in this process is used, so the show never waits on Redis.
+
+Usage:
+    scheduler = QuotaScheduler(logger, project_id)
+    waited = scheduler.acquire("dialogflow_cx")               # live
+    scheduler.acquire("dialogflow_cx", priority=BACKGROUND)   # rehearsal batch
+"""
+
+import threading
+import time
+from collections import defaultdict
+
+from lazy_imports import lazy_attr, lazy_import
+
+# Imported on first use, so text_intent.py can use the priorities without Redis installed
+redis = lazy_import("redis")
+connect_redis = lazy_attr("scene_checkpoint", "connect_redis")
+
+LIVE, BACKGROUND = "live", "background"
+
+# Requests per minute per API; set these to the quotas of the Google Cloud project
+# (IAM & Admin > Quotas), shared by every machine that uses the project
+QUOTAS = {
+    "dialogflow_cx": 600,
+    "dialogflow_es": 180,
+    "google_stt": 900,
+    "google_tts": 1000,
+}
+
+# Bursts of up to this many seconds of quota are let through at once
+BURST_SECONDS = 10.0
+
+# Seconds before Redis is tried again after it failed, so requests do not pay the connect timeout
+REDIS_RETRY_INTERVAL = 10.0
+
+# Takes cost tokens from a bucket if more than reserve are left, otherwise returns the
+# seconds until they are. KEYS[1] = bucket, ARGV = rate (tokens/s), capacity, cost, reserve
+_TAKE_SCRIPT = """
+if redis.replicate_commands then redis.replicate_commands() end
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local rate, capacity = tonumber(ARGV[1]), tonumber(ARGV[2])
+local cost, reserve = tonumber(ARGV[3]), tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= cost + reserve then
+    tokens = tokens - cost
+else
+    wait = (cost + reserve - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return tostring(wait)
+"""
+
+
+class QuotaTimeoutError(Exception):
+    """A request would have waited longer than its timeout for quota."""
+
+
+class _LocalBucket(object):
+    """Token bucket of this process, used while Redis is not reachable."""
+
+    def __init__(self, capacity):
+        self.tokens = capacity
+        self.ts = time.time()
+
+    def take(self, rate, capacity, cost, reserve):
+        now = time.time()
+        self.tokens = min(capacity, self.tokens + max(0.0, now - self.ts) * rate)
+        self.ts = now
+        if self.tokens >= cost + reserve:
+            self.tokens -= cost
+            return 0.0
+        return (cost + reserve - self.tokens) / rate
+
+
+class QuotaScheduler(object):
+    """
+    Token buckets per API and project, shared through Redis.
+
+    Args:
+        logger: Logger of the application.
+        project_id: Google Cloud project the quotas belong to.
+        client: Redis client, by default connected with connect_redis().
+        quotas: dict of API -> requests per minute, by default QUOTAS.
+        reserve: Fraction of the bucket that background requests leave for live ones.
+        on_wait: Optional callable(api, priority, seconds) called after every acquire, e.g. for metrics.
+    """
+
+    def __init__(self, logger, project_id, client=None, quotas=None, reserve=0.2, on_wait=None):
+        self.logger = logger
+        self.project_id = project_id
+        self.client = client if client is not None else connect_redis()
+        self.quotas = dict(QUOTAS if quotas is None else quotas)
+        self.reserve = reserve
+        self.on_wait = on_wait
+        self._script = self.client.register_script(_TAKE_SCRIPT)
+        self._local = {}
+        self._redis_retry_at = 0.0
+        self._live_waiting = 0
+        self._lock = threading.Lock()
+        # (api, priority) -> [requests, seconds waited, longest wait]
+        self._waits = defaultdict(lambda: [0, 0.0, 0.0])
+
+    def _bucket(self, api):
+        rate = self.quotas[api] / 60.0
+        return rate, max(1.0, rate * BURST_SECONDS)
+
+    def _take(self, api, cost, reserve):
+        rate, capacity = self._bucket(api)
+        if time.time() >= self._redis_retry_at:
+            try:
+                wait = float(self._script(keys=["sir:quota:{}:{}".format(self.project_id, api)],
+                                          args=[rate, capacity, cost, reserve * capacity]))
+                if self._redis_retry_at:
+                    self.logger.info("Quota buckets are shared through Redis again")
+                    self._redis_retry_at = 0.0
+                return wait
+            except redis.RedisError as e:
+                if not self._redis_retry_at:
+                    self.logger.warning("Redis unavailable, pacing requests in this process only: {}".format(e))
+                self._redis_retry_at = time.time() + REDIS_RETRY_INTERVAL
+        with self._lock:
+            bucket = self._local.setdefault(api, _LocalBucket(capacity))
+            return bucket.take(rate, capacity, cost, reserve * capacity)
+
+    def acquire(self, api, priority=LIVE, cost=1, timeout=None):
+        """
+        Wait until the quota of an API allows another request.
+
+        Args:
+            api: Key of QUOTAS, e.g. "dialogflow_cx". APIs without a quota are not paced.
+            priority: LIVE or BACKGROUND.
+            cost: Number of requests (tokens) taken.
+            timeout: Maximum seconds to wait, None to wait as long as needed.
+
+        Returns:
+            float: Seconds the request waited.
+
+        Raises:
+            QuotaTimeoutError: The quota would not allow the request within the timeout.
+        """
+        if api not in self.quotas:
+            return 0.0
+        start = time.time()
+        live = priority == LIVE
+        if live:
+            with self._lock:
+                self._live_waiting += 1
+        try:
+            while True:
+                if not live and self._live_waiting:
+                    wait = 0.05
+                else:
+                    wait = self._take(api, cost, 0.0 if live else self.reserve)
+                if wait <= 0:
+                    break
+                if timeout is not None and time.time() - start + wait > timeout:
+                    raise QuotaTimeoutError("{} quota allows no request within {:.1f}s".format(api, timeout))
+                time.sleep(min(wait, 1.0))
+        finally:
+            if live:
+                with self._lock:
+                    self._live_waiting -= 1
+
+        waited = time.time() - start
+        with self._lock:
+            record = self._waits[(api, priority)]
+            record[0] += 1
+            record[1] += waited
+            record[2] = max(record[2], waited)
+        if waited > 0.5:
+            self.logger.info("{} {} request waited {:.2f}s for quota".format(priority, api, waited))
+        if self.on_wait is not None:
+            self.on_wait(api, priority, waited)
+        return waited
+
+    def stats(self):
+        """Return a dict of "api/priority" -> requests, mean and longest wait in seconds."""
+        with self._lock:
+            return {"{}/{}".format(api, priority): {"requests": n, "mean_wait_s": round(total / n, 3),
+                                                     "max_wait_s": round(longest, 3)}
+                    for (api, priority), (n, total, longest) in self._waits.items()}
@@ -0,0 +1,109 @@
+"""
+Keeps spoken replies within a speaking-time budget per intent.
+
+Dialogflow CX's generative replies can run much longer than the scene allows (the
+empathy reply of asking_for_help took over 40 seconds). The shaper estimates how long
+NAO needs to say a reply; a reply over the budget of its intent is trimmed to the
+sentences that fit, or, when not even the first sentence fits, replaced by the canned
+line of the scene file. The canned line, whether it replaces a reply or is said because
+there is none, is held to the same budget. How often each path is taken is counted
+per intent.
+
+The budgets are SPEAKING_BUDGETS in scene_script.py, seconds per intent, with
+"default" for the other intents.
+"""
+
+import threading
+from collections import Counter
+
+from text_chunker import WORDS_PER_SECOND, split_sentences
+
+# Pause NAO makes at the end of a sentence (seconds)
+SENTENCE_PAUSE = 0.3
+
+DEFAULT_BUDGET = 20.0
+
+# Paths a reply can take
+AS_IS, TRIMMED, CANNED, CANNED_TRIMMED = "as_is", "trimmed", "canned", "canned_trimmed"
+
+
+def estimate_speech_duration(text, words_per_second=WORDS_PER_SECOND):
+    """Estimate how many seconds NAO needs to say a text."""
+    return len(text.split()) / float(words_per_second) + SENTENCE_PAUSE * len(split_sentences(text))
+
+
+def fit_sentences(text, budget):
+    """Return the leading sentences of text that can be said within budget seconds ("" if none)."""
+    kept = []
+    used = 0.0
+    for sentence in split_sentences(text):
+        used += estimate_speech_duration(sentence)
+        if used > budget:
+            break
+        kept.append(sentence)
+    return " ".join(kept)
+
+
+class ReplyShaper(object):
+    """
+    Trims or replaces replies that exceed the speaking-time budget of their intent.
+
+    Args:
+        logger: Logger of the application.
+        budgets: dict of intent -> budget in seconds, "default" for the other intents.
+    """
+
+    def __init__(self, logger, budgets=None):
+        self.logger = logger
+        self.budgets = dict(budgets or {})
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def budget(self, intent):
+        return self.budgets.get(intent, self.budgets.get("default", DEFAULT_BUDGET))
+
+    def shape(self, intent, generated, canned):
+        """
+        Return the text to say for a reply.
+
+        Args:
+            intent: The intent the reply belongs to (None if unknown).
+            generated: The generative reply, or None to say the canned line.
+            canned: The canned line of the scene file.
+
+        Returns:
+            str: The generated reply or the canned line, or their first sentences.
+        """
+        budget = self.budget(intent)
+        text = None
+        if generated:
+            duration = estimate_speech_duration(generated)
+            if duration <= budget:
+                path, text = AS_IS, generated
+            else:
+                text = fit_sentences(generated, budget)
+                path = TRIMMED
+                self.logger.info("Reply for {} takes about {:.0f}s (budget {:.0f}s), {}".format(
+                    intent, duration, budget, "trimmed" if text else "using the canned line"))
+        if not text:
+            duration = estimate_speech_duration(canned)
+            if duration <= budget:
+                path, text = CANNED, canned
+            else:
+                # Not even the first sentence fitting still says the first sentence
+                text = fit_sentences(canned, budget) or (split_sentences(canned) or [canned])[0]
+                path = CANNED_TRIMMED
+                self.logger.info("Canned line for {} takes about {:.0f}s (budget {:.0f}s), trimmed".format(
+                    intent, duration, budget))
+
+        with self._lock:
+            self.counts[(intent, path)] += 1
+        return text
+
+    def stats(self):
+        """Return a dict of intent -> {path: count}."""
+        with self._lock:
+            counts = {}
+            for (intent, path), count in self.counts.items():
+                counts.setdefault(intent or "unknown", {})[path] = count
+        return counts
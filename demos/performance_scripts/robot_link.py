@@ -0,0 +1,247 @@
+"""
+Keeps the connection to a NAO alive through short Wi-Fi drops.
+
+When the robot's Wi-Fi dropped for a second, the device connectors failed and the
+whole application had to be restarted. ResilientDevice wraps a Nao and watches the
+robot with a cheap TCP probe (and every failing request). During an outage requests
+are not sent but handled by their policy:
+
+- state (posture, rest and wake up share one slot; breathing): only the last one per
+  slot is kept, and they are restored in the order they were last set,
+- queue (speech): kept in order, up to a maximum age,
+- drop (gestures, sounds, moves): a gesture that comes late is worse than none, and a
+  stale move would walk the robot after the scene has gone on.
+
+When the robot answers again, the kept state is restored first and then the queued
+requests are replayed, on the existing connection if it still works, otherwise on a
+new Nao device; reconnect attempts back off exponentially. Recovery takes seconds
+instead of a restart of the application. What was set up on the old device besides
+requests (callbacks on its connectors, its SSH session) is gone with a new device, so
+its owners re-attach in an on_reconnect callback.
+
+Usage:
+    nao = ResilientDevice(lambda: Nao(ip=ip, dev_test=False), ip, logger)
+    nao.tts.request(NaoqiTextToSpeechRequest("Hello"))    # like on a Nao
+    nao.on_reconnect(lambda device: device.top_camera.register_callback(on_image))
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+from multi_robot import tcp_clock_probe
+
+STATE, QUEUE, DROP = "state", "queue", "drop"
+
+# Policy per request class during an outage, QUEUE for the others
+REQUEST_POLICY = {
+    "NaoPostureRequest": STATE,
+    "NaoqiBreathingRequest": STATE,
+    "NaoRestRequest": STATE,
+    "NaoWakeUpRequest": STATE,
+    "NaoqiTextToSpeechRequest": QUEUE,
+    "NaoqiAnimationRequest": DROP,
+    "NaoqiMoveRequest": DROP,
+    "AudioRequest": DROP,
+}
+
+# State requests that overwrite each other: the robot ends in the pose of the last one
+STATE_SLOTS = {
+    "NaoPostureRequest": "posture",
+    "NaoRestRequest": "posture",
+    "NaoWakeUpRequest": "posture",
+    "NaoqiBreathingRequest": "breathing",
+}
+
+COMPONENTS = ("tts", "motion", "speaker", "autonomous", "leds")
+
+
+class _ResilientConnector(object):
+    def __init__(self, link, component):
+        self._link = link
+        self._component = component
+
+    def request(self, request, block=True, **kwargs):
+        return self._link.request(self._component, request, block=block, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(getattr(self._link.device, self._component), attr)
+
+
+class ResilientDevice(object):
+    """
+    Wraps a Nao so that short outages of the robot are bridged instead of fatal.
+
+    Args:
+        factory: Callable returning a new connected device, e.g. lambda: Nao(ip=ip).
+        ip: IP of the robot, for the reachability probe.
+        logger: Logger of the application.
+        probe: Callable raising when the robot is unreachable, by default a TCP connect to NAOqi.
+        probe_interval: Seconds between two probes while the robot is up.
+        max_backoff: Longest wait between two reconnect attempts.
+        max_queue_age: Seconds after which queued requests are no longer replayed.
+        max_queue: Maximum number of queued requests, the oldest are dropped.
+    """
+
+    def __init__(self, factory, ip, logger, probe=None, probe_interval=1.0, max_backoff=10.0,
+                 max_queue_age=15.0, max_queue=20):
+        self.factory = factory
+        self.ip = ip
+        self.logger = logger
+        self.probe = probe or tcp_clock_probe(ip, timeout=0.5)
+        self.probe_interval = probe_interval
+        self.max_backoff = max_backoff
+        self.max_queue_age = max_queue_age
+        self.device = factory()
+        self.up = True
+        self.outages = 0
+        self.reconnects = 0
+        self.dropped = 0
+        self.replayed = 0
+        self.down_since = None
+        self.recovery_times = []
+        self._state = OrderedDict()  # state slot -> (component, request), in the order last set
+        self._reconnect_callbacks = []
+        self._queue = deque(maxlen=max_queue)  # (time, component, request, block, kwargs)
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        for component in COMPONENTS:
+            setattr(self, component, _ResilientConnector(self, component))
+        self._thread = threading.Thread(target=self._watch, name="robot-link-" + ip, daemon=True)
+        self._thread.start()
+
+    def __getattr__(self, attr):
+        # Everything else (ssh, mic, ...) is taken from the current device
+        return getattr(self.__dict__["device"], attr)
+
+    def on_reconnect(self, callback):
+        """Call callback(device) with every new device, before the held requests are replayed on it."""
+        self._reconnect_callbacks.append(callback)
+
+    def _reachable(self):
+        try:
+            self.probe()
+            return True
+        except Exception:
+            return False
+
+    def request(self, component, request, block=True, **kwargs):
+        """
+        Send a request to a component of the robot, or handle it by its policy during an outage.
+
+        Returns:
+            The reply, or None when the robot is down.
+        """
+        policy = REQUEST_POLICY.get(type(request).__name__, QUEUE)
+        with self._lock:
+            if policy == STATE:
+                slot = STATE_SLOTS.get(type(request).__name__, type(request).__name__)
+                self._state[slot] = (component, request)
+                self._state.move_to_end(slot)
+            if not self.up:
+                self._hold(policy, component, request, block, kwargs)
+                return None
+            device = self.device
+        try:
+            return getattr(device, component).request(request, block=block, **kwargs)
+        except Exception as e:
+            if self._reachable():
+                raise
+            self._mark_down(e)
+            with self._lock:
+                self._hold(policy, component, request, block, kwargs)
+            return None
+
+    def _hold(self, policy, component, request, block, kwargs):
+        if policy == QUEUE:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+            self._queue.append((time.time(), component, request, block, kwargs))
+        elif policy == DROP:
+            self.dropped += 1
+
+    def _mark_down(self, reason):
+        with self._lock:
+            if not self.up:
+                return
+            self.up = False
+            self.outages += 1
+            self.down_since = time.time()
+        self.logger.warning("Robot {} unreachable ({}), holding requests until it is back".format(self.ip, reason))
+        self._wake.set()
+
+    def _watch(self):
+        backoff = 0.5
+        while not self._stop.is_set():
+            if self.up:
+                self._wake.wait(self.probe_interval)
+                self._wake.clear()
+                if self.up and not self._reachable():
+                    self._mark_down("no answer on port probe")
+                backoff = 0.5
+                continue
+
+            if self._reachable() and self._resume():
+                continue
+            self._stop.wait(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def _resume(self):
+        """Restore the state and replay the queue, on the current device or a new one. Returns True if up."""
+        for attempt in ("current", "new"):
+            if attempt == "new":
+                try:
+                    device = self.factory()
+                except Exception as e:
+                    self.logger.warning("Reconnecting to robot {} failed: {}".format(self.ip, e))
+                    return False
+                with self._lock:
+                    self.device = device
+                self.reconnects += 1
+                for callback in self._reconnect_callbacks:
+                    try:
+                        callback(device)
+                    except Exception as e:
+                        self.logger.warning("Re-attaching to robot {} failed: {}".format(self.ip, e))
+            try:
+                self._replay()
+            except Exception as e:
+                self.logger.info("Robot {} needs a new connection: {}".format(self.ip, e))
+                continue
+            return True
+        return False
+
+    def _replay(self):
+        with self._lock:
+            device = self.device
+            state = list(self._state.values())
+        for component, request in state:
+            getattr(device, component).request(request, block=False)
+
+        while True:
+            with self._lock:
+                if not self._queue:
+                    # Nothing sent since the check: new requests go straight to the robot again
+                    self.up = True
+                    recovery = time.time() - self.down_since
+                    self.recovery_times.append(recovery)
+                    break
+                queued_at, component, request, block, kwargs = self._queue[0]
+            if time.time() - queued_at <= self.max_queue_age:
+                getattr(device, component).request(request, block=block, **kwargs)
+                self.replayed += 1
+            else:
+                self.dropped += 1
+            with self._lock:
+                self._queue.popleft()
+        self.logger.info("Robot {} back after {:.1f}s".format(self.ip, recovery))
+
+    def stats(self):
+        return {"outages": self.outages, "reconnects": self.reconnects, "replayed": self.replayed,
+                "dropped": self.dropped,
+                "max_recovery_s": round(max(self.recovery_times), 1) if self.recovery_times else None}
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
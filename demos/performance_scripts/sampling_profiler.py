@@ -0,0 +1,168 @@
+"""
+Low-overhead sampling profiler for live shows.
+
+A background thread takes the stacks of all threads (sys._current_frames) at a fixed
+rate and counts them. On shutdown, or when the process receives SIGUSR1, the counts
+are written as collapsed stacks ("thread;outer;...;inner count" per line), which
+flamegraph.pl, speedscope or inferno turn into a flame graph. A full show can be
+profiled without restarting it under a profiler; pauses show up as wide frames.
+
+Switched on with environment variables:
+    SIC_PROFILE=1           enable the profiler
+    SIC_PROFILE_HZ=100      samples per second (default 100)
+    SIC_PROFILE_DIR=.       directory of the .collapsed files (default the working directory)
+
+Stacks are counted as tuples of (file, function, current line) and only formatted when the
+profile is written, so a tick costs little more than walking the frames.
+
+Usage in a SICApplication, the mixin starts the profiler after SICApplication.__init__
+and writes the profile in cleanup_resources (shutdown, SIGINT/SIGTERM and exit):
+    class MyDemo(ProfiledApplication, SICApplication):
+        ...
+    self.profiler                                     # None unless SIC_PROFILE is set
+
+Or by hand:
+    profiler = profiler_from_env(logger)
+    ...
+    if profiler is not None:
+        profiler.stop()                               # writes the profile
+"""
+
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+
+def _format_frame(key):
+    filename, name, line = key
+    return "{} ({}:{})".format(name, os.path.basename(filename), line)
+
+
+class SamplingProfiler(object):
+    """
+    Samples the stacks of all threads from a background thread.
+
+    Args:
+        logger: Logger of the application.
+        hz: Samples per second.
+        output_dir: Directory the collapsed stack files are written to.
+    """
+
+    def __init__(self, logger, hz=100, output_dir="."):
+        self.logger = logger
+        self.interval = 1.0 / hz
+        self.output_dir = output_dir
+        self.samples = 0
+        self._stacks = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = None
+
+    def start(self):
+        self._started = time.time()
+        self._thread = threading.Thread(target=self._sample_loop, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def _sample_loop(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            frames = sys._current_frames()
+            stacks = []
+            for ident, frame in frames.items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_name, frame.f_lineno))
+                    frame = frame.f_back
+                stacks.append((names.get(ident, str(ident)), tuple(stack)))
+            del frames
+            with self._lock:
+                self._stacks.update(stacks)
+                self.samples += 1
+
+    def dump(self, path=None):
+        """
+        Write the stacks sampled so far as collapsed stacks.
+
+        Args:
+            path: Output file, by default profile-<pid>-<time>.collapsed in the output directory.
+
+        Returns:
+            str: The path of the written file.
+        """
+        if path is None:
+            path = os.path.join(self.output_dir, "profile-{}-{}.collapsed".format(
+                os.getpid(), time.strftime("%Y%m%d-%H%M%S")))
+        with self._lock:
+            stacks = self._stacks.most_common()
+            samples = self.samples
+        with open(path, "w") as f:
+            for (thread, stack), count in stacks:
+                names = [thread] + [_format_frame(key) for key in reversed(stack)]
+                f.write("{} {}\n".format(";".join(names), count))
+        self.logger.info("Profile of {} samples ({:.0f}s) written to {}".format(
+            samples, time.time() - self._started, path))
+        return path
+
+    def install_signal_handler(self, signum=getattr(signal, "SIGUSR1", None)):
+        """Write the profile when the process receives SIGUSR1. Must be called from the main thread."""
+        if signum is not None:
+            signal.signal(signum, lambda s, frame: self.dump())
+
+    def stop(self):
+        """Stop sampling and write the profile."""
+        if self._thread is None:
+            return None
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        return self.dump()
+
+
+def profiler_from_env(logger, environ=os.environ):
+    """
+    Start a SamplingProfiler if SIC_PROFILE is set.
+
+    Returns:
+        SamplingProfiler or None
+    """
+    if environ.get("SIC_PROFILE", "0") in ("", "0"):
+        return None
+    profiler = SamplingProfiler(
+        logger,
+        hz=float(environ.get("SIC_PROFILE_HZ", 100)),
+        output_dir=environ.get("SIC_PROFILE_DIR", "."),
+    )
+    profiler.start()
+    if threading.current_thread() is threading.main_thread():
+        profiler.install_signal_handler()
+    logger.info("Sampling profiler running at {} Hz, send SIGUSR1 to write the profile".format(
+        environ.get("SIC_PROFILE_HZ", 100)))
+    return profiler
+
+
+class ProfiledApplication(object):
+    """
+    Mixin that gives a SICApplication the profiler of SIC_PROFILE.
+
+    Put it before SICApplication in the bases. The profiler (or None) is self.profiler.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ProfiledApplication, self).__init__(*args, **kwargs)
+        # SICApplication is a singleton, __init__ can run more than once
+        if not hasattr(self, "profiler"):
+            self.profiler = profiler_from_env(self.logger)
+
+    def cleanup_resources(self, *args, **kwargs):
+        profiler, self.profiler = getattr(self, "profiler", None), None
+        if profiler is not None:
+            profiler.stop()
+        return super(ProfiledApplication, self).cleanup_resources(*args, **kwargs)
@@ -0,0 +1,155 @@
+"""
+Scene checkpoints stored in the local Redis server.
+
+The performance script saves its position in the show (scene index, Dialogflow CX
+session id, robot posture and the actions that were still pending) on every
+transition. After a crash the script can be started with --resume to continue
+from the last checkpoint instead of starting the show from zero.
+
+The connection settings are read from conf/redis/redis.conf (port and requirepass),
+and can be overridden with the DB_IP / DB_PASS environment variables, the same ones
+the SIC framework uses (see .env).
+"""
+
+import json
+import os
+import time
+from os.path import abspath, dirname, join
+
+import redis
+from redis.backoff import NoBackoff
+from redis.retry import Retry
+
+REDIS_CONF_PATH = abspath(join(dirname(__file__), "..", "..", "conf", "redis", "redis.conf"))
+
+
+def read_redis_conf(path=REDIS_CONF_PATH):
+    """
+    Read the port and password from a redis.conf file.
+
+    Args:
+        path: Path to the redis.conf file.
+
+    Returns:
+        dict with "port" and "password" (defaults when the file or option is missing).
+    """
+    settings = {"port": 6379, "password": None}
+    try:
+        with open(path) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 2 or parts[0].startswith("#"):
+                    continue
+                if parts[0] == "port" and parts[1] != "0":
+                    settings["port"] = int(parts[1])
+                elif parts[0] == "tls-port":
+                    settings["port"] = int(parts[1])
+                elif parts[0] == "requirepass":
+                    settings["password"] = parts[1]
+    except IOError:
+        pass
+    return settings
+
+
+def connect_redis(conf_path=REDIS_CONF_PATH, timeout=0.5, retries=None):
+    """
+    Connect to the Redis server configured in conf/redis/redis.conf.
+
+    Args:
+        conf_path: Path to the redis.conf file.
+        timeout: Socket (connect) timeout in seconds, kept short so a missing
+            server does not stall the show.
+        retries: Retries of a failed command without backoff, e.g. 0 for a readiness probe.
+            None keeps redis-py's default retries with backoff (several seconds when the
+            server is down).
+
+    Returns:
+        redis.Redis: The client (the connection is opened lazily by redis-py).
+    """
+    settings = read_redis_conf(conf_path)
+    options = {}
+    if retries is not None:
+        options["retry"] = Retry(NoBackoff(), retries)
+    return redis.Redis(
+        host=os.environ.get("DB_IP", "localhost"),
+        port=settings["port"],
+        password=os.environ.get("DB_PASS", settings["password"]),
+        socket_timeout=timeout,
+        socket_connect_timeout=timeout,
+        **options
+    )
+
+
+class SceneCheckpoint(object):
+    """
+    Saves and restores the state of the performance in Redis.
+
+    The whole state is stored as a single JSON value, so saving is one SET and
+    restoring is one GET.
+
+    Args:
+        logger: Logger of the application.
+        client: Redis client, by default connected with connect_redis().
+        key: Redis key the checkpoint is stored under.
+    """
+
+    def __init__(self, logger, client=None, key="sir:performance:checkpoint"):
+        self.logger = logger
+        self.client = client if client is not None else connect_redis()
+        self.key = key
+
+    def save(self, scene, session_id, posture, pending_actions=()):
+        """
+        Store the current state of the show.
+
+        Failures are logged and ignored: losing a checkpoint must never stop the show.
+
+        Args:
+            scene: Current scene index.
+            session_id: Dialogflow CX session id.
+            posture: Last posture requested for the robot, e.g. "Stand".
+            pending_actions: Intents whose actions have not finished yet.
+
+        Returns:
+            bool: True if the checkpoint was written.
+        """
+        state = {
+            "scene": scene,
+            "session_id": session_id,
+            "posture": posture,
+            "pending_actions": list(pending_actions),
+            "saved_at": time.time(),
+        }
+        try:
+            self.client.set(self.key, json.dumps(state))
+            return True
+        except redis.RedisError as e:
+            self.logger.warning("Could not save checkpoint: {}".format(e))
+            return False
+
+    def load(self):
+        """
+        Read the last checkpoint.
+
+        Returns:
+            dict with the saved state, or None if there is no (readable) checkpoint.
+        """
+        try:
+            raw = self.client.get(self.key)
+        except redis.RedisError as e:
+            self.logger.warning("Could not read checkpoint: {}".format(e))
+            return None
+        if raw is None:
+            return None
+        try:
+            return json.loads(raw)
+        except ValueError:
+            self.logger.warning("Ignoring corrupt checkpoint")
+            return None
+
+    def clear(self):
+        """Remove the checkpoint, e.g. when the show ended normally."""
+        try:
+            self.client.delete(self.key)
+        except redis.RedisError as e:
+            self.logger.warning("Could not clear checkpoint: {}".format(e))
@@ -0,0 +1,342 @@
+"""
+Performs the scene content of scene_script.py on the robot, with hot reload.
+
+The scene file is loaded with runpy, so it can be reloaded at any moment without
+touching the connections to the robot and the services. A reload happens when the
+file changes on disk or when the process receives SIGHUP (not available on Windows);
+both are handled on a background thread, the signal handler only flags the request.
+If the new file cannot be loaded or contains an unknown step, the error is logged and
+the previous content stays in use.
+"""
+
+import os
+import runpy
+import signal
+import threading
+import time
+
+from lazy_imports import lazy_attr
+
+NaoqiTextToSpeechRequest = lazy_attr("sic_framework.devices.nao", "NaoqiTextToSpeechRequest")
+NaoqiAnimationRequest, NaoPostureRequest, NaoqiMoveRequest, NaoqiBreathingRequest = lazy_attr(
+    "sic_framework.devices.common_naoqi.naoqi_motion",
+    "NaoqiAnimationRequest",
+    "NaoPostureRequest",
+    "NaoqiMoveRequest",
+    "NaoqiBreathingRequest",
+)
+NaoRestRequest = lazy_attr("sic_framework.devices.common_naoqi.naoqi_autonomous", "NaoRestRequest")
+
+SCENE_SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scene_script.py")
+
+# Pseudo intent for the steps performed when entering a scene
+ENTER = "__enter__"
+
+STEP_TYPES = (
+    "log", "say", "gesture", "posture", "breathing", "move", "sound",
+    "sleep", "rest", "end_show", "next_scene",
+)
+
+
+class SceneScriptError(Exception):
+    """Raised when the scene file contains an invalid step."""
+
+
+def validate(content):
+    """
+    Check the steps of a loaded scene file.
+
+    Args:
+        content: Dict with the globals of the scene file.
+
+    Raises:
+        SceneScriptError: If a step has no known type.
+    """
+    for name in ("SCENES", "GLOBAL_INTENTS", "SOUNDS"):
+        if name not in content:
+            raise SceneScriptError("scene file does not define {}".format(name))
+
+    step_lists = [("global", intent, steps) for intent, steps in content["GLOBAL_INTENTS"].items()]
+    for index, scene in content["SCENES"].items():
+        step_lists.append((index, "enter", scene.get("enter", [])))
+        step_lists += [(index, intent, steps) for intent, steps in scene.get("intents", {}).items()]
+
+    for scene, intent, steps in step_lists:
+        for step in steps:
+            if not any(key in step for key in STEP_TYPES):
+                raise SceneScriptError("unknown step in scene {}, intent {}: {}".format(scene, intent, step))
+            if "sound" in step and step["sound"] not in content["SOUNDS"]:
+                raise SceneScriptError("unknown sound in scene {}, intent {}: {}".format(
+                    scene, intent, step["sound"]))
+
+
+class SceneRunner(object):
+    """
+    Performs intents of the scene file on behalf of the performance application.
+
+    The application provides the connections and the show state: nao, logger, scene,
+    posture, show_finished, shutdown_event, fallback_handler(reply, text),
+    parse_text_to_gesture(text) and load_sound(path), which returns the AudioRequest.
+    Several dialogue sessions can share one runner (and its compiled requests) by
+    passing their own show state to perform (see session_host.py).
+
+    Args:
+        app: The performance application.
+        path: Path of the scene file.
+        on_reload: Optional callable invoked with the runner after every successful reload.
+        poll_interval: Seconds between checks for a changed scene file, None to only reload on SIGHUP.
+    """
+
+    def __init__(self, app, path=SCENE_SCRIPT_PATH, on_reload=None, poll_interval=0.5):
+        self.app = app
+        self.path = path
+        self.on_reload = on_reload
+        self.poll_interval = poll_interval
+        self.content = None
+        self.version = 0
+        self._mtime = None
+        self._reload_lock = threading.Lock()
+        self._compiled = {}
+        self.compile_hits = 0
+        self.compile_misses = 0
+        self._watcher = None
+        self._reload_requested = False
+
+        if not self.reload():
+            raise SceneScriptError("could not load the scene file {}".format(path))
+
+    # ----------------------------------------------------------------------------- loading
+
+    def reload(self):
+        """
+        (Re)load the scene file.
+
+        Returns:
+            bool: True if the new content is in use.
+        """
+        with self._reload_lock:
+            start = time.time()
+            mtime = None
+            try:
+                mtime = os.path.getmtime(self.path)
+                content = runpy.run_path(self.path)
+                validate(content)
+            except Exception as e:
+                self.app.logger.error("Scene file not reloaded, keeping the previous version: {}".format(e))
+                if mtime is not None:
+                    # The watcher tries again when the file is saved again, not on every poll
+                    self._mtime = mtime
+                return False
+
+            # A single assignment, an intent that is being performed keeps its own snapshot
+            self.content = content
+            self._mtime = mtime
+            self.version += 1
+            self._compiled = {}
+            self.app.logger.info("Scene file loaded (version {}) in {:.3f}s".format(
+                self.version, time.time() - start))
+
+        if self.on_reload is not None:
+            self.on_reload(self)
+        return True
+
+    def watch(self):
+        """Start the background thread that reloads the scene file when it changes or on request."""
+        if self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch_loop, name="scene-watcher", daemon=True)
+        self._watcher.start()
+
+    def _watch_loop(self):
+        while not self.app.shutdown_event.is_set():
+            time.sleep(self.poll_interval or 0.5)
+            if self._reload_requested:
+                self._reload_requested = False
+                self.reload()
+                continue
+            if self.poll_interval is None:
+                continue
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                continue
+            if mtime != self._mtime:
+                self.reload()
+
+    def install_signal_handler(self):
+        """
+        Reload the scene file on SIGHUP. Must be called from the main thread.
+
+        The handler only flags the reload, the watcher thread (started here if needed)
+        performs it, so no reload runs inside the interrupted thread.
+        """
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, lambda signum, frame: setattr(self, "_reload_requested", True))
+            self.watch()
+
+    # ----------------------------------------------------------------------------- queries
+
+    def intent_order(self):
+        """Return a dict of scene index -> intents in the order of the scene file."""
+        order = {}
+        for index, scene in self.content["SCENES"].items():
+            order[index] = list(scene.get("intents", {})) or ["ready"]
+        return order
+
+    def transitions(self):
+        """Return the optional TRANSITIONS (intent -> likely next intents) of the scene file."""
+        return self.content.get("TRANSITIONS", {})
+
+    def cues(self):
+        """Return the optional CUES (name -> {"file": path, "intent": intent}) with absolute file paths."""
+        directory = os.path.dirname(self.path)
+        return {name: dict(cue, file=os.path.join(directory, cue["file"]))
+                for name, cue in self.content.get("CUES", {}).items()}
+
+    def gestures(self):
+        """Return the animations of all gesture steps of the scene file."""
+        content = self.content
+        step_lists = list(content["GLOBAL_INTENTS"].values())
+        for scene in content["SCENES"].values():
+            step_lists.append(scene.get("enter", []))
+            step_lists += list(scene.get("intents", {}).values())
+        return {step["gesture"] for steps in step_lists for step in steps if "gesture" in step}
+
+    def speaking_budgets(self):
+        """Return the optional SPEAKING_BUDGETS (intent -> seconds) of the scene file."""
+        return self.content.get("SPEAKING_BUDGETS", {})
+
+    def steps_for(self, scene, intent, content=None):
+        """Return the steps of an intent in a scene, or None if the intent has no content there."""
+        content = content or self.content
+        scene_content = content["SCENES"].get(scene, {})
+        if intent == ENTER:
+            return scene_content.get("enter", [])
+        steps = scene_content.get("intents", {}).get(intent)
+        if steps is None:
+            steps = content["GLOBAL_INTENTS"].get(intent)
+        return steps
+
+    # ----------------------------------------------------------------------------- compiling
+
+    def compile(self, scene, intent):
+        """
+        Prepare the steps of an intent: build the robot requests and load the sounds.
+
+        The result is cached per scene file version, so an intent that was prefetched
+        in the background is performed without any preparation.
+
+        Args:
+            scene: Scene index.
+            intent: Name of the intent, or ENTER for the steps performed when entering the scene.
+
+        Returns:
+            list of (step, request) tuples, or None if the intent has no content in the scene.
+        """
+        content, version = self.content, self.version
+        key = (version, scene, intent)
+        compiled = self._compiled.get(key)
+        if compiled is not None:
+            self.compile_hits += 1
+            return compiled
+
+        steps = self.steps_for(scene, intent, content)
+        if steps is None:
+            return None
+        compiled = [(step, self._compile_step(step, content)) for step in steps]
+        if version == self.version:
+            self._compiled[key] = compiled
+        self.compile_misses += 1
+        return compiled
+
+    def _compile_step(self, step, content):
+        if "say" in step and not step.get("gestures"):
+            # Request for the canned line, used unless Dialogflow CX generated another text
+            return NaoqiTextToSpeechRequest(step["say"])
+        if "gesture" in step:
+            return NaoqiAnimationRequest(step["gesture"])
+        if "posture" in step:
+            return NaoPostureRequest(step["posture"], step.get("speed", 0.5))
+        if "breathing" in step:
+            return NaoqiBreathingRequest("Body", step["breathing"])
+        if "move" in step:
+            return NaoqiMoveRequest(*step["move"])
+        if "sound" in step:
+            return self.app.load_sound(os.path.join(os.path.dirname(self.path), content["SOUNDS"][step["sound"]]))
+        if "rest" in step:
+            return NaoRestRequest()
+        return None
+
+    # ----------------------------------------------------------------------------- performing
+
+    def perform(self, intent, reply, app=None):
+        """
+        Perform the steps of an intent in the current scene.
+
+        Args:
+            intent: Name of the intent.
+            reply: The Dialogflow CX reply, or None to use the canned lines.
+            app: Show state and robot to perform on, by default the application of the runner.
+
+        Returns:
+            bool: False if the intent has no content in the current scene.
+        """
+        app = app or self.app
+        compiled = self.compile(app.scene, intent)
+        if compiled is None:
+            app.logger.info("Intent {} has no actions in scene {}".format(intent, app.scene))
+            return False
+        self._perform_steps(compiled, reply, app)
+        return True
+
+    def enter_scene(self, app=None):
+        app = app or self.app
+        app.scene += 1
+        app.logger.info("Moving to scene {}".format(app.scene))
+        if app.scene not in self.content["SCENES"]:
+            # move to next scene code, TBD
+            app.logger.info("Moving to next scene")
+            return
+        self._perform_steps(self.compile(app.scene, ENTER), None, app)
+
+    def _perform_steps(self, compiled, reply, app):
+        nao = app.nao
+        last_text = ""
+
+        for step, request in compiled:
+            if "log" in step:
+                app.logger.info(step["log"])
+            elif "say" in step:
+                text = step["say"]
+                if step.get("generative", True):
+                    text = app.fallback_handler(reply, text)
+                last_text = text
+                if step.get("gestures"):
+                    app.parse_text_to_gesture(text)
+                else:
+                    if text != step["say"]:
+                        request = NaoqiTextToSpeechRequest(text)
+                    nao.tts.request(request, block=step.get("block", False))
+            elif "gesture" in step or "move" in step:
+                nao.motion.request(request, block=step.get("block", True))
+            elif "posture" in step:
+                nao.motion.request(request, block=step.get("block", False))
+                app.posture = step["posture"]
+            elif "breathing" in step:
+                nao.motion.request(request, block=step.get("block", False))
+            elif "sound" in step:
+                if getattr(app, "audio_cache", None) is not None:
+                    app.audio_cache.play(request, nao.speaker)
+                else:
+                    nao.speaker.request(request)
+            elif "sleep" in step:
+                if len(last_text.split()) > step.get("min_words", -1):
+                    time.sleep(step["sleep"])
+            elif "rest" in step:
+                nao.autonomous.request(request)
+                app.posture = "Rest"
+            elif "end_show" in step:
+                app.show_finished = True
+                app.shutdown_event.set()
+            elif "next_scene" in step:
+                self.enter_scene(app)
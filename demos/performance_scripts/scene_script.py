@@ -0,0 +1,266 @@
+"""
+Scene content of the performance: what NAO says and does for every intent.
+
+This file only contains data. It is (re)loaded by scene_runner.py while the show is
+running, so lines, gestures and timings can be changed during rehearsals without
+restarting the script: save the file (or send SIGHUP) and the next intent uses the
+new content. The robot and the services stay connected.
+
+Every intent maps to a list of steps, performed in order:
+    {"log": "..."}                          log a message
+    {"say": "...", "generative": True}      say the generative reply of Dialogflow CX, or this canned line
+                                            "generative": False always says the canned line
+                                            "gestures": True says it as one utterance with gestures, placed by
+                                            inline *gesture* markers or else one per chunk
+                                            "block": True waits until the sentence is spoken (default False)
+    {"gesture": "animations/..."}           play an animation ("block": False to not wait for it)
+    {"posture": "Stand"}                    go to a posture (non-blocking by default)
+    {"breathing": True}                     switch the idle breathing on or off (non-blocking by default)
+    {"move": [x, y, theta]}                 move with the given velocities, [0, 0, 0] stops
+    {"sound": "chime"}                      play one of the SOUNDS
+    {"sleep": 3, "min_words": 15}           wait; with min_words only if the last line was longer than that
+    {"rest": True}                          go to the rest posture
+    {"end_show": True}                      stop the application after this intent
+    {"next_scene": True}                    move to the next scene and perform its "enter" steps
+
+The order of the intents is the order of the show. It is used to predict the next
+intent (and prefetch what it needs) and by the degraded mode. Where the show can
+branch, add the likely next intents to TRANSITIONS, e.g. {"deceiving": ["confused"]}.
+
+Generative replies longer than SPEAKING_BUDGETS (seconds of speech per intent) are
+trimmed to the sentences that fit, or replaced by the canned line; a canned line said
+instead of a reply is trimmed the same way (see reply_shaper.py).
+"""
+
+# Sound files, relative to this directory
+SOUNDS = {
+    "chime": "clock-chimes-sounds.wav",
+}
+
+# Optional: intent -> likely next intents, where they differ from the order below
+TRANSITIONS = {}
+
+# Optional: cue sounds (files relative to this directory) that trigger an intent when the mic hears
+# them, without speech recognition, e.g. {"sting": {"file": "sting.wav", "intent": "ready"}}
+CUES = {}
+
+# Maximum speaking time (seconds) of a reply per intent, "default" for the others
+SPEAKING_BUDGETS = {
+    "default": 20,
+    "asking_for_help": 25,
+}
+
+# What the actors say to trigger each intent, checked against the agent by intent_regression.py.
+# Add every variant you hear in rehearsals.
+ACTOR_LINES = {
+    "tired.scene1": ["Shhhhh…. I’m so tired"],
+    "shocked_awake": ["Ahhh! Okay okay I’m awake"],
+    "acquaintance": ["Who are you?"],
+    "thankful": ["Wow. Thank you Nao. That really helped."],
+}
+
+# Intents that are handled in every scene
+GLOBAL_INTENTS = {
+    # To be implemented in each scene, move to next scene intent
+    "ready": [
+        {"next_scene": True},
+    ],
+    # current default turn off intent
+    "bye": [
+        {"log": "Bye intent detected - going to sleep"},
+        {"rest": True},
+        {"end_show": True},
+    ],
+}
+
+SCENES = {
+    0: {
+        "enter": [],
+        "intents": {},
+    },
+    1: {
+        # immediately start scene one dialog
+        "enter": [
+            {"log": " -- Ready -- "},
+            {"gesture": "animations/Stand/Reactions/TouchHead_2", "block": False},
+            {"say": "Oh no! It appears that this human is unconscious. Let me wake her up!",
+             "generative": False, "block": True},
+            {"log": "Sending audio!"},
+            {"sound": "chime"},
+        ],
+        "intents": {
+            # Actor: Shhhhh…. I’m so tired
+            "tired.scene1": [
+                {"log": "Tired intent detected"},
+                {"say": "Understood. I will remain here, silent and still, so you may rest undisturbed."},
+                {"gesture": "animations/Stand/Gestures/YouKnowWhat_1"},
+                {"sleep": 7, "min_words": 15},
+                {"log": "Sending audio!"},
+                {"sound": "chime"},
+            ],
+            # Actor: Ahhh! Okay okay I’m awake
+            "shocked_awake": [
+                {"log": "Good morning!"},
+                {"say": "Good morning!"},
+                {"gesture": "animations/Stand/Gestures/Hey_4", "block": False},
+                {"sleep": 3},
+            ],
+            # Actor: - Who are you?
+            "acquaintance": [
+                {"log": "Acquaintance intent detected - introducing itself"},
+                {"say": "I’m Nao! I’m here to be your guide. What is your name?"},
+                {"gesture": "animations/Stand/Gestures/Me_2"},
+            ],
+            "panic": [
+                {"log": "Confused user intent detected - explaining situation"},
+                {"say": "Please calm down. You’re going to tear the carpet. Let’s do some breathing exercises. "
+                        "Breathe in for 3. 1, 2, 3. Hold for 3. 1, 2, 3. Exhale for 3.",
+                 "gestures": True},
+            ],
+            # Actor: Wow. Thank you Nao. That really helped.
+            "thankful": [
+                {"log": "Thankful intent detected - starting the walk"},
+                {"say": "No problem! Follow me. I will show you the way"},
+                {"gesture": "animations/Stand/Gestures/Kisses_1", "block": False},
+                {"sleep": 4, "min_words": 30},
+                {"log": "Moving forward"},
+                {"move": [0.001, 0, 0.02]},
+                {"sleep": 10},
+                {"move": [0, 0, 0]},
+                {"sleep": 1},
+                {"posture": "Stand"},
+                # restart the idling feature
+                {"breathing": True},
+            ],
+            "malevolent_greeting": [
+                {"log": "Malevolent greeting intent detected"},
+                {"say": "We have never seen you before."},
+                {"gesture": "animations/Stand/Gestures/No_9"},
+                {"sleep": 1},
+            ],
+            # Deceiving proposal
+            "deceiving_proposal": [
+                {"log": "deceiving_proposal intent detected"},
+                {"say": "Wait a minute, this sounds too good to be true - I am not sure if we can trust this man"},
+                {"gesture": "animations/Stand/Gestures/No_2", "block": False},
+                {"sleep": 3},
+            ],
+            # Deceiving
+            "deceiving": [
+                {"log": "Deceving intent detected"},
+                {"say": "I'm not sure about it."},
+                {"sleep": 1},
+            ],
+            "confused": [
+                {"log": "Confused intent detected"},
+                {"say": "I'm trying to help you"},
+                {"log": "Be confused and need help "},
+                {"gesture": "animations/Stand/Gestures/Thinking_3"},
+                {"sleep": 1},
+            ],
+            # When Nao senses that Later is intimidating_attitude
+            "intimidating_attitude": [
+                {"log": "intimidating_attitude intent detected"},
+                {"say": "The proximity, insistence and body language of this individual suggest coercion",
+                 "gestures": True},
+                {"sleep": 1},
+            ],
+            # Actor: What am I gonna do? I need to get home. Please help me
+            # "help": [
+            #     {"say": "Good morning!"},
+            #     {"gesture": "animations/Stand/Gestures/Shoot_1"},
+            # ],
+            # "concerned": [
+            #     {"say": "Good morning!"},
+            #     {"gesture": "animations/Stand/Gestures/Shoot_1"},
+            # ],
+            "innocent_answer": [
+                {"log": "Innocent answer intent detected"},
+                {"say": "We have never seen you before!"},
+                {"log": "Be confused and need help "},
+                {"gesture": "animations/Stand/Gestures/YouKnowWhat_1"},
+            ],
+            "uneasy": [
+                {"log": "Uneasy intent detected"},
+                {"say": "Let’s disengage!"},
+                {"log": "Moving backward"},
+                {"move": [0.001, 0, 0.02]},
+                {"sleep": 10},
+                {"move": [0, 0, 0]},
+                {"posture": "Stand"},
+                {"breathing": True},
+            ],
+            "relieved": [
+                {"log": "Relieved intent detected"},
+                {"say": "That’s why I’m here. Until you recalibrate, I will help you understand human behavior. "
+                        "You’re not alone."},
+                {"gesture": "animations/Stand/Gestures/Me_2"},
+                {"sleep": 3},
+                {"log": "Moving backward"},
+                {"move": [0.001, 0, 0.02]},
+                {"sleep": 10},
+                {"move": [0, 0, 0]},
+                {"posture": "Stand"},
+                {"breathing": True},
+                {"say": "Oh dear, there is a human on the floor. Stand up human!", "generative": False},
+                {"sleep": 10},
+            ],
+            "rude": [
+                {"log": "Rude intent detected"},
+                {"say": "Later, you are being very rude to this lady"},
+                {"gesture": "animations/Stand/Gestures/No_1"},
+                {"sleep": 3},
+            ],
+            "needing_guidance": [
+                {"log": "Needing guidance intent detected"},
+                {"say": "People can’t just cheer up if you tell them to. "
+                        "Human emotions are far more complicated than that.",
+                 "gestures": True},
+                {"sleep": 3},
+            ],
+            "asking_for_help": [
+                {"log": "Asking for help intent detected"},
+                {"say": "I notice our friend is feeling quite sad right now. When someone is upset, it's really "
+                        "important to try and understand how they might be feeling. Instead of saying things that "
+                        "might make them feel worse, we can try to imagine ourselves in their shoes. Think about a "
+                        "time you felt sad or frustrated. What would have made you feel better? Often, just "
+                        "listening without judgment, offering a kind word, or even just being quietly present can "
+                        "make a big difference. It shows them that you care about their feelings, and that is what "
+                        "empathy is all about.",
+                 "gestures": True},
+                {"sleep": 5},
+            ],
+            "confident": [
+                {"log": "Confident intent detected"},
+                {"say": "And remember to be nice!"},
+                {"gesture": "animations/Stand/Gestures/YouKnowWhat_2"},
+                {"sleep": 3},
+            ],
+            "growth": [
+                {"log": "Growth intent detected"},
+                {"say": "Her software has been upgraded!"},
+                {"gesture": "animations/Stand/Gestures/Explain_10"},
+                {"log": "Moving backward"},
+                {"move": [0.001, 0, 0.02]},
+                {"sleep": 10},
+                {"move": [0, 0, 0]},
+                {"posture": "Stand"},
+                {"breathing": True},
+                {"sleep": 3},
+                {"say": "We are reaching the end of our route", "generative": False, "block": True},
+            ],
+            "Grateful": [
+                {"log": "Grateful intent detected"},
+                {"say": "Humans are complicated creatures so it’s okay to need some help every once in a while"},
+                {"gesture": "animations/Stand/Gestures/Explain_6"},
+                {"sleep": 5},
+            ],
+            "Farewell": [
+                {"log": "Farewell intent detected"},
+                {"say": "See you later!"},
+                {"gesture": "animations/Stand/Gestures/Salute_1"},
+                {"sleep": 3},
+            ],
+        },
+    },
+}
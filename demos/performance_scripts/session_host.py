@@ -0,0 +1,325 @@
+"""
+Runs several independent robot dialogues in one process.
+
+Every SICApplication is a singleton that drives one robot, so an exhibition floor of
+robots used to need one process per robot. SessionHost is the one application of the
+process and runs a DialogueSession per robot side by side, each on its own thread
+with its own robot, microphone, collision-free Dialogflow CX session id, show state
+and metrics. The sessions share what does not depend on the robot: the Dialogflow CX
+configuration and circuit breaker, the scene file with its compiled requests and
+loaded sounds, the intent predictor and the prefetch thread pool. With SIC_ANALYTICS_DB
+set, every session records its turns as a show of its own (see show_analytics.py).
+
+Usage:
+    python session_host.py --robot 10.0.0.181:2 --robot 10.0.0.182:3
+
+Every --robot is the IP of a NAO and the device index of the microphone listening to it.
+"""
+
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict, deque
+
+from sic_framework.core import sic_logging
+from sic_framework.core.sic_application import SICApplication
+
+from lazy_imports import lazy_attr
+
+from circuit_breaker import CircuitBreaker, ProtectedService, tcp_probe
+from degraded_mode import ScriptedDegradedMode
+from DialogFlowIntentDetection import NaoDialogflowCXDemo
+from gesture_markup import BookmarkListener, GesturePerformer
+from intent_predictor import Prefetcher, TransitionModel
+from intent_regression import percentile
+from quota_scheduler import QuotaScheduler
+from reply_shaper import ReplyShaper
+from sampling_profiler import ProfiledApplication
+from scene_runner import ENTER, SceneRunner
+from show_analytics import AnalyticsStore
+from text_intent import AGENT_ID, KEYFILE_PATH, LOCATION, api_endpoint
+
+Nao = lazy_attr("sic_framework.devices", "Nao")
+NaoqiTextToSpeechRequest = lazy_attr("sic_framework.devices.nao", "NaoqiTextToSpeechRequest")
+NaoPostureRequest, NaoqiBreathingRequest = lazy_attr(
+    "sic_framework.devices.common_naoqi.naoqi_motion", "NaoPostureRequest", "NaoqiBreathingRequest"
+)
+DialogflowCX, DialogflowCXConf, DetectIntentRequest = lazy_attr(
+    "sic_framework.services.dialogflow_cx.dialogflow_cx", "DialogflowCX", "DialogflowCXConf", "DetectIntentRequest"
+)
+Desktop = lazy_attr("sic_framework.devices.desktop", "Desktop")
+MicrophoneConf = lazy_attr("sic_framework.devices.common_desktop.desktop_microphone", "MicrophoneConf")
+
+
+def new_session_id():
+    """Return a Dialogflow CX session id that does not collide with other sessions (max 36 characters)."""
+    return uuid.uuid4().hex
+
+
+class SessionMetrics(object):
+    """
+    Counters and recent latencies of one dialogue session.
+
+    Args:
+        window: Number of recent latencies kept per name.
+    """
+
+    def __init__(self, window=200):
+        self.counters = Counter()
+        self.latencies = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def observe(self, name, seconds):
+        with self._lock:
+            self.latencies[name].append(seconds)
+
+    def snapshot(self):
+        """Return a dict with the counters and the p50/p90/max of every latency."""
+        with self._lock:
+            snapshot = dict(self.counters)
+            latencies = {name: list(values) for name, values in self.latencies.items()}
+        for name, values in latencies.items():
+            if values:
+                snapshot[name + "_p50"] = percentile(values, 0.5)
+                snapshot[name + "_p90"] = percentile(values, 0.9)
+                snapshot[name + "_max"] = max(values)
+        return snapshot
+
+
+class SessionLogger(logging.LoggerAdapter):
+    """Logger adapter prefixing the records of a session with its name."""
+
+    def process(self, msg, kwargs):
+        return "[{}] {}".format(self.extra["session"], msg), kwargs
+
+
+class DialogueSession(object):
+    """
+    One robot dialogue: a NAO, the microphone listening to it and a Dialogflow CX session.
+
+    Provides the show state the scene runner performs on (nao, logger, scene, posture,
+    show_finished, shutdown_event), so intents are performed exactly like in the
+    single-robot show.
+
+    Args:
+        host: The SessionHost.
+        name: Name of the session in logs and metrics, e.g. the robot's IP.
+        nao_ip: IP of the NAO.
+        mic_device_index: Device index of the microphone listening to this robot.
+    """
+
+    # Lines and gestures are performed like in the single-robot show
+    fallback_handler = NaoDialogflowCXDemo.fallback_handler
+    parse_text_to_gesture = NaoDialogflowCXDemo.parse_text_to_gesture
+    # Intent the script expects next, for the misfire rate of the analytics
+    expected_intent = ScriptedDegradedMode.expected_intent
+
+    def __init__(self, host, name, nao_ip, mic_device_index):
+        self.host = host
+        self.name = name
+        self.logger = SessionLogger(host.logger, {"session": name})
+        self.session_id = new_session_id()
+        self.metrics = SessionMetrics()
+
+        self.scene = 0
+        self.posture = None
+        self.show_finished = False
+        self.shutdown_event = threading.Event()
+        self.last_intent = None
+        self.shaper = host.shaper
+        self.scenes = host.scenes
+
+        # One show per session, so the sessions of the host are compared like separate shows
+        self.analytics = None
+        if os.environ.get("SIC_ANALYTICS_DB"):
+            self.analytics = AnalyticsStore(os.environ["SIC_ANALYTICS_DB"], self.logger, session_id=self.session_id)
+
+        self.nao = Nao(ip=nao_ip, dev_test=False)
+        self.gestures = GesturePerformer(self.nao, self.logger, BookmarkListener.start(self.nao.ssh, self.logger))
+        self.desktop = Desktop(mic_conf=MicrophoneConf(device_index=mic_device_index))
+        self.dialogflow_cx = ProtectedService(
+            DialogflowCX(conf=host.dialogflow_conf, input_source=self.desktop.mic), host.dialogflow_breaker
+        )
+        self.logger.info("Session {} ready".format(self.session_id))
+
+    @property
+    def script(self):
+        return self.host.script
+
+    def stopped(self):
+        return self.shutdown_event.is_set() or self.host.shutdown_event.is_set()
+
+    def run(self):
+        """Dialogue loop of the session, runs until the show of this robot ends or the host stops."""
+        self.nao.motion.request(NaoPostureRequest("Stand", 0.5), block=False)
+        self.nao.motion.request(NaoqiBreathingRequest("Body", True), block=False)
+        self.posture = "Stand"
+
+        while not self.stopped():
+            if not self.dialogflow_cx.breaker.available:
+                # Dialogflow CX is down for every session, wait for the probe instead of prompting
+                self.metrics.count("unavailable")
+                self.host.shutdown_event.wait(self.dialogflow_cx.breaker.probe_interval)
+                continue
+
+            try:
+                if self.host.quota is not None:
+                    self.metrics.observe("quota_wait", self.host.quota.acquire("dialogflow_cx", timeout=5.0))
+                start = time.time()
+                reply = self.dialogflow_cx.request(DetectIntentRequest(self.session_id))
+            except Exception as e:
+                self.metrics.count("errors")
+                self.logger.error("Intent detection failed: {}".format(e))
+                continue
+            detect_latency = time.time() - start
+            self.metrics.observe("detect_latency", detect_latency)
+            self.metrics.count("turns")
+
+            scene, expected, perform_latency = self.scene, self.expected_intent(self.scene), None
+            if reply.intent:
+                self.logger.info("The detected intent: %s (confidence: %s)",
+                                 reply.intent, reply.intent_confidence if reply.intent_confidence else "N/A")
+                self.metrics.count("intents")
+                self.host.prefetch_after(self, reply.intent)
+                start = time.time()
+                self.host.scenes.perform(reply.intent, reply, app=self)
+                perform_latency = time.time() - start
+                self.metrics.observe("perform_latency", perform_latency)
+                self.host.predictor.observe(self.last_intent, reply.intent)
+                self.last_intent = reply.intent
+            else:
+                self.metrics.count("no_intent")
+            if self.analytics is not None:
+                self.analytics.record_turn(scene, reply.intent or None, expected, reply.intent_confidence,
+                                           reply.transcript, detect_latency, perform_latency)
+
+            if reply.fulfillment_message:
+                self.nao.tts.request(NaoqiTextToSpeechRequest(reply.fulfillment_message))
+
+        self.logger.info("Session finished: {}".format(self.metrics.snapshot()))
+
+
+class SessionHost(ProfiledApplication, SICApplication):
+    """
+    Application hosting several dialogue sessions in one process.
+
+    Args:
+        robots: List of (nao_ip, mic_device_index) tuples, one session per robot.
+        keyfile_path: Path of the Google service account key.
+        agent_id: Dialogflow CX agent id.
+        location: Agent location.
+    """
+
+    def __init__(self, robots, keyfile_path=KEYFILE_PATH, agent_id=AGENT_ID, location=LOCATION):
+        super(SessionHost, self).__init__()
+        self.robots = list(robots)
+        self.keyfile_path = keyfile_path
+        self.agent_id = agent_id
+        self.location = location
+        self.sessions = []
+
+        # Shared by all sessions
+        self.sounds = {}
+        self.audio_cache = None  # load_sound of the show checks it, the host sends the sounds whole
+        self.shaper = ReplyShaper(self.logger)
+        self.predictor = TransitionModel()
+        self.prefetcher = Prefetcher(self.scenes_prepare, self.logger)
+        self.prefetch_k = 2
+        self.scenes = SceneRunner(self, on_reload=self.on_scenes_reloaded)
+
+        self.set_log_level(sic_logging.INFO)
+        self.setup()
+
+    # Sounds are loaded once for all sessions
+    load_sound = NaoDialogflowCXDemo.load_sound
+
+    def setup(self):
+        """Create the shared Dialogflow CX configuration and one session per robot."""
+        with open(self.keyfile_path) as f:
+            keyfile_json = json.load(f)
+        self.dialogflow_conf = DialogflowCXConf(
+            keyfile_json=keyfile_json,
+            agent_id=self.agent_id,
+            location=self.location,
+            sample_rate_hertz=16000,
+            language="en"
+        )
+        # With SIC_QUOTA=1 the sessions (and other machines) share the project's quota through Redis
+        self.quota = None
+        if os.environ.get("SIC_QUOTA") == "1":
+            self.quota = QuotaScheduler(self.logger, keyfile_json["project_id"])
+        self.dialogflow_breaker = CircuitBreaker(
+            "dialogflow_cx", self.logger, call_timeout=30.0, probe=tcp_probe(api_endpoint(self.location))
+        )
+        for nao_ip, mic_device_index in self.robots:
+            self.logger.info("Initializing session for NAO {} (mic {})...".format(nao_ip, mic_device_index))
+            self.sessions.append(DialogueSession(self, nao_ip, nao_ip, mic_device_index))
+
+    def on_scenes_reloaded(self, scenes):
+        self.script = scenes.intent_order()
+        predictor = TransitionModel()
+        predictor.learn_from_script(scenes.intent_order(), scenes.transitions())
+        self.predictor = predictor
+        self.shaper.budgets = scenes.speaking_budgets()
+
+    def scenes_prepare(self, scene, intent):
+        self.scenes.compile(scene, intent)
+
+    def prefetch_after(self, session, intent):
+        """Prefetch the most likely intents after the given one of a session."""
+        scene = session.scene
+        if intent == "ready":
+            scene += 1
+            self.prefetcher.prefetch(scene, [ENTER])
+        self.prefetcher.prefetch(scene, [name for name, _ in self.predictor.predict(intent, self.prefetch_k)])
+
+    def metrics(self):
+        """Return a dict of session name -> metrics snapshot."""
+        return {session.name: session.metrics.snapshot() for session in self.sessions}
+
+    def run(self):
+        """Run all sessions until every show has ended or the host is stopped."""
+        self.scenes.watch()
+        self.scenes.install_signal_handler()
+        self.prefetcher.prefetch(1, [ENTER])
+
+        threads = [threading.Thread(target=session.run, name="session-{}".format(session.name), daemon=True)
+                   for session in self.sessions]
+        try:
+            for thread in threads:
+                thread.start()
+            while not self.shutdown_event.is_set() and any(thread.is_alive() for thread in threads):
+                self.shutdown_event.wait(1.0)
+        except KeyboardInterrupt:
+            self.logger.info("Host interrupted by user")
+        finally:
+            for name, snapshot in self.metrics().items():
+                self.logger.info("Metrics of {}: {}".format(name, snapshot))
+            for session in self.sessions:
+                if session.analytics is not None:
+                    session.analytics.close()
+            self.prefetcher.shutdown()
+            self.shutdown()
+
+
+def parse_robot(value):
+    """Parse a --robot argument of the form IP[:MIC_DEVICE_INDEX]."""
+    ip, _, mic = value.partition(":")
+    return ip, int(mic) if mic else 2
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run one dialogue session per robot in a single process.")
+    parser.add_argument("--robot", action="append", type=parse_robot, required=True, metavar="IP[:MIC]",
+                        help="IP of a NAO and the device index of its microphone (default 2)")
+    args = parser.parse_args()
+
+    SessionHost(args.robot).run()
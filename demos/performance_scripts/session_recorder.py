@@ -0,0 +1,428 @@
+"""
+Recorder of what the robot heard, saw and did during a show, on one timeline.
+
+For tuning after a show, the microphone audio, the camera images, the intents that
+fired and the requests sent to the robot are written to one session directory.
+Every record gets a time on a shared monotonic timeline (seconds since the start of
+the recording), so the streams line up even when the wall clock is adjusted mid-show.
+Audio records are timed by the capture start of their frame, which can be a good half
+second before they reach the recorder. Callers only append to an in-memory buffer; a
+background thread writes the buffer to segment files, like show_analytics.py does for
+its database, once its records are older than a short reorder delay, so the records
+go to disk in time order.
+
+A session directory holds:
+
+- session.json: wall-clock time of the start of the timeline and the segment length,
+- NNNNN.seg: the records of one segment (by default 60 s), each a fixed header
+  (time, stream, meta length, data length), JSON meta and raw data (PCM, JPEG),
+- NNNNN.idx: one fixed-size entry (time, offset) per record of the segment,
+- segments.idx: one fixed-size entry (start time, segment number) per segment.
+
+All index entries have a fixed size and increasing times, so a time window is found
+with a binary search on the index files (O(log n) small reads), and only the records
+of the window are read. A segment's index entry is written after its record, so a
+session that was cut short can still be read up to its last complete record.
+
+Enable it in the performance script with SIC_RECORD_DIR=<directory for the sessions>.
+
+Usage:
+    python session_recorder.py recordings/<session> --from 120 --to 135
+    python session_recorder.py recordings/<session> --from 120 --to 135 --streams intent request
+    python session_recorder.py recordings/<session> --from 120 --to 135 --wav window.wav --jpeg-dir frames
+
+The exported wav starts at --from; audio that was not recorded (dropped frames) is silence.
+"""
+
+import argparse
+import bisect
+import heapq
+import itertools
+import json
+import os
+import struct
+import threading
+import time
+import wave
+
+from async_logging import RateLimitedLogger
+from lazy_imports import lazy_import
+
+cv2 = lazy_import("cv2")
+
+AUDIO, CAMERA, INTENT, REQUEST = "audio", "camera", "intent", "request"
+STREAMS = (AUDIO, CAMERA, INTENT, REQUEST)
+
+# time, stream, meta length, data length
+RECORD_HEADER = struct.Struct("<dBII")
+# time, offset in the segment
+RECORD_INDEX = struct.Struct("<dQ")
+# start time, segment number
+SEGMENT_INDEX = struct.Struct("<dI")
+
+# Seconds of difference between the end of an audio record and the start of the next one
+# that is taken as capture jitter, not as missing (or doubled) audio
+GAP_TOLERANCE = 0.02
+
+
+def _request_meta(component, request):
+    """Describe a robot request with its type and simple fields (not waveforms or images)."""
+    meta = {"component": component, "request": type(request).__name__}
+    for name, value in vars(request).items():
+        if isinstance(value, (str, int, float, bool)) and not name.startswith("_"):
+            meta[name] = value
+        elif isinstance(value, (bytes, bytearray)):
+            meta[name + "_bytes"] = len(value)
+    return meta
+
+
+class _RecordingConnector(object):
+    def __init__(self, connector, recorder, component):
+        self._connector = connector
+        self._recorder = recorder
+        self._component = component
+
+    def request(self, request, *args, **kwargs):
+        self._recorder.record_request(self._component, request)
+        return self._connector.request(request, *args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self._connector, attr)
+
+
+class RecordingDevice(object):
+    """
+    Wraps a Nao (or RobotGroup) and records every request sent to it.
+
+    Args:
+        device: The device to wrap.
+        recorder: The SessionRecorder.
+    """
+
+    COMPONENTS = ("tts", "motion", "speaker", "autonomous", "leds")
+
+    def __init__(self, device, recorder):
+        self._device = device
+        self._recorder = recorder
+
+    def __getattr__(self, attr):
+        value = getattr(self._device, attr)
+        if attr in self.COMPONENTS:
+            value = _RecordingConnector(value, self._recorder, attr)
+            setattr(self, attr, value)
+        return value
+
+
+class SessionRecorder(object):
+    """
+    Append-only recorder of the audio, camera, intents and robot requests of one show.
+
+    Args:
+        directory: Directory of the session, created if needed.
+        logger: Logger of the application.
+        segment_seconds: Length of the timeline covered by one segment file.
+        camera_interval: Minimum seconds between two recorded camera images.
+        capacity: Maximum number of records waiting to be written, newer records are dropped beyond it.
+        flush_interval: Seconds between writes of the buffered records.
+        reorder_delay: Seconds a record is held before it is written, so audio that arrives
+            after later records (its frame lagged behind) is still written in time order.
+    """
+
+    def __init__(self, directory, logger, segment_seconds=60.0, camera_interval=0.2, capacity=2000,
+                 flush_interval=0.5, reorder_delay=2.0):
+        self.directory = directory
+        self.logger = logger
+        self.frame_log = RateLimitedLogger(logger, interval=5.0)
+        self.segment_seconds = segment_seconds
+        self.camera_interval = camera_interval
+        self.flush_interval = flush_interval
+        self.reorder_delay = reorder_delay
+        self.records = dict.fromkeys(STREAMS, 0)
+        self.bytes = 0
+        self.dropped = 0
+        self.late = 0
+        self.segments = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.t0 = time.monotonic()
+        self.wall0 = time.time()
+        with open(os.path.join(directory, "session.json"), "w") as f:
+            json.dump({"started": self.wall0, "segment_seconds": segment_seconds, "streams": STREAMS}, f)
+
+        self._buffer = []  # heap of (time, sequence, stream, meta, data)
+        self._sequence = itertools.count()
+        self._capacity = capacity
+        self._lock = threading.Lock()
+        self._last_camera = None
+        self._last_written = 0.0
+        self._segment = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._write_loop, name="session-recorder", daemon=True)
+        self._thread.start()
+
+    def now(self):
+        """Return the current time on the timeline of the session."""
+        return time.monotonic() - self.t0
+
+    def _append(self, stream, meta, data=b"", t=None):
+        with self._lock:
+            if len(self._buffer) >= self._capacity:
+                self.dropped += 1
+                self.frame_log.warning("Session recording cannot keep up, dropping %s records", stream)
+                return
+            if t is None:
+                t = self.now()
+            heapq.heappush(self._buffer, (t, next(self._sequence), stream, meta, data))
+
+    def on_audio(self, frame):
+        """Microphone consumer (AudioFrame of the MicrophoneMultiplexer, subscribed with copy=True)."""
+        samples = len(frame.waveform) // 2
+        # Indexed by the start of the frame on the timeline, from its (monotonic) capture time
+        start = frame.timestamp - self.t0 - samples / float(frame.sample_rate)
+        self._append(AUDIO, {"rate": frame.sample_rate}, bytes(frame.waveform), t=max(start, 0.0))
+
+    def on_image(self, message):
+        """Camera callback (CompressedImageMessage with an RGB image), limited to one image per camera_interval."""
+        now = time.monotonic()
+        if self._last_camera is not None and now - self._last_camera < self.camera_interval:
+            return
+        self._last_camera = now
+        ok, jpeg = cv2.imencode(".jpg", message.image[..., ::-1])
+        if ok:
+            self._append(CAMERA, {"shape": list(message.image.shape)}, jpeg.tobytes())
+        else:
+            self.frame_log.warning("Could not encode a camera image of shape %s", message.image.shape)
+
+    def record_intent(self, scene, intent, reply=None, source="dialogflow_cx"):
+        """Record a detected (or missed, intent None) intent with the reply of the agent."""
+        self._append(INTENT, {
+            "scene": scene, "intent": intent, "source": source,
+            "confidence": getattr(reply, "intent_confidence", None),
+            "transcript": getattr(reply, "transcript", None),
+            "fulfillment_message": getattr(reply, "fulfillment_message", None),
+        })
+
+    def record_request(self, component, request):
+        """Record a request sent to a component of the robot."""
+        self._append(REQUEST, _request_meta(component, request))
+
+    # ----------------------------------------------------------------------------- writing
+
+    def _open_segment(self, number, start):
+        base = os.path.join(self.directory, "{:05d}".format(number))
+        self._segment = (number, open(base + ".seg", "ab"), open(base + ".idx", "ab"))
+        with open(os.path.join(self.directory, "segments.idx"), "ab") as f:
+            f.write(SEGMENT_INDEX.pack(start, number))
+        self.segments += 1
+
+    def _close_segment(self):
+        if self._segment is not None:
+            self._segment[1].close()
+            self._segment[2].close()
+            self._segment = None
+
+    def _write_loop(self):
+        try:
+            while not self._stop.wait(self.flush_interval):
+                self._write(self.now() - self.reorder_delay)
+            self._write(float("inf"))
+        finally:
+            self._close_segment()
+
+    def _due(self, until):
+        with self._lock:
+            due = []
+            while self._buffer and self._buffer[0][0] <= until:
+                due.append(heapq.heappop(self._buffer))
+        return due
+
+    def _write(self, until):
+        due = self._due(until)
+        if not due:
+            return
+        try:
+            for t, _, stream, meta, data in due:
+                if t < self._last_written:
+                    # Arrived later than the reorder delay, written at the end of the index
+                    self.late += 1
+                    meta = dict(meta, late_by=round(self._last_written - t, 3))
+                    t = self._last_written
+                self._last_written = t
+                number = int(t // self.segment_seconds)
+                if self._segment is None or self._segment[0] != number:
+                    self._close_segment()
+                    self._open_segment(number, number * self.segment_seconds)
+                _, seg, idx = self._segment
+                meta = json.dumps(meta).encode()
+                offset = seg.tell()
+                seg.write(RECORD_HEADER.pack(t, STREAMS.index(stream), len(meta), len(data)))
+                seg.write(meta)
+                seg.write(data)
+                idx.write(RECORD_INDEX.pack(t, offset))
+                self.records[stream] += 1
+                self.bytes += RECORD_HEADER.size + len(meta) + len(data)
+            # Records first, so every index entry on disk points to a complete record
+            self._segment[1].flush()
+            self._segment[2].flush()
+        except (OSError, ValueError) as e:
+            with self._lock:
+                self.dropped += len(self._buffer) + len(due)
+                self._buffer = []
+            self.logger.warning("Could not write the session recording: {}".format(e))
+
+    def stats(self):
+        return {"records": dict(self.records), "segments": self.segments,
+                "mb": round(self.bytes / 1e6, 1), "dropped": self.dropped, "late": self.late}
+
+    def close(self):
+        """Write the remaining records and close the segment files."""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join()
+
+
+# ----------------------------------------------------------------------------- reading
+
+
+class _IndexFile(object):
+    """Sequence of the times of a fixed-entry index file, read entry by entry for bisect."""
+
+    def __init__(self, f, entry):
+        self.f = f
+        self.entry = entry
+        f.seek(0, os.SEEK_END)
+        self.length = f.tell() // entry.size
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        return self.entry_at(i)[0]
+
+    def entry_at(self, i):
+        self.f.seek(i * self.entry.size)
+        return self.entry.unpack(self.f.read(self.entry.size))
+
+
+class Record(object):
+    """
+    Record of a session.
+
+    Args:
+        t: Time on the timeline of the session.
+        stream: One of STREAMS.
+        meta: Dict with the details of the record.
+        data: Raw data: 16-bit PCM (audio), JPEG (camera), or empty.
+    """
+
+    def __init__(self, t, stream, meta, data):
+        self.t = t
+        self.stream = stream
+        self.meta = meta
+        self.data = data
+
+
+class SessionReader(object):
+    """
+    Reads a time window of a recorded session without loading the rest of it.
+
+    Args:
+        directory: Directory of the session.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "session.json")) as f:
+            self.info = json.load(f)
+
+    def read(self, start, end, streams=STREAMS):
+        """
+        Yield the records with start <= t < end, in time order.
+
+        Args:
+            start: Start of the window, seconds on the timeline.
+            end: End of the window.
+            streams: The streams to return.
+        """
+        with open(os.path.join(self.directory, "segments.idx"), "rb") as f:
+            segments = _IndexFile(f, SEGMENT_INDEX)
+            # The last segment starting at or before the window
+            i = max(bisect.bisect_right(segments, start) - 1, 0)
+            numbers = []
+            while i < len(segments):
+                segment_start, number = segments.entry_at(i)
+                if segment_start >= end:
+                    break
+                numbers.append(number)
+                i += 1
+
+        wanted = set(STREAMS.index(stream) for stream in streams)
+        for number in numbers:
+            base = os.path.join(self.directory, "{:05d}".format(number))
+            with open(base + ".idx", "rb") as idx_file, open(base + ".seg", "rb") as seg:
+                index = _IndexFile(idx_file, RECORD_INDEX)
+                first = bisect.bisect_left(index, start)
+                if first == len(index):
+                    continue
+                seg.seek(index.entry_at(first)[1])
+                for _ in range(len(index) - first):
+                    t, stream, meta_length, data_length = RECORD_HEADER.unpack(seg.read(RECORD_HEADER.size))
+                    if t >= end:
+                        return
+                    if stream not in wanted:
+                        seg.seek(meta_length + data_length, os.SEEK_CUR)
+                        continue
+                    meta = json.loads(seg.read(meta_length).decode())
+                    yield Record(t, STREAMS[stream], meta, seg.read(data_length))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show a time window of a recorded session.")
+    parser.add_argument("session", help="Directory of the session")
+    parser.add_argument("--from", dest="start", type=float, default=0.0, help="Start of the window (s)")
+    parser.add_argument("--to", dest="end", type=float, default=float("inf"), help="End of the window (s)")
+    parser.add_argument("--streams", nargs="+", default=list(STREAMS), choices=STREAMS)
+    parser.add_argument("--wav", help="Write the audio of the window to this wav file")
+    parser.add_argument("--jpeg-dir", help="Write the camera images of the window to this directory")
+    args = parser.parse_args()
+
+    reader = SessionReader(args.session)
+    audio, rate, recorded = [], None, 0
+    # End of the audio so far on the timeline, gaps up to the next record become silence
+    cursor = args.start
+    for record in reader.read(args.start, args.end, args.streams):
+        if record.stream == AUDIO:
+            rate = record.meta["rate"]
+            data = record.data
+            recorded += len(data)
+            gap = int(round((record.t - cursor) * rate))
+            if gap > rate * GAP_TOLERANCE:
+                audio.append(b"\x00\x00" * gap)
+            elif -gap > rate * GAP_TOLERANCE:
+                # Overlaps the audio before it (capture time jitter), the overlap is left out
+                data = data[-gap * 2:]
+            audio.append(data)
+            cursor = record.t + len(record.data) / 2.0 / rate
+            continue
+        if record.stream == CAMERA and args.jpeg_dir:
+            if not os.path.isdir(args.jpeg_dir):
+                os.makedirs(args.jpeg_dir)
+            with open(os.path.join(args.jpeg_dir, "{:09.3f}.jpg".format(record.t)), "wb") as f:
+                f.write(record.data)
+        print("{:9.3f}  {:<8} {}".format(record.t, record.stream, json.dumps(record.meta)))
+
+    if audio:
+        print("audio: {:.1f}s at {} Hz, {:.1f}s of it recorded".format(
+            sum(len(a) for a in audio) / 2.0 / rate, rate, recorded / 2.0 / rate))
+        if args.wav:
+            with wave.open(args.wav, "wb") as f:
+                f.setnchannels(1)
+                f.setsampwidth(2)
+                f.setframerate(rate)
+                f.writeframes(b"".join(audio))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+SQLite analytics store for show turns and latencies, with a query CLI.
+
+Every turn of a show (scene, detected and expected intent, confidence, transcript,
+Dialogflow CX and perform latency) and every event from the callbacks is appended to
+a SQLite database, so results can be compared across many performances. Callers only
+append to an in-memory buffer; a background thread owns the connection and writes the
+buffer in batches (one transaction per batch), so the main loop and the callbacks never
+wait for the disk. The store is append-only, rows are never updated.
+
+Enable it in the performance script with SIC_ANALYTICS_DB=<path of the database>.
+
+Usage:
+    python show_analytics.py shows.sqlite3 shows              # list the recorded shows
+    python show_analytics.py shows.sqlite3 intents            # per-intent latency and misfire rate
+    python show_analytics.py shows.sqlite3 intents --show <show id> --scene 1
+"""
+
+import argparse
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+
+from intent_regression import percentile
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shows (
+    show_id TEXT PRIMARY KEY,
+    started REAL NOT NULL,
+    session_id TEXT
+);
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY,
+    show_id TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    scene INTEGER,
+    intent TEXT,
+    expected_intent TEXT,
+    confidence REAL,
+    transcript TEXT,
+    detect_latency REAL,
+    perform_latency REAL,
+    source TEXT
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    show_id TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    scene INTEGER,
+    kind TEXT NOT NULL,
+    detail TEXT
+);
+CREATE INDEX IF NOT EXISTS turns_show ON turns (show_id);
+CREATE INDEX IF NOT EXISTS turns_scene ON turns (scene);
+CREATE INDEX IF NOT EXISTS turns_intent ON turns (intent);
+CREATE INDEX IF NOT EXISTS turns_timestamp ON turns (timestamp);
+CREATE INDEX IF NOT EXISTS events_show ON events (show_id);
+CREATE INDEX IF NOT EXISTS events_timestamp ON events (timestamp);
+"""
+
+TURN_COLUMNS = ("show_id", "timestamp", "scene", "intent", "expected_intent", "confidence", "transcript",
+                "detect_latency", "perform_latency", "source")
+
+
+class AnalyticsStore(object):
+    """
+    Append-only store of the turns and events of one show.
+
+    Args:
+        path: Path of the SQLite database, created if needed.
+        logger: Logger of the application.
+        show_id: Id of this show, a new uuid by default.
+        session_id: Dialogflow CX session id of the show.
+        capacity: Maximum number of rows waiting to be written, older rows are dropped beyond it.
+        flush_interval: Seconds between writes of the buffered rows.
+    """
+
+    def __init__(self, path, logger, show_id=None, session_id=None, capacity=10000, flush_interval=1.0):
+        self.path = path
+        self.logger = logger
+        self.show_id = show_id or uuid.uuid4().hex
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+
+        self._buffer = deque()
+        self._capacity = capacity
+        self._stop = threading.Event()
+        self._buffer.append(("shows", (self.show_id, time.time(), None if session_id is None else str(session_id))))
+        self._thread = threading.Thread(target=self._write_loop, name="analytics-store", daemon=True)
+        self._thread.start()
+
+    def _append(self, table, row):
+        # deque.append is atomic, the hot path takes no lock
+        if len(self._buffer) >= self._capacity:
+            self.dropped += 1
+            return
+        self._buffer.append((table, row))
+
+    def record_turn(self, scene, intent, expected_intent=None, confidence=None, transcript=None,
+                    detect_latency=None, perform_latency=None, source="dialogflow_cx"):
+        """
+        Record a turn of the show.
+
+        Args:
+            scene: Scene index.
+            intent: Detected intent, or None.
+            expected_intent: Intent the script expected next, used for the misfire rate.
+            confidence: Confidence of the detected intent.
+            transcript: What the actor said.
+            detect_latency: Seconds the intent detection took.
+            perform_latency: Seconds performing the intent took.
+            source: "dialogflow_cx", "degraded", "cue" or "operator".
+        """
+        self._append("turns", (self.show_id, time.time(), scene, intent, expected_intent, confidence, transcript,
+                               detect_latency, perform_latency, source))
+
+    def record_event(self, scene, kind, detail=None):
+        """Record an event, e.g. a transcript from the recognition callback."""
+        self._append("events", (self.show_id, time.time(), scene, kind, detail))
+
+    def _write_loop(self):
+        connection = sqlite3.connect(self.path)
+        connection.executescript(SCHEMA)
+        try:
+            while not self._stop.wait(self.flush_interval):
+                self._write(connection)
+            self._write(connection)
+        finally:
+            connection.close()
+
+    def _write(self, connection):
+        rows = {"shows": [], "turns": [], "events": []}
+        while self._buffer:
+            table, row = self._buffer.popleft()
+            rows[table].append(row)
+        if not any(rows.values()):
+            return
+        try:
+            with connection:
+                connection.executemany("INSERT OR IGNORE INTO shows VALUES (?, ?, ?)", rows["shows"])
+                connection.executemany("INSERT INTO turns ({}) VALUES ({})".format(
+                    ", ".join(TURN_COLUMNS), ", ".join("?" * len(TURN_COLUMNS))), rows["turns"])
+                connection.executemany(
+                    "INSERT INTO events (show_id, timestamp, scene, kind, detail) VALUES (?, ?, ?, ?, ?)",
+                    rows["events"])
+            self.written += sum(len(r) for r in rows.values())
+        except sqlite3.Error as e:
+            self.dropped += sum(len(r) for r in rows.values())
+            self.logger.warning("Could not write show analytics: {}".format(e))
+
+    def close(self):
+        """Write the remaining rows and close the database."""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join()
+
+
+# ----------------------------------------------------------------------------- queries
+
+
+def list_shows(connection):
+    rows = connection.execute("""
+        SELECT s.show_id, s.started, COUNT(t.id), MAX(t.scene)
+        FROM shows s LEFT JOIN turns t ON t.show_id = s.show_id
+        GROUP BY s.show_id ORDER BY s.started
+    """).fetchall()
+    print("{:<34} {:<20} {:>6} {:>6}".format("show", "started", "turns", "scene"))
+    for show_id, started, turns, scene in rows:
+        print("{:<34} {:<20} {:>6} {:>6}".format(
+            show_id, time.strftime("%Y-%m-%d %H:%M", time.localtime(started)), turns,
+            scene if scene is not None else "-"))
+
+
+def intent_report(connection, show_id=None, scene=None):
+    """Print per expected intent the number of turns, the misfire rate and the latency distribution."""
+    where, args = [], []
+    if show_id:
+        where.append("show_id = ?")
+        args.append(show_id)
+    if scene is not None:
+        where.append("scene = ?")
+        args.append(scene)
+    query = "SELECT COALESCE(expected_intent, intent), intent, detect_latency, perform_latency FROM turns"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+
+    stats = {}
+    for expected, intent, detect, perform in connection.execute(query, args):
+        entry = stats.setdefault(expected or "(none)", {"turns": 0, "misfires": 0, "detect": [], "perform": []})
+        entry["turns"] += 1
+        if intent != expected:
+            entry["misfires"] += 1
+        if detect is not None:
+            entry["detect"].append(detect)
+        if perform is not None:
+            entry["perform"].append(perform)
+
+    print("{:<24} {:>6} {:>9} {:>9} {:>9} {:>9} {:>11}".format(
+        "intent", "turns", "misfire", "p50 ms", "p90 ms", "p99 ms", "perform p50"))
+    for name in sorted(stats):
+        entry = stats[name]
+        detect = entry["detect"]
+        print("{:<24} {:>6} {:>9.0%} {:>9.0f} {:>9.0f} {:>9.0f} {:>11.0f}".format(
+            name, entry["turns"], entry["misfires"] / float(entry["turns"]),
+            percentile(detect, 0.5) * 1000, percentile(detect, 0.9) * 1000, percentile(detect, 0.99) * 1000,
+            percentile(entry["perform"], 0.5) * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the show analytics database.")
+    parser.add_argument("db", help="Path of the SQLite database")
+    parser.add_argument("query", choices=("shows", "intents"))
+    parser.add_argument("--show", help="Only this show id")
+    parser.add_argument("--scene", type=int, help="Only this scene")
+    args = parser.parse_args()
+
+    connection = sqlite3.connect(args.db)
+    try:
+        if args.query == "shows":
+            list_shows(connection)
+        else:
+            intent_report(connection, args.show, args.scene)
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Splits long replies into speech chunks that fit a gesture each.
+
+Splitting on every "." gave empty chunks, broke "1, 2, 3." and abbreviations apart,
+and gave chunks of very different lengths, so some gestures ended long before their
+speech. The chunker splits on sentence boundaries (and "|", an explicit break in the
+agent's replies), splits long sentences further on clause boundaries (, ; : and
+dashes, but not between the numbers of a list), and then merges the pieces into
+chunks whose estimated speaking time is close to the duration of a gesture.
+
+It is plain regular expressions and runs in well under a millisecond per reply.
+
+Usage:
+    for chunk in chunk_text(reply_text):
+        gesture = pick_gesture()
+"""
+
+import math
+import random
+import re
+from collections import namedtuple
+
+# NAO's default speaking rate is about 150 words per minute
+WORDS_PER_SECOND = 2.5
+
+# Gestures played while speaking. Chunks are sized to about TYPICAL_GESTURE_DURATION;
+# the durations of the single animations have not been measured on the robot, so the
+# gesture of a chunk is not picked by its length.
+GESTURES = tuple("animations/Stand/Gestures/Explain_{}".format(i) for i in range(1, 12))
+TYPICAL_GESTURE_DURATION = 3.0
+
+# Words ending in a period that do not end a sentence ("No." only before a number, see split_sentences)
+ABBREVIATIONS = {"mr", "mrs", "ms", "dr", "prof", "st", "vs", "etc", "e.g", "i.e"}
+
+_SENTENCE_END = re.compile(r"([.!?…]+[\"')\]]*)\s+|\s*\|\s*")
+_CLAUSE_END = re.compile(r"(?<!\d)([,;:]|\s[-–—])\s+|(?<=\d)([;:])\s+|(?<=\d),\s+(?!\d)")
+_WORD = re.compile(r"\S+")
+
+Chunk = namedtuple("Chunk", ["text", "words", "duration"])
+
+
+def split_sentences(text):
+    """Return the non-empty sentences of a text, keeping abbreviations and initials together."""
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        candidate = text[start:match.start()].strip()
+        if match.group(1) and match.group(1).startswith("."):
+            last_word = candidate.rsplit(None, 1)[-1].lower() if candidate else ""
+            if last_word in ABBREVIATIONS or (len(last_word) == 1 and last_word.isalpha()):
+                continue
+            if last_word == "no" and text[match.end():match.end() + 1].isdigit():
+                # "No. 5" is a number, "No. I said no." two sentences
+                continue
+        sentences.append(text[start:match.end()].strip(" |"))
+        start = match.end()
+    sentences.append(text[start:].strip(" |"))
+    return [s for s in sentences if _WORD.search(s) and re.search(r"\w", s)]
+
+
+def _split_clauses(sentence):
+    clauses = []
+    start = 0
+    for match in _CLAUSE_END.finditer(sentence):
+        clauses.append(sentence[start:match.end()].strip())
+        start = match.end()
+    clauses.append(sentence[start:].strip())
+    return [c for c in clauses if re.search(r"\w", c)]
+
+
+def _split_words(piece, target_words):
+    words = piece.split()
+    parts = max(1, int(math.ceil(len(words) / float(target_words))))
+    size = int(math.ceil(len(words) / float(parts)))
+    return [" ".join(words[i:i + size]) for i in range(0, len(words), size)]
+
+
+def chunk_text(text, gesture_duration=TYPICAL_GESTURE_DURATION, words_per_second=WORDS_PER_SECOND):
+    """
+    Split a reply into chunks of about one gesture of speech each.
+
+    Args:
+        text: The reply.
+        gesture_duration: Typical duration (seconds) of the gestures played with the chunks.
+        words_per_second: Estimated speaking rate.
+
+    Returns:
+        list of Chunk(text, words, duration), without empty chunks.
+    """
+    target = max(1.0, gesture_duration * words_per_second)
+    min_words, max_words = 0.6 * target, 1.5 * target
+
+    # (piece, ends a sentence) with no piece longer than max_words
+    pieces = []
+    for sentence in split_sentences(text):
+        if len(sentence.split()) <= max_words:
+            pieces.append((sentence, True))
+            continue
+        clauses = []
+        for clause in _split_clauses(sentence):
+            clauses += _split_words(clause, target) if len(clause.split()) > max_words else [clause]
+        pieces += [(clause, i == len(clauses) - 1) for i, clause in enumerate(clauses)]
+
+    chunks = []
+    current = []
+    count = 0
+    for piece, sentence_end in pieces:
+        words = len(piece.split())
+        if current and count + words > max_words:
+            chunks.append(" ".join(current))
+            current, count = [], 0
+        current.append(piece)
+        count += words
+        if sentence_end and count >= min_words:
+            chunks.append(" ".join(current))
+            current, count = [], 0
+    if current:
+        chunks.append(" ".join(current))
+
+    result = []
+    for chunk in chunks:
+        words = len(chunk.split())
+        result.append(Chunk(chunk, words, words / float(words_per_second)))
+    return result
+
+
+def pick_gesture(gestures=GESTURES):
+    """
+    Pick a random gesture for a chunk.
+
+    Args:
+        gestures: The animations to choose from.
+
+    Returns:
+        str: The animation.
+    """
+    return random.choice(gestures)
@@ -0,0 +1,162 @@
+"""
+Text-mode intent detection against the Dialogflow CX agent, or a local stand-in.
+
+TextIntentClient sends text (instead of audio) to detect-intent, using the Dialogflow
+CX API directly like utils/verify_dialogflow_cx_agent.py does. LocalIntentMatcher is a
+stand-in agent without network that matches text against the expected actor lines of
+the scene file. Both return a TextQueryResult with the same attributes the performance
+script reads from the SIC QueryResult (intent, intent_confidence, transcript,
+fulfillment_message, parameters).
+"""
+
+import json
+import re
+import time
+from os.path import abspath, dirname, join
+
+from lazy_imports import lazy_import
+from quota_scheduler import LIVE
+
+dialogflowcx_v3 = lazy_import("google.cloud.dialogflowcx_v3")
+service_account = lazy_import("google.oauth2.service_account")
+
+# Agent of the performance (see DialogFlowIntentDetection.py and verify_dialogflow_cx_agent.py)
+AGENT_ID = "4d0ad0a1-d873-421d-8f8e-be8229efe112"
+LOCATION = "europe-west4"
+KEYFILE_PATH = abspath(join(dirname(__file__), "..", "..", "conf", "google", "google-key.json"))
+
+
+class TextQueryResult(object):
+    """
+    Result of a text detect-intent call, shaped like the SIC Dialogflow CX QueryResult.
+
+    Args:
+        intent: Display name of the matched intent, or None.
+        intent_confidence: Confidence of the match (0-1), or None.
+        transcript: The text that was sent.
+        fulfillment_message: Text of the agent's response messages, or None.
+        parameters: Dict of session parameters.
+        latency: Seconds the call took.
+    """
+
+    def __init__(self, intent, intent_confidence, transcript, fulfillment_message=None, parameters=None,
+                 latency=None):
+        self.intent = intent
+        self.intent_confidence = intent_confidence
+        self.transcript = transcript
+        self.fulfillment_message = fulfillment_message
+        self.parameters = parameters or {}
+        self.latency = latency
+
+
+def api_endpoint(location):
+    """Return the Dialogflow CX API endpoint for an agent location."""
+    if location == "global":
+        return "dialogflow.googleapis.com"
+    return "{}-dialogflow.googleapis.com".format(location)
+
+
+class TextIntentClient(object):
+    """
+    Text detect-intent against the real Dialogflow CX agent.
+
+    The underlying gRPC client is thread-safe, so one instance can be shared by a worker pool.
+
+    Args:
+        keyfile_path: Path of the Google service account key.
+        agent_id: Dialogflow CX agent id.
+        location: Agent location.
+        language: Language code of the queries.
+        scheduler: Optional QuotaScheduler the requests wait on.
+        priority: Priority of the requests for the scheduler (LIVE or BACKGROUND).
+    """
+
+    def __init__(self, keyfile_path=KEYFILE_PATH, agent_id=AGENT_ID, location=LOCATION, language="en",
+                 scheduler=None, priority=LIVE):
+        with open(keyfile_path) as f:
+            keyfile_json = json.load(f)
+        self.project_id = keyfile_json["project_id"]
+        self.agent_id = agent_id
+        self.location = location
+        self.language = language
+        self.scheduler = scheduler
+        self.priority = priority
+        self.client = dialogflowcx_v3.SessionsClient(
+            credentials=service_account.Credentials.from_service_account_info(keyfile_json),
+            client_options={"api_endpoint": api_endpoint(location)},
+        )
+
+    def detect(self, text, session_id):
+        """
+        Detect the intent of a text.
+
+        Args:
+            text: The text, e.g. an actor line.
+            session_id: Dialogflow CX session id.
+
+        Returns:
+            TextQueryResult
+        """
+        session = self.client.session_path(self.project_id, self.location, self.agent_id, str(session_id))
+        request = dialogflowcx_v3.DetectIntentRequest(
+            session=session,
+            query_input=dialogflowcx_v3.QueryInput(
+                text=dialogflowcx_v3.TextInput(text=text), language_code=self.language
+            ),
+        )
+        if self.scheduler is not None:
+            self.scheduler.acquire("dialogflow_cx", self.priority)
+        start = time.time()
+        response = self.client.detect_intent(request=request)
+        latency = time.time() - start
+
+        result = response.query_result
+        intent = result.match.intent.display_name or None
+        messages = [t for message in result.response_messages for t in message.text.text]
+        return TextQueryResult(
+            intent=intent,
+            intent_confidence=result.match.confidence if intent else None,
+            transcript=text,
+            fulfillment_message=" ".join(messages) or None,
+            parameters=dict(result.parameters) if result.parameters else {},
+            latency=latency,
+        )
+
+
+def _words(text):
+    return set(re.findall(r"[a-z']+", text.lower().replace("’", "'")))
+
+
+class LocalIntentMatcher(object):
+    """
+    Local stand-in for the agent: matches a text to the intent with the most similar actor line.
+
+    Similarity is the overlap (Jaccard) of the word sets, which is enough to catch lines
+    that are ambiguous between two intents of the script.
+
+    Args:
+        examples: dict of intent -> list of example lines (ACTOR_LINES of the scene file).
+        threshold: Minimum similarity for a match, below it no intent is returned.
+    """
+
+    def __init__(self, examples, threshold=0.2):
+        self.threshold = threshold
+        self.examples = [(intent, _words(line)) for intent, lines in examples.items() for line in lines]
+
+    def detect(self, text, session_id=None):
+        start = time.time()
+        words = _words(text)
+        best_intent, best_score = None, 0.0
+        for intent, example in self.examples:
+            union = words | example
+            score = len(words & example) / float(len(union)) if union else 0.0
+            if score > best_score:
+                best_intent, best_score = intent, score
+        if best_score < self.threshold:
+            best_intent = None
+        return TextQueryResult(
+            intent=best_intent,
+            intent_confidence=best_score if best_intent else None,
+            transcript=text,
+            latency=time.time() - start,
+        )
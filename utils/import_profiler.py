@@ -0,0 +1,152 @@
+"""
+Startup import profiler for the demo entry points.
+
+Runs each entry point under ``python -X importtime`` without executing its
+``if __name__ == "__main__":`` block (so no robot or service gets connected), and
+reports the total import time and the most expensive top-level packages.
+
+Usage:
+    python utils/import_profiler.py                                   # every script in demos/
+    python utils/import_profiler.py demos/performance_scripts/DialogFlowIntentDetection.py
+    python utils/import_profiler.py --top 15 --details demos/desktop/demo_desktop_conversation.py
+"""
+
+import argparse
+import glob
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Loads the entry point like `python script.py` would, but with a run_name other than
+# "__main__" so the demo itself does not start.
+LOADER = (
+    "import runpy, sys; "
+    "sys.path.insert(0, sys.argv[1]); "
+    "runpy.run_path(sys.argv[2], run_name='__import_profile__')"
+)
+
+
+def parse_importtime(stderr):
+    """
+    Parse the output of ``-X importtime``.
+
+    Args:
+        stderr: The stderr text of the profiled process.
+
+    Returns:
+        list of (module, self_us, cumulative_us, depth) tuples in import order.
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3:
+            continue
+        self_us, cumulative_us, name = fields
+        # Nesting is encoded as two extra spaces of indentation per level
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        try:
+            entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+        except ValueError:
+            continue
+    return entries
+
+
+def profile_entry_point(path, python=sys.executable, timeout=120):
+    """
+    Import an entry point in a fresh interpreter and collect its import timings.
+
+    Args:
+        path: Path of the demo script.
+        python: Interpreter to use.
+        timeout: Seconds before the profiled process is killed.
+
+    Returns:
+        dict with the entry point, its import entries, and the error (if the import failed).
+    """
+    path = os.path.abspath(path)
+    cmd = [python, "-X", "importtime", "-c", LOADER, os.path.dirname(path), path]
+    try:
+        proc = subprocess.run(
+            cmd, cwd=os.path.dirname(path), capture_output=True, text=True, timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        return {"path": path, "entries": [], "error": "timed out after {}s".format(timeout)}
+
+    error = None
+    if proc.returncode != 0:
+        # The last line of the traceback is the most useful part (usually a missing dependency)
+        tail = [l for l in proc.stderr.splitlines() if l and not l.startswith("import time:")]
+        error = tail[-1] if tail else "exit code {}".format(proc.returncode)
+    return {"path": path, "entries": parse_importtime(proc.stderr), "error": error}
+
+
+def summarize(entries):
+    """
+    Aggregate import entries per top-level package.
+
+    Only entries at depth 0 are counted for the cumulative figure, so nested
+    imports are not counted twice.
+
+    Returns:
+        (total_us, list of (package, cumulative_us, module_count) sorted by cost)
+    """
+    cumulative = defaultdict(int)
+    counts = defaultdict(int)
+    for name, _self_us, cumulative_us, depth in entries:
+        package = name.split(".")[0]
+        counts[package] += 1
+        if depth == 0:
+            cumulative[package] += cumulative_us
+    total = sum(cumulative.values())
+    packages = sorted(
+        ((p, us, counts[p]) for p, us in cumulative.items()), key=lambda x: x[1], reverse=True
+    )
+    return total, packages
+
+
+def print_report(result, top, details):
+    rel = os.path.relpath(result["path"], REPO_ROOT)
+    total, packages = summarize(result["entries"])
+    print("=" * 80)
+    print("{:<60} {:>10.1f} ms".format(rel, total / 1000.0))
+    if result["error"]:
+        print("  ! import stopped early: {}".format(result["error"]))
+    for package, us, count in packages[:top]:
+        share = 100.0 * us / total if total else 0.0
+        print("  {:<40} {:>9.1f} ms {:>5.1f}%  ({} modules)".format(package, us / 1000.0, share, count))
+    if details:
+        print("  -- slowest modules (self time) --")
+        slowest = sorted(result["entries"], key=lambda e: e[1], reverse=True)[:top]
+        for name, self_us, _cumulative_us, _depth in slowest:
+            print("  {:<60} {:>9.1f} ms".format(name, self_us / 1000.0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure startup import time of the demo entry points.")
+    parser.add_argument("paths", nargs="*", help="Entry points to profile (default: every script in demos/)")
+    parser.add_argument("--top", type=int, default=10, help="Number of packages/modules to show per entry point")
+    parser.add_argument("--details", action="store_true", help="Also list the slowest individual modules")
+    parser.add_argument("--python", default=sys.executable, help="Interpreter used to run the entry points")
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(glob.glob(os.path.join(REPO_ROOT, "demos", "**", "*.py"), recursive=True))
+
+    results = [profile_entry_point(p, python=args.python) for p in paths]
+    for result in results:
+        print_report(result, args.top, args.details)
+
+    print("=" * 80)
+    print("SUMMARY (total import time at startup)")
+    for result in sorted(results, key=lambda r: summarize(r["entries"])[0], reverse=True):
+        total, _ = summarize(result["entries"])
+        flag = "  (incomplete)" if result["error"] else ""
+        print("  {:<60} {:>9.1f} ms{}".format(os.path.relpath(result["path"], REPO_ROOT), total / 1000.0, flag))
+
+
+if __name__ == "__main__":
+    main()
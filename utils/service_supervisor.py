@@ -0,0 +1,270 @@
+"""
+Starts the local services of the show, waits until they are ready and keeps them running.
+
+Replaces starting `redis-server conf/redis/redis.conf` and `run-dialogflow-cx` by hand
+in separate terminals. Services are started in parallel as soon as the services they
+depend on are ready (the SIC services need Redis). Readiness is probed, not slept on:
+Redis must answer PING with the password of conf/redis/redis.conf, and a SIC service
+must print the "Started component manager" line the SIC framework itself waits for.
+A service that exits, or does not get ready in time, is restarted with exponential
+backoff. A Redis that is already running is used as is.
+
+Once everything is ready, the startup time of every service is reported: the wait for
+its dependencies, the time to spawn the process, and the time until the probe passed.
+
+Usage:
+    python utils/service_supervisor.py                             # redis and dialogflow_cx
+    python utils/service_supervisor.py --services redis dialogflow_cx whisper
+    python utils/service_supervisor.py --log-dir logs/services     # also write the output per service
+
+Stop with Ctrl-C; the services are stopped with it.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+REDIS_DIR = os.path.join(REPO_ROOT, "conf", "redis")
+
+# Reuse how the performance scripts read conf/redis/redis.conf and connect to Redis
+sys.path.insert(0, os.path.join(REPO_ROOT, "demos", "performance_scripts"))
+from scene_checkpoint import connect_redis  # noqa: E402
+
+# Printed by a SIC component manager once it accepts requests (sic_framework.core.utils)
+SIC_READY_TEXT = "Started component manager"
+
+# A service that ran this long is considered healthy again, its backoff is reset
+HEALTHY_AFTER = 60.0
+
+
+def redis_command():
+    # The repository ships redis-server.exe for Windows
+    if os.name == "nt" and os.path.exists(os.path.join(REDIS_DIR, "redis-server.exe")):
+        return [os.path.join(REDIS_DIR, "redis-server.exe"), "redis.conf"]
+    return ["redis-server", "redis.conf"]
+
+
+def redis_ready():
+    """Return True if the Redis of conf/redis/redis.conf answers PING."""
+    try:
+        # No client retries: a Redis that is not running fails the probe at once
+        return connect_redis(timeout=0.5, retries=0).ping()
+    except Exception:
+        return False
+
+
+# name -> command, working directory, services it needs, and readiness probe
+# (None: wait for SIC_READY_TEXT in the output)
+SERVICES = {
+    "redis": {"command": redis_command, "cwd": REDIS_DIR, "needs": [], "probe": redis_ready},
+    "dialogflow_cx": {"command": lambda: ["run-dialogflow-cx"], "cwd": REPO_ROOT, "needs": ["redis"],
+                      "probe": None},
+    "whisper": {"command": lambda: ["run-whisper"], "cwd": REPO_ROOT, "needs": ["redis"], "probe": None},
+}
+
+
+class Service(object):
+    """
+    One supervised service process.
+
+    Args:
+        name: Key of SERVICES.
+        spec: The SERVICES entry.
+        log_dir: Directory for the output of the service, or None to only print it.
+    """
+
+    def __init__(self, name, spec, log_dir=None):
+        self.name = name
+        self.spec = spec
+        self.log_path = os.path.join(log_dir, name + ".log") if log_dir else None
+        self.process = None
+        self.ready = threading.Event()
+        self.external = False
+        self.restarts = 0
+        self.started_at = None
+        # Startup breakdown of the first start (seconds since the supervisor started)
+        self.timeline = {}
+        self._output_ready = threading.Event()
+
+    def start(self, t0):
+        command = self.spec["command"]()
+        if shutil.which(command[0]) is None and not os.path.exists(command[0]):
+            raise OSError("{} not found, is it installed and on the PATH?".format(command[0]))
+        self._output_ready.clear()
+        self.timeline.setdefault("spawn", time.time() - t0)
+        self.process = subprocess.Popen(
+            command, cwd=self.spec["cwd"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL, universal_newlines=True, bufsize=1)
+        self.started_at = time.time()
+        self.timeline.setdefault("spawned", time.time() - t0)
+        threading.Thread(target=self._read_output, args=(self.process,), daemon=True).start()
+
+    def _read_output(self, process):
+        log = open(self.log_path, "a") if self.log_path else None
+        try:
+            for line in process.stdout:
+                if SIC_READY_TEXT in line:
+                    self._output_ready.set()
+                if log is not None:
+                    log.write(line)
+                    log.flush()
+                print("[{}] {}".format(self.name, line.rstrip()))
+        finally:
+            if log is not None:
+                log.close()
+
+    def probe(self):
+        if self.spec["probe"] is not None:
+            return self.spec["probe"]()
+        return self._output_ready.is_set()
+
+    @property
+    def running(self):
+        return self.external or (self.process is not None and self.process.poll() is None)
+
+    def stop(self, timeout=5.0):
+        if self.process is None or self.process.poll() is not None:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+class Supervisor(object):
+    """
+    Starts the services in dependency order, probes their readiness and restarts them when they exit.
+
+    Args:
+        services: List of Service.
+        ready_timeout: Seconds a service may take to get ready before it is restarted.
+        max_backoff: Longest wait between two restarts of a service.
+    """
+
+    def __init__(self, services, ready_timeout=60.0, max_backoff=30.0):
+        self.services = {service.name: service for service in services}
+        self.ready_timeout = ready_timeout
+        self.max_backoff = max_backoff
+        self.stop_event = threading.Event()
+        self.t0 = time.time()
+
+    def _supervise(self, service):
+        backoff = 1.0
+        for need in service.spec["needs"]:
+            while not self.services[need].ready.wait(0.1):
+                if self.stop_event.is_set():
+                    return
+        service.timeline.setdefault("needs_ready", time.time() - self.t0)
+
+        if service.probe():
+            # e.g. a Redis that was started earlier
+            service.external = True
+            service.timeline.update(spawn=time.time() - self.t0, spawned=time.time() - self.t0,
+                                    ready=time.time() - self.t0)
+            service.ready.set()
+            print("[supervisor] {} was already running".format(service.name))
+            return
+
+        while not self.stop_event.is_set():
+            try:
+                service.start(self.t0)
+            except OSError as e:
+                print("[supervisor] could not start {}: {}".format(service.name, e))
+                return
+            deadline = time.time() + self.ready_timeout
+            while not self.stop_event.is_set() and service.running and time.time() < deadline:
+                if service.probe():
+                    service.timeline.setdefault("ready", time.time() - self.t0)
+                    service.ready.set()
+                    print("[supervisor] {} ready after {:.2f}s".format(
+                        service.name, time.time() - service.started_at))
+                    break
+                time.sleep(0.05)
+            else:
+                if not self.stop_event.is_set() and service.running:
+                    print("[supervisor] {} not ready within {:.0f}s".format(service.name, self.ready_timeout))
+
+            while not self.stop_event.is_set() and service.running and service.ready.is_set():
+                if time.time() - service.started_at > HEALTHY_AFTER:
+                    backoff = 1.0
+                self.stop_event.wait(0.5)
+            if self.stop_event.is_set():
+                return
+
+            code = service.process.poll()
+            service.stop()
+            service.ready.clear()
+            service.restarts += 1
+            print("[supervisor] {} {}, restarting in {:.0f}s".format(
+                service.name, "exited with code {}".format(code) if code is not None else "was not ready", backoff))
+            if self.stop_event.wait(backoff):
+                return
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def run(self):
+        threads = [threading.Thread(target=self._supervise, args=(service,), daemon=True)
+                   for service in self.services.values()]
+        for thread in threads:
+            thread.start()
+        try:
+            while not all(service.ready.is_set() for service in self.services.values()):
+                if not any(thread.is_alive() for thread in threads):
+                    print("[supervisor] not every service could be started")
+                    return 1
+                time.sleep(0.05)
+            self.report()
+            print("[supervisor] all services ready, Ctrl-C to stop them")
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop_event.set()
+            for service in reversed(list(self.services.values())):
+                service.stop()
+        return 0
+
+    def report(self):
+        print("=" * 80)
+        print("STARTUP (seconds since the supervisor started)")
+        print("  {:<16} {:>12} {:>10} {:>10} {:>10}".format("service", "deps ready", "spawn", "probe", "ready at"))
+        for service in self.services.values():
+            t = service.timeline
+            print("  {:<16} {:>12.2f} {:>10.2f} {:>10.2f} {:>10.2f}{}".format(
+                service.name, t.get("needs_ready", 0.0), t.get("spawned", 0.0) - t.get("spawn", 0.0),
+                t.get("ready", 0.0) - t.get("spawned", 0.0), t.get("ready", 0.0),
+                "  (already running)" if service.external else ""))
+        print("  {:<16} {:>47.2f}".format("total", max(s.timeline.get("ready", 0.0) for s in self.services.values())))
+        print("=" * 80)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Start and supervise the local services of the show.")
+    parser.add_argument("--services", nargs="+", default=["redis", "dialogflow_cx"], choices=sorted(SERVICES),
+                        help="Services to run (their dependencies are added)")
+    parser.add_argument("--ready-timeout", type=float, default=60.0,
+                        help="Seconds a service may take to get ready before it is restarted")
+    parser.add_argument("--log-dir", help="Also write the output of every service to <log-dir>/<service>.log")
+    args = parser.parse_args()
+
+    names = []
+    for name in args.services:
+        for needed in SERVICES[name]["needs"] + [name]:
+            if needed not in names:
+                names.append(needed)
+    if args.log_dir and not os.path.isdir(args.log_dir):
+        os.makedirs(args.log_dir)
+
+    supervisor = Supervisor([Service(name, SERVICES[name], args.log_dir) for name in names],
+                            ready_timeout=args.ready_timeout)
+    return supervisor.run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())